@@ -1,22 +1,168 @@
-# backup_to_csv.py
+"""
+boatrace_data.db のバックアップ（SQLite のオンラインバックアップ + gzip + 世代管理）
 
+    python backup_to_csv.py              # スナップショットを取って古いものを整理
+    python backup_to_csv.py --verify [ファイル]   # 最新（または指定）のスナップショットを検査
+    python backup_to_csv.py --list       # 保存されているスナップショットの一覧
+
+sqlite3 のバックアップ API で読み込みトランザクション1つ分の一貫した内容を写す。
+WAL なので、取っている間もアプリからの保存は止まらない（ファイルのコピーと違い書き込み途中の状態を拾わない）。
+写したものを PRAGMA quick_check で確かめてから gzip で backups/daily/ に保存し、
+週の最初の1つは backups/weekly/ にも残す。日次は KEEP_DAILY 個、週次は KEEP_WEEKLY 個まで残す。
+（CSV への書き出しは export_to_csv.py）
+"""
+import datetime
+import gzip
+import os
+import shutil
 import sqlite3
-import pandas as pd
-from datetime import datetime
+import sys
+import tempfile
+import time
+
+import db
+
+BACKUP_DIR = os.path.join(db.BASE_DIR, "backups")
+DAILY_DIR = os.path.join(BACKUP_DIR, "daily")
+WEEKLY_DIR = os.path.join(BACKUP_DIR, "weekly")
+
+# 残す世代数
+KEEP_DAILY = 7
+KEEP_WEEKLY = 4
+
+PREFIX = "boatrace_data_"
+SUFFIX = ".db.gz"
+
+
+def daily_name(day):
+    return f"{PREFIX}{day.isoformat()}{SUFFIX}"
+
+
+def weekly_name(day):
+    year, week, _ = day.isocalendar()
+    return f"{PREFIX}{year}-W{week:02d}{SUFFIX}"
+
+
+def quick_check(path):
+    """PRAGMA quick_check の結果（問題なければ "ok"）"""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return "\n".join(row[0] for row in conn.execute("PRAGMA quick_check"))
+    finally:
+        conn.close()
+
+
+def snapshot(dest, source=None):
+    """DB の一貫したコピーを dest（非圧縮の .db）に作る"""
+    source = source or db.DB_FILE
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    dst = sqlite3.connect(dest)
+    try:
+        # 全ページを1ステップで写す（分けると他の接続の書き込みのたびに最初からやり直しになる）
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def _compress(src_path, dest_path):
+    tmp = dest_path + ".tmp"
+    with open(src_path, "rb") as src, gzip.open(tmp, "wb", compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    os.replace(tmp, dest_path)
+
+
+def _prune(directory, keep):
+    """名前順（= 日付順）で古いものから消して keep 個にする。消したファイル名を返す"""
+    names = list_snapshots(directory)
+    removed = names[:-keep] if keep else names
+    for name in removed:
+        os.remove(os.path.join(directory, name))
+    return removed
+
+
+def list_snapshots(directory):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(n for n in os.listdir(directory) if n.startswith(PREFIX) and n.endswith(SUFFIX))
+
+
+def create_backup(day=None, source=None):
+    """
+    スナップショットを取り、検査・圧縮して保存し、古い世代を消す。
+    {"daily", "weekly"（作らなかったら None）, "removed", "bytes"} を返す。検査で問題があれば RuntimeError
+    """
+    day = day or datetime.date.today()
+    os.makedirs(DAILY_DIR, exist_ok=True)
+    os.makedirs(WEEKLY_DIR, exist_ok=True)
+
+    with tempfile.TemporaryDirectory(dir=BACKUP_DIR) as work:
+        raw = os.path.join(work, "snapshot.db")
+        snapshot(raw, source)
+        result = quick_check(raw)
+        if result != "ok":
+            raise RuntimeError(f"スナップショットの検査に失敗しました: {result}")
+        daily = os.path.join(DAILY_DIR, daily_name(day))
+        _compress(raw, daily)
+
+    weekly = os.path.join(WEEKLY_DIR, weekly_name(day))
+    if os.path.exists(weekly):
+        weekly = None
+    else:
+        shutil.copyfile(daily, weekly)
+
+    removed = _prune(DAILY_DIR, KEEP_DAILY) + _prune(WEEKLY_DIR, KEEP_WEEKLY)
+    return {"daily": daily, "weekly": weekly, "removed": removed, "bytes": os.path.getsize(daily)}
+
+
+def latest_snapshot():
+    names = list_snapshots(DAILY_DIR)
+    return os.path.join(DAILY_DIR, names[-1]) if names else None
+
 
-# 日付付きファイル名を生成
-today = datetime.now().strftime("%Y-%m-%d")
-filename = f"boatrace_backup_{today}.csv"
+def verify(path):
+    """
+    圧縮済みスナップショットを展開して quick_check する（gzip の CRC もここで確かめられる）。
+    問題なければ "ok"、あればその内容を返す
+    """
+    with tempfile.TemporaryDirectory() as work:
+        raw = os.path.join(work, "verify.db")
+        try:
+            with gzip.open(path, "rb") as src, open(raw, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+        except (OSError, EOFError) as e:
+            return f"展開できません: {e}"
+        try:
+            return quick_check(raw)
+        except sqlite3.DatabaseError as e:
+            return f"DBとして開けません: {e}"
 
-# データベースに接続
-conn = sqlite3.connect("boatrace_data.db")
-df = pd.read_sql_query("SELECT * FROM records", conn)
-conn.close()
 
-# CSVとして保存
-df.to_csv(filename, index=False, encoding="utf-8-sig")
+if __name__ == "__main__":
+    args = sys.argv[1:]
 
-print(f"{filename} にバックアップを保存しました。")
+    if "--list" in args:
+        for directory in (DAILY_DIR, WEEKLY_DIR):
+            for name in list_snapshots(directory):
+                size = os.path.getsize(os.path.join(directory, name))
+                print(f"{os.path.basename(directory)}/{name}  {size / 1024 / 1024:.2f}MB")
+        sys.exit()
 
+    if "--verify" in args:
+        i = args.index("--verify")
+        path = args[i + 1] if i + 1 < len(args) else latest_snapshot()
+        if path is None:
+            print("スナップショットがありません")
+            sys.exit(1)
+        result = verify(path)
+        print(f"{path}: {result}")
+        sys.exit(0 if result == "ok" else 1)
 
-#バックアップのコマンドプロンプト　python backup_to_csv.py
+    started = time.monotonic()
+    backup = create_backup()
+    elapsed = time.monotonic() - started
+    print(f"{backup['daily']} にバックアップを保存しました（{backup['bytes'] / 1024 / 1024:.2f}MB, {elapsed:.1f}秒）")
+    if backup["weekly"]:
+        print(f"週次バックアップ: {backup['weekly']}")
+    for name in backup["removed"]:
+        print(f"古いバックアップを削除: {name}")
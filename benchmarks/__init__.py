@@ -0,0 +1,8 @@
+"""
+ベンチマーク（合成データでの主な処理の計測）
+
+    python -m benchmarks [--rows 10000] [--iterations 200] ...   # 詳しくは benchmarks/__main__.py
+
+  - synthetic.py: 実データの分布をもとにした合成データ（race_data・選手・出走表・狙い目リスト・展開パターン辞書）
+  - hotpaths.py: 計測する処理（保存・選手データの読み込み・狙い目リストの日別表示・展開の表示）
+"""
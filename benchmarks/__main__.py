@@ -0,0 +1,301 @@
+"""
+ベンチマークの実行
+
+    python -m benchmarks [--rows 10000] [--iterations 200] [--seed 1] [--only 名前,名前]
+                         [--db ファイル] [--source ファイル] [--json ファイル] [--plans]
+                         [--save-baseline] [--tolerance 0.5]
+
+合成データ（synthetic.py, 1万〜500万行）を一時DBに作り、hotpaths.py の処理を1つずつ計測する。
+  - 1回ごとの時間の p50 / p95 / p99 / 最大（ミリ秒）と1秒あたりの回数
+  - tracemalloc で測ったピークメモリ（MEMORY_ITERATIONS 回分）
+  - 1回分で流れたSQLの EXPLAIN QUERY PLAN（大きなテーブルの全件スキャンは警告。--plans で全部表示）
+--db を付けるとそのファイルに作って残し、次回は同じ行数・seed なら作り直さずに使う。
+
+結果は benchmarks/baselines/rows{行数}.json の基準値と比べ、p50 / p95 / ピークメモリが許容幅
+（--tolerance, 既定 50%）を超えて悪くなった処理や、全件スキャンが増えた処理があれば終了コード 1 で終わる。
+--save-baseline で今回の結果を基準値として保存する（マシンごとの値なので、マシンを変えたら取り直す）。
+"""
+import datetime
+import json
+import os
+import platform
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import db
+import watchlist
+from benchmarks import hotpaths, synthetic
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+DEFAULT_ROWS = 10000
+DEFAULT_ITERATIONS = 200
+WARMUP = 5
+MEMORY_ITERATIONS = 10
+TOLERANCE = 0.5
+
+# これより小さい差は誤差とみなす（ミリ秒 / KiB）
+NOISE_MS = 0.5
+NOISE_KIB = 256
+
+# 全件スキャンを警告するテーブル（行数がデータ量に比例して増えるもの）
+LARGE_TABLES = ["race_data", "race_summary", "race_summary_rival", "racecards"]
+
+# 計画を取る文（BEGIN・PRAGMA・トリガーの中の文は除く）
+PLAN_STATEMENTS = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+def option(args, name, default, convert=str):
+    if name not in args:
+        return default
+    return convert(args[args.index(name) + 1])
+
+
+def use_database(path, list_path):
+    """db・watchlist の読み書き先をベンチマーク用のファイルに向ける（以前の JSON の取り込みはしない）"""
+    db.close_connection()
+    db.DB_FILE = path
+    db.RACECARD_JSON_DIR = os.path.join(os.path.dirname(path), "__none__")
+    db.SCENARIO_JSON_FILE = db.RACECARD_JSON_DIR
+    watchlist.LIST_FILE = list_path
+    watchlist.LOG_FILE = list_path + ".log.jsonl"
+    watchlist.LOCK_FILE = list_path + ".lock"
+
+
+def prepare(path, rows, seed, source):
+    """path に合成データを用意して、その情報を返す（同じ条件で作ったものがあれば使い回す）"""
+    info_path = path + ".bench.json"
+    list_path = path + ".manual_list.json"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    use_database(path, list_path)
+    wanted = {"rows_requested": rows, "seed": seed}
+    try:
+        with open(info_path, encoding="utf-8") as f:
+            info = json.load(f)
+    except (FileNotFoundError, ValueError):
+        info = None
+    if info and os.path.exists(path) and {k: info.get(k) for k in wanted} == wanted:
+        return {**info, "reused": True}
+
+    for stale in (path, path + "-wal", path + "-shm", list_path, info_path):
+        if os.path.exists(stale):
+            os.remove(stale)
+    started = time.perf_counter()
+    info = {**synthetic.generate(rows, seed, source, watchlist_path=list_path), **wanted}
+    info["seconds"] = time.perf_counter() - started
+    with open(info_path, "w", encoding="utf-8") as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+    return {**info, "reused": False}
+
+
+def make_context(info, source):
+    """hotpaths の factory に渡す ctx（出走表のある日の全レース・選手・実データのレース）"""
+    end = datetime.date.fromisoformat(info["end"])
+    cards = []
+    for d in range(synthetic.RACECARD_DAYS):
+        day = (end - datetime.timedelta(days=d)).strftime("%Y%m%d")
+        for (venue_name, race_number), racers in sorted(db.load_racecards_by_date(day).items()):
+            cards.append((day, venue_name, race_number, racers))
+    racers = [{"reg_no": reg_no, "name": name} for reg_no, name in db.fetchall("SELECT reg_no, name FROM racers ORDER BY reg_no")]
+    return {"end": info["end"], "templates": synthetic.load_templates(source), "racers": racers, "cards": cards}
+
+
+def query_plans(fn, i):
+    """fn(i) で流れたSQLごとの EXPLAIN QUERY PLAN（[{"sql", "plan": [detail, ...]}, ...]）"""
+    statements = []
+    conn = db.get_connection()
+    conn.set_trace_callback(statements.append)
+    try:
+        fn(i)
+    finally:
+        conn.set_trace_callback(None)
+
+    plans = {}
+    for sql in statements:
+        text = " ".join(sql.split())
+        if not text.upper().startswith(PLAN_STATEMENTS) or text in plans:
+            continue
+        try:
+            plans[text] = [row[3] for row in db.fetchall("EXPLAIN QUERY PLAN " + text)]
+        except sqlite3.Error as e:
+            plans[text] = [f"（計画を取れませんでした: {e}）"]
+    return [{"sql": sql, "plan": plan} for sql, plan in plans.items()]
+
+
+def full_scans(plans):
+    """計画のうち大きなテーブルの全件スキャン（"SCAN race_data" など）"""
+    return [
+        detail for p in plans for detail in p["plan"]
+        if any(detail.startswith(f"SCAN {table}") for table in LARGE_TABLES)
+    ]
+
+
+def run_case(factory, ctx, iterations):
+    """1つの処理を計測して結果の辞書を返す"""
+    fn = factory(ctx)
+    i = 0
+    for _ in range(WARMUP):
+        fn(i)
+        i += 1
+
+    times = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t = time.perf_counter()
+        fn(i)
+        times.append(time.perf_counter() - t)
+        i += 1
+    total = time.perf_counter() - started
+
+    tracemalloc.start()
+    try:
+        for _ in range(MEMORY_ITERATIONS):
+            fn(i)
+            i += 1
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    plans = query_plans(fn, i)
+    ms = np.array(times) * 1000
+    return {
+        "iterations": iterations,
+        "ops_per_sec": iterations / total,
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+        "peak_kib": peak / 1024,
+        "scans": len(full_scans(plans)),
+        "plans": plans,
+    }
+
+
+def baseline_path(rows):
+    return os.path.join(BASELINE_DIR, f"rows{rows}.json")
+
+
+def load_baseline(rows):
+    try:
+        with open(baseline_path(rows), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_baseline(rows, seed, results):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    baseline = {
+        "rows": rows,
+        "seed": seed,
+        "machine": platform.platform(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "cases": {
+            name: {key: round(r[key], 3) for key in ("p50_ms", "p95_ms", "peak_kib")} | {"scans": r["scans"]}
+            for name, r in results.items()
+        },
+    }
+    with open(baseline_path(rows), "w", encoding="utf-8") as f:
+        json.dump(baseline, f, ensure_ascii=False, indent=2)
+        f.write("\n")
+    return baseline_path(rows)
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """基準値より悪くなった項目を [(処理, 項目, 基準値, 今回), ...] で返す"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline["cases"].get(name)
+        if base is None:
+            continue
+        for key, noise in (("p50_ms", NOISE_MS), ("p95_ms", NOISE_MS), ("peak_kib", NOISE_KIB)):
+            if result[key] > base[key] * (1 + tolerance) and result[key] - base[key] > noise:
+                regressions.append((name, key, base[key], result[key]))
+        if result["scans"] > base.get("scans", 0):
+            regressions.append((name, "scans", base.get("scans", 0), result["scans"]))
+    return regressions
+
+
+def print_results(results, show_plans):
+    print(f"{'処理':<22}{'回数':>6}{'回/秒':>10}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'最大ms':>9}{'ピークKiB':>11}")
+    for name, r in results.items():
+        print(
+            f"{name:<22}{r['iterations']:>6}{r['ops_per_sec']:>10.1f}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}"
+            f"{r['p99_ms']:>9.2f}{r['max_ms']:>9.2f}{r['peak_kib']:>11.0f}"
+        )
+    for name, r in results.items():
+        for detail in full_scans(r["plans"]):
+            print(f"警告: {name} で全件スキャン: {detail}")
+        if show_plans:
+            print(f"\n[{name}] {hotpaths.CASES[name].__doc__}")
+            for p in r["plans"]:
+                print(f"  {p['sql'][:160]}")
+                for detail in p["plan"]:
+                    print(f"    {detail}")
+
+
+def main(args):
+    rows = option(args, "--rows", DEFAULT_ROWS, int)
+    iterations = option(args, "--iterations", DEFAULT_ITERATIONS, int)
+    seed = option(args, "--seed", 1, int)
+    source = option(args, "--source", synthetic.DEFAULT_SOURCE)
+    tolerance = option(args, "--tolerance", TOLERANCE, float)
+    only = option(args, "--only", None, lambda v: v.split(","))
+    unknown = set(only or []) - set(hotpaths.CASES)
+    if unknown:
+        print(f"不明な処理: {', '.join(sorted(unknown))}（{', '.join(hotpaths.CASES)}）")
+        return 2
+    names = [name for name in hotpaths.CASES if not only or name in only]
+
+    with tempfile.TemporaryDirectory() as work:
+        path = os.path.abspath(option(args, "--db", os.path.join(work, "bench.db")))
+        info = prepare(path, rows, seed, source)
+        if info["reused"]:
+            print(f"{path} を使います（{info['rows']}行 / {info['races']}レース / {info['racers']}人）")
+        else:
+            print(
+                f"合成データ: {info['rows']}行 / {info['races']}レース / {info['days']}日 / {info['racers']}人 / "
+                f"出走表 {info['racecards']}レース / 狙い目 {info['watchlist']}件 / 展開 {info['patterns']}パターン"
+                f"（{info['seconds']:.1f}秒, {info['rows'] / info['seconds']:.0f}行/秒）"
+            )
+        ctx = make_context(info, source)
+
+        results = {}
+        try:
+            for name in names:
+                results[name] = run_case(hotpaths.CASES[name], ctx, iterations)
+        finally:
+            # 使い回すDBを作ったときの状態に戻す
+            hotpaths.cleanup(ctx)
+            db.close_connection()
+
+    print_results(results, "--plans" in args)
+
+    if "--json" in args:
+        with open(option(args, "--json", None), "w", encoding="utf-8") as f:
+            json.dump({"data": info, "cases": results}, f, ensure_ascii=False, indent=2)
+
+    if "--save-baseline" in args:
+        print(f"基準値を保存しました: {save_baseline(rows, seed, results)}")
+        return 0
+
+    baseline = load_baseline(rows)
+    if baseline is None:
+        print(f"基準値がありません（--save-baseline で {baseline_path(rows)} に保存できます）")
+        return 0
+    regressions = compare(results, baseline, tolerance)
+    for name, key, base, now in regressions:
+        print(f"悪化: {name} {key} {base:.2f} → {now:.2f}")
+    if not regressions:
+        print(f"基準値（{os.path.basename(baseline_path(rows))}）から悪化した処理はありません")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,148 @@
+"""
+ベンチマークで計測する処理
+
+それぞれ factory(ctx) が「i 回目の1回分を実行する関数」を返す。ctx は __main__.py が作る
+{"end", "templates", "racers", "cards"} の辞書（cards は出走表のある日の (日付, 場, R, 選手) の並び）。
+画面（streamlit）を通さず、各ページが1回の実行で呼ぶ関数をそのまま呼ぶ。
+save_race は DB の内容を変える（集計キャッシュが無効になる）ので、最後に回るよう末尾に置いている。
+"""
+import datetime
+
+import db
+import kimari_stats
+import player_summary
+import watchlist
+from benchmarks import synthetic
+from racecard import VENUE_CODES
+
+CASES = {}
+
+# 開き直しを測るときに順に開くレース数（1レース最大12キーなので、集計キャッシュに収まる数）
+WARM_RACES = min(12, db.SUMMARY_CACHE_SIZE // 12)
+
+
+def case(name):
+    def register(factory):
+        CASES[name] = factory
+        return factory
+    return register
+
+
+def _entries(card):
+    """出走表1レース分を load_entries に渡す形にする（進入は枠なり）"""
+    _, _, _, racers = card
+    return [(r["name"], r["lane"], r["reg_no"]) for r in racers]
+
+
+@case("player_load_cold")
+def player_load_cold(ctx):
+    """選手データ: 6人分の集計（全期間）と比較表。キャッシュなし"""
+    cards = ctx["cards"]
+
+    def run(i):
+        db.clear_summary_cache()
+        entries = _entries(cards[i % len(cards)])
+        summary, _ = player_summary.load_entries(entries)
+        player_summary.compare_entries(entries, summary)
+    return run
+
+
+@case("player_load_warm")
+def player_load_warm(ctx):
+    """選手データ: 開いたことのあるレースの6人分の集計（全部キャッシュから。比較表は player_compare）"""
+    cards = ctx["cards"]
+    # 計測の前に WARM_RACES レース分を読んでおき、毎回キャッシュにあるキーだけを読む
+    db.clear_summary_cache()
+    for card in cards[:WARM_RACES]:
+        player_summary.load_entries(_entries(card))
+
+    def run(i):
+        player_summary.load_entries(_entries(cards[i % WARM_RACES]))
+    return run
+
+
+@case("player_compare")
+def player_compare(ctx):
+    """選手データ: 読み込んだ6人分の集計から比較表を作る"""
+    cards = ctx["cards"]
+    loaded = [(_entries(card), player_summary.load_entries(_entries(card))[0]) for card in cards[:WARM_RACES]]
+
+    def run(i):
+        entries, summary = loaded[i % len(loaded)]
+        player_summary.compare_entries(entries, summary)
+    return run
+
+
+@case("player_load_since")
+def player_load_since(ctx):
+    """選手データ: 集計期間「直近1年」（6人分の履歴を読んで groupby）"""
+    cards = ctx["cards"]
+    since = (datetime.date.fromisoformat(ctx["end"]) - datetime.timedelta(days=365)).isoformat()
+
+    def run(i):
+        entries = _entries(cards[i % len(cards)])
+        summary, _ = player_summary.load_entries(entries, since)
+        player_summary.compare_entries(entries, summary)
+    return run
+
+
+@case("day_view")
+def day_view(ctx):
+    """狙い目リスト: 1日分の出走表とリストの突き合わせ"""
+    days = sorted({date for date, _, _, _ in ctx["cards"]})
+
+    def run(i):
+        racecards = db.load_racecards_by_date(days[i % len(days)])
+        watchlist.build_day_view(racecards)
+    return run
+
+
+@case("scenario_view")
+def scenario_view(ctx):
+    """展開: 1つの展開のパターン一覧と出目の確率（集計はキャッシュから）"""
+    types = synthetic.SCENARIO_TYPES
+
+    def run(i):
+        selected_type = types[i % len(types)]
+        patterns = db.load_scenarios(selected_type)
+        stats = kimari_stats.get_stats()
+        kimari_stats.select(stats["type"]["coverage"], selected_type)
+        for pattern in patterns:
+            kimari_stats.select(stats["pattern"]["kimari"], pattern["id"])
+            kimari_stats.select(stats["pattern"]["coverage"], pattern["id"])
+    return run
+
+
+@case("scenario_stats_cold")
+def scenario_stats_cold(ctx):
+    """展開: 辞書が変わった直後の出目分布の集計（全パターン・全展開）"""
+    def run(i):
+        kimari_stats.compute_stats(kimari_stats.load_results())
+    return run
+
+
+@case("save_race")
+def save_race(ctx):
+    """data_rec.py の保存: 1レース6人分を1トランザクションで（集計テーブルのトリガー込み）"""
+    templates = ctx["templates"]
+    racers = ctx["racers"]
+    first_day = datetime.date.fromisoformat(ctx["end"]) + datetime.timedelta(days=1)
+    venues = list(VENUE_CODES)
+    per_day = len(venues) * synthetic.RACES_PER_VENUE
+
+    def run(i):
+        # 合成データより後の日付に1レースずつ新しく保存する
+        date = (first_day + datetime.timedelta(days=i // per_day)).isoformat()
+        venue_name = venues[i % per_day // synthetic.RACES_PER_VENUE]
+        race_number = i % synthetic.RACES_PER_VENUE + 1
+        template = templates[i % len(templates)]
+        entry = [racers[(i * 7 + k) % len(racers)] for k in range(len(template))]
+        db.save_race(date, venue_name, race_number, synthetic.race_rows(date, venue_name, race_number, template, entry))
+    return run
+
+
+def cleanup(ctx):
+    """save_race で足したレース（合成データより後の日付）を消す"""
+    with db.transaction() as conn:
+        conn.execute(db.BUMP_RACE_REV_SQL)
+        conn.execute("DELETE FROM race_data WHERE date > ?", (ctx["end"],))
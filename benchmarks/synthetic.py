@@ -0,0 +1,250 @@
+"""
+ベンチマーク用の合成データ
+
+動き・着順・2着/負けたコース・ST評価・補足項目は、手入力の実データ（boatrace_data_backup.db）の
+レースを1レース単位でそのまま使い回す（レース内の整合性と、コースごとの分布がそのまま残る）。
+選手（既定 1,600人）・日付・場・レース番号だけを合成する。
+
+  - race_data: 1日 VENUES_PER_DAY 場 × 12R を、行数に届くまで古い日付から順に書き込む
+  - racecards: 最後の RACECARD_DAYS 日分（進入は枠なり）
+  - 狙い目リスト: WATCHLIST_SIZE 件（manual_list.json の形式）
+  - 展開パターン辞書: 展開ごとに PATTERNS_PER_TYPE パターン・1パターン RESULTS_PER_PATTERN 出目
+
+書き込みは db の関数（upsert_race_rows・save_racecards など）を通すので、集計テーブルのトリガーも含めて
+アプリと同じ形の DB になる。呼び出す前に db.DB_FILE を書き込み先に向けておくこと。
+"""
+import datetime
+import json
+import math
+import os
+import random
+import shutil
+import tempfile
+
+import db
+from racecard import VENUE_CODES
+
+DEFAULT_SOURCE = os.path.join(db.BASE_DIR, "boatrace_data_backup.db")
+
+RACERS = 1600
+VENUES_PER_DAY = 12
+RACES_PER_VENUE = 12
+RACECARD_DAYS = 7
+WATCHLIST_SIZE = 300
+PATTERNS_PER_TYPE = 20
+RESULTS_PER_PATTERN = 8
+
+# upsert_race_rows に1回で渡す行数
+BATCH_SIZE = 20000
+
+# pages/展開.py の展開の種類
+SCENARIO_TYPES = [
+    "イン逃げ",
+    "2捲り", "2差し",
+    "3捲り", "3捲り差し",
+    "4捲り", "4捲り差し", "4差し",
+    "5捲り", "5捲り差し",
+    "6捲り", "6捲り差し"
+]
+
+# 苗字 40 × 名前 40 = 1,600通り
+SURNAMES = [
+    "佐藤", "鈴木", "高橋", "田中", "伊藤", "渡辺", "山本", "中村", "小林", "加藤",
+    "吉田", "山田", "佐々木", "山口", "松本", "井上", "木村", "林", "斎藤", "清水",
+    "山崎", "森", "池田", "橋本", "阿部", "石川", "山下", "中島", "石井", "小川",
+    "前田", "岡田", "長谷川", "藤田", "後藤", "近藤", "村上", "遠藤", "青木", "坂本",
+]
+GIVEN_NAMES = [
+    "翔", "大輔", "健太", "拓也", "祐介", "亮", "聡", "誠", "直樹", "和也",
+    "剛", "隆之", "竜也", "茂", "秀樹", "博之", "浩二", "雄一", "修", "達也",
+    "優", "陽介", "慎吾", "勝", "良太", "智之", "光", "勇人", "将太", "龍",
+    "恵", "麻衣", "美咲", "彩", "香織", "真由美", "遥", "舞", "瞳", "千尋",
+]
+BRANCHES = ["群馬", "埼玉", "東京", "静岡", "愛知", "三重", "福井", "滋賀", "大阪", "兵庫", "徳島", "香川", "岡山", "広島", "山口", "福岡", "佐賀", "長崎"]
+CLASSES = ["A1", "A2", "B1", "B2"]
+CLASS_WEIGHTS = [20, 20, 50, 10]
+
+# 3連単の出目（120通り）
+KIMARI = [f"{a}-{b}-{c}" for a in range(1, 7) for b in range(1, 7) for c in range(1, 7) if len({a, b, c}) == 3]
+
+# 実データのレースから使う列
+TEMPLATE_COLUMNS = ["course_in", "move", "second_place", "lost_to", "rank", "st_eval", "flags"]
+
+SELECT_TEMPLATES_SQL = f"""
+SELECT date, venue_name, race_number, {", ".join(TEMPLATE_COLUMNS)}
+FROM race_data
+ORDER BY date, venue_name, race_number, course_in
+"""
+
+
+def load_templates(source=DEFAULT_SOURCE):
+    """
+    実データのレースを [[{TEMPLATE_COLUMNS}, ...（コース順）], ...] で返す。
+    元のファイルには触らず、一時コピーを今のスキーマにしてから読む
+    """
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"分布の元にするDBがありません: {source}")
+    saved = db.DB_FILE
+    db.close_connection()
+    with tempfile.TemporaryDirectory() as work:
+        db.DB_FILE = os.path.join(work, "source.db")
+        shutil.copyfile(source, db.DB_FILE)
+        try:
+            rows = db.fetchall(SELECT_TEMPLATES_SQL)
+        finally:
+            db.close_connection()
+            db.DB_FILE = saved
+
+    races = {}
+    for date, venue_name, race_number, *values in rows:
+        races.setdefault((date, venue_name, race_number), []).append(dict(zip(TEMPLATE_COLUMNS, values)))
+    if not races:
+        raise ValueError(f"{source} にレースがありません")
+    return list(races.values())
+
+
+def make_racers(rng, count=RACERS):
+    """選手マスタの行（{RACER_COLUMNS}）を count 人分作る"""
+    names = [db.join_name(last, first) for last in SURNAMES for first in GIVEN_NAMES]
+    if count > len(names):
+        # 足りない分は名前に番号をつける
+        names += [f"{names[i % len(names)]}{i // len(names) + 1}" for i in range(len(names), count)]
+    rng.shuffle(names)
+    racers = []
+    for i, name in enumerate(names[:count]):
+        starts = rng.randint(40, 200)
+        first = rng.randint(0, starts // 3)
+        second = rng.randint(0, (starts - first) // 3)
+        racers.append({
+            "reg_no": 3000 + i,
+            "name": name,
+            "name_kana": "",
+            "name_norm": db.normalize_name(name),
+            "branch": rng.choice(BRANCHES),
+            "class": rng.choices(CLASSES, CLASS_WEIGHTS)[0],
+            "win_rate": round(rng.uniform(2.0, 8.5), 2),
+            "place_rate": round(rng.uniform(10.0, 70.0), 1),
+            "first_count": first,
+            "second_count": second,
+            "starts": starts,
+            "avg_st": round(rng.uniform(0.10, 0.22), 2),
+        })
+    return racers
+
+
+def race_rows(date, venue_name, race_number, template, racers):
+    """実データの1レースに選手を当てはめて race_data の行（RACE_WRITE_COLUMNS の並び）にする"""
+    rows = []
+    for row, racer in zip(template, racers):
+        values = {
+            "date": date,
+            "venue_name": venue_name,
+            "race_number": race_number,
+            "course_in": row["course_in"],
+            "player_name": racer["name"],
+            "move": row["move"],
+            "second_place": row["second_place"],
+            "lost_to": row["lost_to"],
+            "rank": row["rank"],
+            "st_eval": row["st_eval"],
+            "player_id": racer["reg_no"],
+            **{flag: int(bool(row["flags"] & bit)) for flag, bit in db.FLAG_BITS.items()},
+        }
+        rows.append(tuple(values[c] for c in db.RACE_WRITE_COLUMNS))
+    return rows
+
+
+def racecard_of(template, racers):
+    return [{"lane": row["course_in"], "name": r["name"], "reg_no": r["reg_no"]} for row, r in zip(template, racers)]
+
+
+def iter_races(rng, templates, racers, rows, end):
+    """
+    行数が rows に届くまで (日付, 場, レース番号, 実データのレース, 選手) を日付順に返す（ジェネレーター）。
+    最後の日が end になるように始まりの日を決める
+    """
+    per_day = sum(len(t) for t in templates) / len(templates) * VENUES_PER_DAY * RACES_PER_VENUE
+    days = max(1, math.ceil(rows / per_day))
+    venues = list(VENUE_CODES)
+    written = 0
+    for day in range(days):
+        date = (end - datetime.timedelta(days=days - 1 - day)).isoformat()
+        for k in range(VENUES_PER_DAY):
+            venue_name = venues[(day * 5 + k) % len(venues)]
+            for race_number in range(1, RACES_PER_VENUE + 1):
+                template = rng.choice(templates)
+                yield date, venue_name, race_number, template, rng.sample(racers, len(template))
+                written += len(template)
+                if written >= rows:
+                    return
+
+
+def write_watchlist(path, rng, racers, count=WATCHLIST_SIZE):
+    """狙い目リスト（manual_list.json の形式）を count 件書く"""
+    entries = []
+    for i, racer in enumerate(rng.sample(racers, min(count, len(racers)))):
+        entries.append({
+            "id": f"bench{i:05d}",
+            "name": racer["name"],
+            "lane": rng.randint(1, 6),
+            "note": rng.choice(["スタート早い", "まくり警戒", "差し巧い", "伸び型", "ターン鋭い"]),
+            "mark": rng.choice(["◯", "△"]),
+            "reg_no": racer["reg_no"],
+        })
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(entries, f, ensure_ascii=False, indent=2)
+    return len(entries)
+
+
+def write_scenarios(rng):
+    """展開パターン辞書を書き込み、パターン数を返す"""
+    count = 0
+    for scenario_type in SCENARIO_TYPES:
+        for p in range(PATTERNS_PER_TYPE):
+            picked = rng.sample(KIMARI, RESULTS_PER_PATTERN)
+            pattern_id = db.add_scenario_pattern(
+                scenario_type, f"パターン{p + 1}", f"要因{p + 1}", picked[0], rng.randint(1, 30)
+            )
+            for k in picked[1:]:
+                db.increment_scenario_result(pattern_id, k, rng.randint(1, 30))
+            count += 1
+    return count
+
+
+def generate(rows, seed=1, source=DEFAULT_SOURCE, end=None, watchlist_path=None):
+    """
+    今の db.DB_FILE に合成データを書き込み、
+    {"rows", "races", "racers", "days", "end", "racecards", "watchlist", "patterns"} を返す
+    """
+    rng = random.Random(seed)
+    end = end or datetime.date.today()
+    templates = load_templates(source)
+    racers = make_racers(rng)
+    db.upsert_racers([tuple(r[c] for c in db.RACER_COLUMNS) for r in racers])
+
+    first_card_day = (end - datetime.timedelta(days=RACECARD_DAYS - 1)).isoformat()
+    summary = {"rows": 0, "races": 0, "racers": len(racers), "days": 0, "racecards": 0}
+    batch = []
+    cards = []
+    last_date = None
+    for date, venue_name, race_number, template, entry in iter_races(rng, templates, racers, rows, end):
+        batch.extend(race_rows(date, venue_name, race_number, template, entry))
+        if date >= first_card_day:
+            cards.append((date.replace("-", ""), venue_name, race_number, racecard_of(template, entry)))
+        if date != last_date:
+            summary["days"] += 1
+            last_date = date
+        summary["races"] += 1
+        if len(batch) >= BATCH_SIZE:
+            summary["rows"] += db.upsert_race_rows(batch, overwrite=True)
+            batch.clear()
+    if batch:
+        summary["rows"] += db.upsert_race_rows(batch, overwrite=True)
+    db.save_racecards(cards)
+    summary["racecards"] = len(cards)
+
+    # 行数が早めに届いたときは end より前の日で終わる
+    summary["end"] = last_date
+    summary["watchlist"] = write_watchlist(watchlist_path, rng, racers) if watchlist_path else 0
+    summary["patterns"] = write_scenarios(rng)
+    return summary
@@ -0,0 +1,121 @@
+"""
+選手データページのグラフ（plotly の円グラフの作成・キャッシュと、軽量表示用の棒グラフのデータ）
+
+円グラフは (グラフの種類, 選手, コース, 集計期間, 詳細, race_data の版数) をキーにして図を使い回す。
+レースが保存されると db.race_rev() が変わるので、古い図は使われずに押し出される
+（出走表の先読みなど race_data 以外の書き込みでは作り直さない）。
+図の JSON の大きさ（ブラウザに送る量の目安）も作ったときに一緒に測っておく。
+streamlit には依存しない。
+"""
+import threading
+from collections import OrderedDict
+
+import plotly.express as px
+
+import db
+
+# 動き・コースの色（app全体で共通化して使えるように）
+COLOR_MAP = {
+    # ①（1コース）
+    "逃げ": "blue",
+    "差され": "green",
+    "捲り差され": "yellow",
+    "捲られ": "red",
+
+    # ②〜⑥共通（色分類に基づいて設定）
+    "差し": "green",
+    "2外見て差し":"green",
+    "4外見て差し":"green",
+    "外マイ": "indianred",
+    "ジカマ": "firebrick",
+    "ツケマイ": "tomato",
+    "箱捲り": "tomato",
+    "絞り捲り": "lightcoral",
+    "叩いて外マイ": "crimson",
+
+    "捲り差し": "khaki",
+    "後手捲り差し": "goldenrod",
+    "叩いて捲り差し": "khaki",
+    "1-2捲り差し": "gold",
+    "2-4捲り差し": "goldenrod",
+    "捲り差し・外マイ": "goldenrod",
+
+    "2捲り展開": "rebeccapurple",
+    "3捲り展開": "rebeccapurple",
+    "4捲り展開": "rebeccapurple",
+    "5捲り展開": "rebeccapurple",
+    "3ツケマイ展開": "rebeccapurple",
+    "3絞り展開": "slateblue",
+    "4絞り展開": "slateblue",
+    "5絞り展開": "slateblue",
+    "展開差し・捲り差し": "thistle",
+    "他艇捲り展開": "thistle",
+    "展開捲り差し・外マイ": "thistle",
+    "展開差し・捲り差し・外マイ": "thistle",
+
+    "3捲り差され": "darkgray",
+    "捲られ・叩かれ": "gray",
+    "ブロック負け": "lightgray",
+    "2外被り": "lightgray",
+    "3差し被り": "lightgray",
+    "4外被り": "lightgray",
+    "5差し被り": "lightgray",
+    "5捲り差され": "darkgray",
+    "後手": "darkslategray",
+
+    "2": "black",
+    "3": "red",
+    "4": "blue",
+    "5": "yellow",
+    "6": "green",
+    "記録なし": "gray"
+}
+
+# 円グラフのキャッシュ（6人 × 数種類 × 数レース分）
+FIGURE_CACHE_SIZE = 128
+_figure_cache = OrderedDict()
+_figure_lock = threading.Lock()
+
+
+def _build_pie(frame, names, values, title, hole, show_labels):
+    fig = px.pie(
+        frame,
+        names=names,
+        values=values,
+        title=title,
+        hole=hole,
+        color=names,
+        color_discrete_map=COLOR_MAP,
+    )
+    if show_labels:
+        fig.update_traces(textinfo="percent+label")  # ← 割合とラベルを表示
+    return fig
+
+
+def pie(key, frame, names, values, title, hole=0.4, show_labels=False):
+    """
+    円グラフを (図, JSON のバイト数) で返す。
+    key は frame の中身を決める値のタプル（種類・選手・コース・期間など）で、race_data の版数と合わせてキャッシュのキーにする
+    """
+    cache_key = (*key, db.race_rev())
+    with _figure_lock:
+        if cache_key in _figure_cache:
+            _figure_cache.move_to_end(cache_key)
+            return _figure_cache[cache_key]
+
+    fig = _build_pie(frame, names, values, title, hole, show_labels)
+    result = (fig, len(fig.to_json().encode("utf-8")))
+    with _figure_lock:
+        _figure_cache[cache_key] = result
+        while len(_figure_cache) > FIGURE_CACHE_SIZE:
+            _figure_cache.popitem(last=False)
+    return result
+
+
+def bar_data(frame, names, values):
+    """
+    軽量表示（st.bar_chart）用のデータを (DataFrame, JSON のバイト数) で返す。
+    plotly の図と違って値の列だけを送るので、遅い回線でも軽い
+    """
+    data = frame[[names, values]].astype({names: str})
+    return data, len(data.to_json(orient="split").encode("utf-8"))
@@ -3,11 +3,14 @@
 """
 import streamlit as st
 import requests
-from bs4 import BeautifulSoup
 import datetime
 import sqlite3
-import os
-import json
+
+import db
+import export_to_csv
+import perf
+import prefetch
+import racecard
 
 move_options = [
     "ジカマ", "捲り", "差し", "捲り差し", "ツケマイ", "絞り捲り", "叩いて捲り差し", "1－2捲り差し",
@@ -139,60 +142,17 @@ sashi_shortcuts = {
 
 
 
+perf.start("データ記録")
+
 # レース番号の初期化（セッションに保持）
 if "race_number" not in st.session_state:
     st.session_state["race_number"] = 1
 race_number = st.session_state["race_number"]
 
-# --- オフライン用の読み込み関数 ---
-def load_local_racecard(date_str, venue_name, race_number):
-    file_name = f"{date_str}_{venue_name}_{race_number:02}.json"
-    file_path = os.path.join("local_racecards", file_name)
-
-    if os.path.exists(file_path):
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return [entry["name"] for entry in data]
-    else:
-        return None
-
 st.title("選手データ記録")
 
-# SQLite接続とテーブル作成
-conn = sqlite3.connect('boatrace_data.db')
-cursor = conn.cursor()
-
-# 選手データを保存するテーブルを作成
-cursor.execute('''
-CREATE TABLE IF NOT EXISTS race_data (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    date TEXT,
-    venue_name TEXT,
-    race_number INTEGER,
-    course_in INTEGER,
-    player_name TEXT,
-    move TEXT,
-    second_place INTEGER,
-    lost_to INTEGER,
-    rank INTEGER,
-    flow INTEGER,
-    cabi INTEGER,
-    kawarizensoku INTEGER,
-    attack INTEGER,
-    pressure INTEGER,
-    block INTEGER,
-    three_hari INTEGER,
-    three_makurizashi INTEGER,
-    two_nokoshi INTEGER,
-    four_tsubushi INTEGER,
-    four_nokoshi INTEGER,
-    st_eval TEXT,
-    two_shizumase INTEGER,
-    four_shizumase INTEGER,
-    makurizashi_flow_cabi
-)
-''')
-conn.commit()
+# DB接続（接続とテーブル作成はプロセスごとに1回だけ）
+db.get_connection()
 
 # 会場情報
 venues = {
@@ -215,30 +175,16 @@ with col1:
 with col2:
     race_number = st.selectbox("レースを選択", list(range(1, 13)), index=st.session_state["race_number"] - 1)
 
-venue_code = venues[venue_name]
-url = f"https://www.boatrace.jp/owpc/pc/race/racelist?rno={race_number}&jcd={venue_code}&hd={date_str}"
-
-
-@st.cache_data(ttl=3600)
-def get_racer_names(url, date_str, venue_name, race_number):
-    #  まずローカルに出走表があるか確認
-    local_data = load_local_racecard(date_str, venue_name, race_number)
-    if local_data:
-        return local_data
 
-    #  なければオンラインで取得
+@perf.timed("出走表")
+def get_racer_names(date_str, venue_name, race_number):
+    # ローカル保存 → ディスクキャッシュ（http_cache.db）→ オンラインの順に探す
     try:
-        res = requests.get(url)
-        res.raise_for_status()
-        soup = BeautifulSoup(res.content, "html.parser")
-        name_tags = soup.select("div.is-fs18.is-fBold a")
-
-        if not name_tags:
+        racer_names = racecard.load_racer_names(date_str, venue_name, race_number)
+        if not racer_names:
             # オンラインでも選手名が取得できない（ページ構成変化 or 未公開）
             st.warning("出走表が見つかりませんでした（ローカルにもオンラインにもありません）")
-            return []
-
-        return [tag.text.strip() for tag in name_tags]
+        return racer_names
 
     except requests.exceptions.RequestException as e:
         st.warning("通信エラーが発生しました（オフラインとみなします）")
@@ -253,7 +199,7 @@ def get_racer_names(url, date_str, venue_name, race_number):
         return []
 
 # 先に関数としてリセット処理を定義しておく
-def reset_shortcut_and_course_states(date_str, race_number, venue_name, url):
+def reset_shortcut_and_course_states(date_str, race_number, venue_name):
     # --- ショートカットセレクトのリセット ---
     st.session_state["nige_choice"] = "---"
     st.session_state["makuri_choice"] = "---"
@@ -267,7 +213,7 @@ def reset_shortcut_and_course_states(date_str, race_number, venue_name, url):
         st.session_state[f"course_pos_{i}"] = i + 1
 
     # --- 選手ごとのステート初期化 ---
-    racer_names = get_racer_names(url, date_str, venue_name, race_number)
+    racer_names = get_racer_names(date_str, venue_name, race_number)
     for i, name in enumerate(racer_names, start=1):
         key_prefix = f"{date_str}_{race_number}_{name}"
         keys_to_clear = [
@@ -288,12 +234,16 @@ if "prev_date_str" not in st.session_state:
 
 # レース or 日付が変わったらリセット
 if st.session_state.prev_race_number != race_number or st.session_state.prev_date_str != date_str:
-    reset_shortcut_and_course_states(date_str, race_number, venue_name, url)
+    reset_shortcut_and_course_states(date_str, race_number, venue_name)
     st.session_state.prev_race_number = race_number
     st.session_state.prev_date_str = date_str
 
 
-racer_names = get_racer_names(url, date_str, venue_name, race_number)
+racer_names = get_racer_names(date_str, venue_name, race_number)
+
+# 入力・閲覧している間に次のレースの出走表と選手データを先読みしておく
+if racer_names and race_number < 12:
+    prefetch.prefetch_race(date_str, venue_name, race_number + 1)
 
 try:
     if racer_names:
@@ -480,7 +430,7 @@ try:
 
             # 進入コースごとの処理
             if course_in == 1:
-                move = st.selectbox("動き", ["逃げ", "差され", "捲られ", "捲り差され", "抜かれ"], key=f"{key_prefix}_move_{i}")
+                move = st.selectbox("動き", db.MOVE_CHOICES[1], key=f"{key_prefix}_move_{i}")
                 if move == "逃げ":
                     second_place = st.selectbox("2着の艇番", [2, 3, 4, "記録なし"], key=f"{key_prefix}_second_{i}")
                     additional_data["2着"] = second_place
@@ -501,7 +451,7 @@ try:
                 additional_data["3張"] = three_hari
 
             elif course_in == 2:
-                move = st.selectbox("動き", ["差し", "外マイ", "ジカマ", "ツケマイ", "3捲り差され", "捲られ・叩かれ", "ブロック負け", "3ツケマイ展開"], key=f"{key_prefix}_move_{i}")
+                move = st.selectbox("動き", db.MOVE_CHOICES[2], key=f"{key_prefix}_move_{i}")
                 additional_data["動き"] = move
                 rank = st.selectbox("着順", ["着外", "1", "2", "3"], key=f"{key_prefix}_rank_{i}")
                 additional_data["着順"] = rank
@@ -521,7 +471,7 @@ try:
                 additional_data["3捲り差し1着"] = three_makurizashi
 
             elif course_in == 3:
-                move = st.selectbox("動き", ["外マイ", "絞り捲り", "ツケマイ", "箱捲り", "捲り差し", "後手捲り差し", "差し", "2外見て差し", "2捲り展開", "展開差し・捲り差し", "2外被り", "捲られ・叩かれ", "ブロック負け"], key=f"{key_prefix}_move_{i}")
+                move = st.selectbox("動き", db.MOVE_CHOICES[3], key=f"{key_prefix}_move_{i}")
                 additional_data["動き"] = move
                 rank = st.selectbox("着順", ["着外", "1", "2", "3"], key=f"{key_prefix}_rank_{i}")
                 additional_data["着順"] = rank
@@ -546,7 +496,7 @@ try:
                 additional_data["捲り差し流れ・キャビ"] = makurizashi_flow_cabi
 
             elif course_in == 4:
-                move = st.selectbox("動き", ["差し", "捲り差し", "外マイ", "捲り", "叩いて捲り差し", "叩いて外マイ", "2捲り展開", "3捲り展開", "3絞り展開", "3ツケマイ展開", "展開捲り差し・外マイ", "3差し被り", "5捲り差され", "捲られ・叩かれ", "ブロック負け", "後手"], key=f"{key_prefix}_move_{i}")
+                move = st.selectbox("動き", db.MOVE_CHOICES[4], key=f"{key_prefix}_move_{i}")
                 additional_data["動き"] = move
                 rank = st.selectbox("着順", ["着外", "1", "2", "3"], key=f"{key_prefix}_rank_{i}")
                 additional_data["着順"] = rank
@@ -563,7 +513,7 @@ try:
                 additional_data["圧"] = pressure              
 
             elif course_in == 5:
-                move = st.selectbox("動き", ["1-2捲り差し", "2-4捲り差し", "外マイ", "差し", "4外見て差し", "捲り", "叩いて捲り差し", "叩いて外マイ", "他艇捲り展開", "4捲り展開", "4絞り展開", "3ツケマイ展開", "展開差し・捲り差し・外マイ", "4外被り", "捲られ・叩かれ", "ブロック負け", "後手"], key=f"{key_prefix}_move_{i}")
+                move = st.selectbox("動き", db.MOVE_CHOICES[5], key=f"{key_prefix}_move_{i}")
                 additional_data["動き"] = move
                 rank = st.selectbox("着順", ["着外", "1", "2", "3"], key=f"{key_prefix}_rank_{i}")
                 additional_data["着順"] = rank
@@ -585,7 +535,7 @@ try:
 
 
             elif course_in == 6:
-                move = st.selectbox("動き", ["差し", "捲り差し・外マイ", "捲り", "叩いて捲り差し", "叩いて外マイ", "他艇捲り展開", "4捲り展開", "5捲り展開", "5絞り展開", "展開差し・捲り差し・外マイ", "5差し被り", "ブロック負け", "後手"], key=f"{key_prefix}_move_{i}")
+                move = st.selectbox("動き", db.MOVE_CHOICES[6], key=f"{key_prefix}_move_{i}")
                 additional_data["動き"] = move
                 rank = st.selectbox("着順", ["着外", "1", "2", "3"], key=f"{key_prefix}_rank_{i}")
                 additional_data["着順"] = rank
@@ -613,57 +563,56 @@ try:
 
         # Submit button to save the data into SQLite
         if st.button("保存"):
-            for record in record_data:
-                cursor.execute('''
-                    SELECT COUNT(*) FROM race_data
-                    WHERE player_name = ? AND race_number = ? AND venue_name = ? AND date = ?
-                ''', (record["選手名"], race_number, venue_name, date.isoformat()))
-                count = cursor.fetchone()[0]
-
-                if count == 0:
-                    cursor.execute('''
-                        INSERT INTO race_data (
-                            date, venue_name, race_number, course_in, player_name, move, second_place,
-                            lost_to, rank,
-                            flow, cabi, kawarizensoku, attack, pressure, block, three_hari,
-                            three_makurizashi, two_nokoshi, four_tsubushi, four_nokoshi, st_eval, two_shizumase, four_shizumase, makurizashi_flow_cabi
-                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                    ''', (
-                        date.isoformat(),
-                        venue_name,
-                        race_number,
-                        record["進入コース"],
-                        record["選手名"],
-                        record["動き"],
-                        record.get("2着", None),
-                        record.get("負けたコース", None),
-                        record.get("着順", None),
-
-                        # 以下、補足項目（未入力は0）
-
-                        int(record.get("流れ", 0)),
-                        int(record.get("キャビ", 0)),
-                        int(record.get("かわり全速", 0)),
-                        int(record.get("攻め", 0)),
-                        int(record.get("圧", 0)),
-                        int(record.get("捲りブロック", 0)),
-                        int(record.get("3張", 0)),
-                        int(record.get("3捲り差し1着", 0)),
-                        int(record.get("2残し", 0)),
-                        int(record.get("4潰し", 0)),
-                        int(record.get("4残し", 0)),
-                        record["ST評価"],
-                        int(record.get("2沈ませ", 0)),
-                        int(record.get("4沈ませ", 0)),
-                        int(record.get("捲り差し流れ・キャビ", 0))
-                    ))
-                    conn.commit()
+            player_ids = racecard.load_player_ids(date_str, venue_name, race_number)
+            rows = [
+                (
+                    date.isoformat(),
+                    venue_name,
+                    race_number,
+                    record["進入コース"],
+                    record["選手名"],
+                    record["動き"],
+                    record.get("2着", None),
+                    record.get("負けたコース", None),
+                    record.get("着順", None),
+
+                    # 以下、補足項目（未入力は0）
+
+                    int(record.get("流れ", 0)),
+                    int(record.get("キャビ", 0)),
+                    int(record.get("かわり全速", 0)),
+                    int(record.get("攻め", 0)),
+                    int(record.get("圧", 0)),
+                    int(record.get("捲りブロック", 0)),
+                    int(record.get("3張", 0)),
+                    int(record.get("3捲り差し1着", 0)),
+                    int(record.get("2残し", 0)),
+                    int(record.get("4潰し", 0)),
+                    int(record.get("4残し", 0)),
+                    record["ST評価"],
+                    int(record.get("2沈ませ", 0)),
+                    int(record.get("4沈ませ", 0)),
+                    int(record.get("捲り差し流れ・キャビ", 0)),
+                    player_ids.get(record["選手名"])  # 登録番号（出走表のリンクから）
+                )
+                for record in record_data
+            ]
+
+            # 全選手分を1トランザクションで保存（保存済みのレースは上書き）
+            try:
+                with perf.stage("保存"):
+                    existing = db.save_race(date.isoformat(), venue_name, race_number, rows)
+            except sqlite3.Error as e:
+                st.error(f"保存に失敗しました（このレースは保存されていません）: {e}")
+            else:
+                if existing:
+                    st.success("保存済みのデータを上書きしました")
                 else:
-                    st.warning(f"{record['選手名']}のデータはすでに保存されています。")
-            st.success("データが保存されました")
+                    st.success("データが保存されました")
+                # CSV も裏で差分だけ更新しておく（画面は待たない）
+                export_to_csv.schedule_export()
 
 except requests.exceptions.RequestException as e:
     st.error(f"データの取得に失敗しました: {e}")
 
-# SQLite接続を閉じる
-conn.close()
\ No newline at end of file
+perf.finish()
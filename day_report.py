@@ -0,0 +1,302 @@
+"""
+1日分の選手データの一括出力（夜のうちに全レース分を作っておく）
+
+    python day_report.py 日付 [--days 365] [--workers 4] [--out フォルダ] [--force]
+
+その日の出走表（racecards テーブル。先に save_racecard.py で保存しておく）の全場・全レースについて、
+選手データページと同じ集計（6選手の比較表と、1人ずつの動きの傾向・相手コース・補足項目・ST評価）を
+reports/{日付}/{場}_{R}.json と .html に書き出し、一覧の index.html / index.json を作る。
+  - 進入コースは枠なりとする（prefetch.py の先読みと同じ）
+  - --days を付けると集計をその日から数えて直近 N 日に絞る（選手データページの「集計期間」）
+  - 円グラフは出さず、グラフの元になる回数・割合を表で出す
+
+レースは ProcessPoolExecutor でプロセスに分けて作る（1レース = 1タスク。ファイルの書き込みも各プロセスで）。
+各プロセスは自分の接続で読むだけで、DBには書き込まない。
+前回の出力と race_data の版数（db.race_rev）・出走表・集計期間が同じレースは作り直さない（--force で全部作り直す）。
+"""
+import datetime
+import html
+import json
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import db
+import player_summary
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+REPORT_DIR = os.path.join(BASE_DIR, "reports")
+
+# 比較表で割合として表示する列
+PERCENT_COLUMNS = ["1着率", "2連対率", "3連対率", "抜出", "出遅"]
+
+STYLE = """
+body { font-family: sans-serif; margin: 24px; }
+table { border-collapse: collapse; margin: 8px 0 16px; }
+th, td { border: 1px solid #ccc; padding: 4px 8px; text-align: right; }
+th { background: #f0f0f0; }
+td:first-child, th:first-child { text-align: left; }
+hr { margin: 40px 0; border: 0.5px solid #000; }
+.note { color: #666; }
+"""
+
+
+def option(args, name, default, convert=str):
+    if name not in args:
+        return default
+    return convert(args[args.index(name) + 1])
+
+
+def report_name(venue_name, race_number):
+    return f"{venue_name}_{race_number}"
+
+
+def _write_text(path, text):
+    # 書きかけのファイルを開かれないよう、書き終えてから置き換える
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def _records(df):
+    """DataFrame を JSON に書ける行のリストにする（NaN は None）"""
+    if df is None:
+        return None
+    return [
+        {k: None if isinstance(v, float) and math.isnan(v) else v for k, v in row.items()}
+        for row in df.to_dict("records")
+    ]
+
+
+def race_report(date_str, venue_name, race_number, racers, since=None):
+    """1レース分の選手データの集計を辞書で返す（racers は db.load_racecards_by_date の1レース分）"""
+    entries = [(r["name"], r["lane"], r["reg_no"]) for r in racers]
+    all_summary, all_rivals = player_summary.load_entries(entries, since)
+    report = {
+        "date": date_str,
+        "venue_name": venue_name,
+        "race_number": race_number,
+        "since": since,
+        "compare": _records(player_summary.compare_entries(entries, all_summary)),
+        "racers": [],
+    }
+    for i, (name, course_in, reg_no) in enumerate(entries):
+        summary, rivals = player_summary.select_entry(all_summary, all_rivals, i)
+        summary = summary[summary["count"] > 0]
+        movement = player_summary.movement_table(summary)
+        racer = {"lane": i + 1, "name": name, "reg_no": reg_no, "course": course_in, "movement": _records(movement)}
+        if not summary.empty:
+            # 相手コースの内訳はページと同じく1コースのときだけ
+            if course_in == 1:
+                racer["rivals"] = {
+                    move: _records(table)
+                    for move in movement["動き"]
+                    if (table := player_summary.rival_table(rivals, move)) is not None and not table.empty
+                }
+            racer["supplement"] = _records(player_summary.supplement_table(summary, course_in))
+            racer["st"] = _records(player_summary.st_table(summary))
+        report["racers"].append(racer)
+    return report
+
+
+# --- HTML ---
+
+def _table_html(rows, columns=None, percent=()):
+    if not rows:
+        return "<p class='note'>データがありません。</p>"
+    columns = columns or list(rows[0])
+    head = "".join(f"<th>{html.escape(str(c))}</th>" for c in columns)
+    body = []
+    for row in rows:
+        cells = []
+        for c in columns:
+            value = row.get(c)
+            if value is None:
+                text = ""
+            elif c in percent:
+                text = f"{value * 100:.1f}%"
+            else:
+                text = str(value)
+            cells.append(f"<td>{html.escape(text)}</td>")
+        body.append(f"<tr>{''.join(cells)}</tr>")
+    return f"<table><tr>{head}</tr>{''.join(body)}</table>"
+
+
+def _page(title, body):
+    return (
+        f"<!DOCTYPE html>\n<html lang='ja'><head><meta charset='utf-8'><title>{html.escape(title)}</title>"
+        f"<style>{STYLE}</style></head><body>{body}</body></html>\n"
+    )
+
+
+def race_html(report):
+    title = f"{report['venue_name']} {report['race_number']}R 選手データ"
+    period = f"{report['since']} 以降" if report["since"] else "全期間"
+    parts = [
+        "<p><a href='index.html'>一覧へ</a></p>",
+        f"<h2>{html.escape(title)}</h2>",
+        f"<p class='note'>{report['date']} / 集計期間: {period} / 進入は枠なり</p>",
+        "<h3>6選手の比較</h3>",
+        _table_html(report["compare"], player_summary.COMPARE_COLUMNS, PERCENT_COLUMNS),
+    ]
+    for racer in report["racers"]:
+        parts.append("<hr>")
+        parts.append(f"<h2>{racer['lane']}号艇　{html.escape(racer['name'])}（{racer['course']}コース）</h2>")
+        if not racer["movement"]:
+            parts.append("<p class='note'>データがありません。</p>")
+            continue
+        parts.append("<h4>動きの傾向</h4>")
+        parts.append(_table_html(racer["movement"]))
+        for move, rows in racer.get("rivals", {}).items():
+            parts.append(f"<h4>{html.escape(move)}: {html.escape(list(rows[0])[0])}</h4>")
+            parts.append(_table_html(rows))
+        if racer.get("supplement") is not None:
+            parts.append("<h4>補足項目</h4>")
+            parts.append(_table_html(racer["supplement"]))
+        parts.append("<h4>ST評価</h4>")
+        parts.append(_table_html(racer["st"]))
+    return _page(title, "".join(parts))
+
+
+def index_html(date_str, races):
+    venues = {}
+    for race in races:
+        venues.setdefault(race["venue_name"], {})[race["race_number"]] = race
+    head = "".join(f"<th>{n}R</th>" for n in range(1, 13))
+    rows = []
+    for venue_name, by_number in venues.items():
+        cells = []
+        for n in range(1, 13):
+            race = by_number.get(n)
+            cells.append(f"<td><a href='{html.escape(race['html'])}'>{n}R</a></td>" if race else "<td></td>")
+        rows.append(f"<tr><td>{html.escape(venue_name)}</td>{''.join(cells)}</tr>")
+    body = f"<h2>{date_str} 選手データ</h2><table><tr><th>場</th>{head}</tr>{''.join(rows)}</table>"
+    return _page(f"{date_str} 選手データ", body)
+
+
+# --- 出力 ---
+
+def _init_worker(db_file):
+    # プロセスごとに自分の接続を開く（親で開いた接続は引き継がない）
+    db.close_connection()
+    db.DB_FILE = db_file
+
+
+def build_race(out_dir, date_str, venue_name, race_number, racers, since, rev):
+    """1レース分を集計して JSON と HTML を書く（プロセスプールのタスク）"""
+    report = race_report(date_str, venue_name, race_number, racers, since)
+    report["race_rev"] = rev
+    report["card"] = racers
+    name = report_name(venue_name, race_number)
+    _write_text(os.path.join(out_dir, name + ".json"), json.dumps(report, ensure_ascii=False, indent=1))
+    _write_text(os.path.join(out_dir, name + ".html"), race_html(report))
+    return venue_name, race_number
+
+
+def is_current(path, since, rev, racers):
+    """前回の出力が同じ版数・集計期間・出走表から作ったものか"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            report = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return False
+    return report.get("race_rev") == rev and report.get("since") == since and report.get("card") == racers
+
+
+def build_day(date_str, out_dir=None, days=None, workers=None, force=False):
+    """
+    その日の全レースを書き出し、{"races", "built", "skipped", "failed", "out_dir"} を返す。
+    workers が 1 のときはプロセスを分けずにこのプロセスで作る
+    """
+    date_str = date_str.replace("-", "")
+    out_dir = out_dir or os.path.join(REPORT_DIR, date_str)
+    cards = db.load_racecards_by_date(date_str)
+    if not cards:
+        return {"races": 0, "built": 0, "skipped": 0, "failed": 0, "out_dir": out_dir}
+    os.makedirs(out_dir, exist_ok=True)
+    since = None
+    if days:
+        since = (datetime.datetime.strptime(date_str, "%Y%m%d").date() - datetime.timedelta(days=days)).isoformat()
+
+    rev = db.race_rev()
+    races = [
+        {"venue_name": venue_name, "race_number": race_number,
+         "json": report_name(venue_name, race_number) + ".json", "html": report_name(venue_name, race_number) + ".html"}
+        for venue_name, race_number in sorted(cards)
+    ]
+    tasks = [
+        (venue_name, race_number) for venue_name, race_number in sorted(cards)
+        if force or not is_current(
+            os.path.join(out_dir, report_name(venue_name, race_number) + ".json"), since, rev, cards[(venue_name, race_number)]
+        )
+    ]
+    summary = {"races": len(races), "built": 0, "skipped": len(races) - len(tasks), "failed": 0, "out_dir": out_dir}
+
+    def done(count, venue_name, race_number, error=None):
+        if error is None:
+            summary["built"] += 1
+            print(f"[{count}/{len(tasks)}] {venue_name}{race_number}R 作成完了")
+        else:
+            summary["failed"] += 1
+            print(f"[{count}/{len(tasks)}] {venue_name}{race_number}R 作成失敗: {error}")
+
+    if tasks and (workers or os.cpu_count() or 1) > 1:
+        # 子プロセスに接続を持ち込まないよう、プールを作る前に閉じておく
+        db.close_connection()
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(db.DB_FILE,)) as executor:
+            futures = {
+                executor.submit(build_race, out_dir, date_str, venue_name, race_number, cards[(venue_name, race_number)], since, rev):
+                (venue_name, race_number)
+                for venue_name, race_number in tasks
+            }
+            for count, future in enumerate(as_completed(futures), start=1):
+                try:
+                    future.result()
+                    done(count, *futures[future])
+                except Exception as e:
+                    done(count, *futures[future], error=e)
+    else:
+        for count, (venue_name, race_number) in enumerate(tasks, start=1):
+            try:
+                build_race(out_dir, date_str, venue_name, race_number, cards[(venue_name, race_number)], since, rev)
+                done(count, venue_name, race_number)
+            except Exception as e:
+                done(count, venue_name, race_number, error=e)
+
+    index = {
+        "date": date_str,
+        "since": since,
+        "race_rev": rev,
+        "generated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "races": races,
+    }
+    _write_text(os.path.join(out_dir, "index.json"), json.dumps(index, ensure_ascii=False, indent=1))
+    _write_text(os.path.join(out_dir, "index.html"), index_html(date_str, races))
+    return summary
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args or args[0].startswith("--"):
+        print(__doc__)
+        sys.exit(1)
+
+    started = time.monotonic()
+    result = build_day(
+        args[0],
+        out_dir=option(args, "--out", None),
+        days=option(args, "--days", None, int),
+        workers=option(args, "--workers", None, int),
+        force="--force" in args,
+    )
+    elapsed = time.monotonic() - started
+    if not result["races"]:
+        print(f"{args[0]} の出走表がありません（先に save_racecard.py で保存してください）")
+        sys.exit(1)
+    print(
+        f"完了: 作成 {result['built']}レース / 変更なし {result['skipped']}レース / "
+        f"失敗 {result['failed']}レース（{elapsed:.1f}秒）: {os.path.join(result['out_dir'], 'index.html')}"
+    )
@@ -0,0 +1,1428 @@
+"""
+SQLite データアクセス層
+
+data_rec.py・pages・メンテナンス用スクリプトはすべてここを経由して
+boatrace_data.db に接続する。接続はプロセスごとに1本だけ作って使い回し、
+PRAGMA の設定とテーブル作成（スキーマ確認）は最初の接続時に1回だけ行う。
+"""
+import os
+import re
+import json
+import sqlite3
+import unicodedata
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_FILE = os.path.join(BASE_DIR, "boatrace_data.db")
+
+# 以前の出走表の保存先（1レース1ファイルのJSON）。初回起動時に racecards へ取り込む
+RACECARD_JSON_DIR = os.path.join(BASE_DIR, "local_racecards")
+
+# 以前の展開パターン辞書（JSON）。初回起動時に scenario_patterns / scenario_results へ取り込む
+SCENARIO_JSON_FILE = os.path.join(BASE_DIR, "scenarios.json")
+
+# race_data のカラム（読み書きで使う並び）。
+# 補足項目はテーブル上では flags の1カラムにまとめて持つ（RACE_STORED_COLUMNS）。rev は db の中だけで扱う
+RACE_DATA_COLUMNS = [
+    "id", "date", "venue_name", "race_number", "course_in", "player_name", "move",
+    "second_place", "lost_to", "rank",
+    "flow", "cabi", "kawarizensoku", "attack", "pressure",
+    "block", "three_hari",
+    "three_makurizashi", "two_nokoshi", "four_tsubushi", "four_nokoshi", "st_eval",
+    "two_shizumase", "four_shizumase", "makurizashi_flow_cabi",
+    "player_id"
+]
+
+# 補足項目（0/1）のカラム
+FLAG_COLUMNS = [
+    "flow", "cabi", "kawarizensoku", "attack", "pressure",
+    "block", "three_hari",
+    "three_makurizashi", "two_nokoshi", "four_tsubushi", "four_nokoshi",
+    "two_shizumase", "four_shizumase", "makurizashi_flow_cabi"
+]
+
+# 動きの選択肢（進入コース別。data_rec.py の入力欄と import_results.py の取り込みで共通）
+MOVE_CHOICES = {
+    1: ["逃げ", "差され", "捲られ", "捲り差され", "抜かれ"],
+    2: ["差し", "外マイ", "ジカマ", "ツケマイ", "3捲り差され", "捲られ・叩かれ", "ブロック負け", "3ツケマイ展開"],
+    3: ["外マイ", "絞り捲り", "ツケマイ", "箱捲り", "捲り差し", "後手捲り差し", "差し", "2外見て差し", "2捲り展開", "展開差し・捲り差し", "2外被り", "捲られ・叩かれ", "ブロック負け"],
+    4: ["差し", "捲り差し", "外マイ", "捲り", "叩いて捲り差し", "叩いて外マイ", "2捲り展開", "3捲り展開", "3絞り展開", "3ツケマイ展開", "展開捲り差し・外マイ", "3差し被り", "5捲り差され", "捲られ・叩かれ", "ブロック負け", "後手"],
+    5: ["1-2捲り差し", "2-4捲り差し", "外マイ", "差し", "4外見て差し", "捲り", "叩いて捲り差し", "叩いて外マイ", "他艇捲り展開", "4捲り展開", "4絞り展開", "3ツケマイ展開", "展開差し・捲り差し・外マイ", "4外被り", "捲られ・叩かれ", "ブロック負け", "後手"],
+    6: ["差し", "捲り差し・外マイ", "捲り", "叩いて捲り差し", "叩いて外マイ", "他艇捲り展開", "4捲り展開", "5捲り展開", "5絞り展開", "展開差し・捲り差し・外マイ", "5差し被り", "ブロック負け", "後手"],
+}
+
+# 補足項目 → flags のビット（並びを変えると既存の行の意味が変わるので、追加は末尾にだけ行う）
+FLAG_BITS = {flag: 1 << i for i, flag in enumerate(FLAG_COLUMNS)}
+
+# テーブル上のカラム（補足項目の代わりに flags）
+RACE_STORED_COLUMNS = [c for c in RACE_DATA_COLUMNS if c not in FLAG_COLUMNS] + ["flags"]
+
+
+def flag_mask(flags):
+    """補足項目名のリストをビットマスクにする（["flow", "cabi"] → 0b11）"""
+    mask = 0
+    for flag in flags:
+        mask |= FLAG_BITS[flag]
+    return mask
+
+
+def flag_sql(flag, table=None):
+    """flags から1つの補足項目（0/1）を取り出すSQL式"""
+    column = f"{table}.flags" if table else "flags"
+    return f"(({column} >> {FLAG_BITS[flag].bit_length() - 1}) & 1)"
+
+
+# 接続ごとに1回だけ流す設定
+PRAGMAS = [
+    "PRAGMA journal_mode = WAL",      # 読み込み中でも書き込みをブロックしない
+    "PRAGMA synchronous = NORMAL",    # WAL では NORMAL で十分安全
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",     # 約16MB
+    "PRAGMA foreign_keys = ON",
+]
+
+# 同じSQL文字列は sqlite3 側でプリペアドステートメントとして再利用される
+STATEMENT_CACHE_SIZE = 128
+
+
+def _race_data_table_sql(name, extra_columns=()):
+    """race_data のテーブル定義（作り直し用に名前と以前のDBにだけあるカラムを指定できる）"""
+    extra = "".join(f",\n    {column}" for column in extra_columns)
+    return f"""
+CREATE TABLE IF NOT EXISTS {name} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT,
+    venue_name TEXT,
+    race_number INTEGER,
+    course_in INTEGER,
+    player_name TEXT,
+    move TEXT,
+    second_place INTEGER,
+    lost_to INTEGER,
+    rank INTEGER,
+    st_eval TEXT,
+    player_id INTEGER,
+    flags INTEGER NOT NULL DEFAULT 0,
+    rev INTEGER{extra}
+)
+"""
+
+
+CREATE_RACE_DATA_SQL = _race_data_table_sql("race_data")
+
+# 1レース・1選手につき1行（保存し直したときは上書き）。
+# 選手は登録番号で見分け、登録番号のない行だけ名前で見分ける（名前の表記が変わっても同じ行になる）
+RACE_PLAYER_KEY_SQL = "COALESCE(player_id, player_name)"
+RACE_KEY_COLUMNS = ["date", "venue_name", "race_number", RACE_PLAYER_KEY_SQL]
+
+CREATE_RACE_KEY_INDEX_SQL = f"""
+CREATE UNIQUE INDEX IF NOT EXISTS ux_race_data_race_player
+ON race_data ({", ".join(RACE_KEY_COLUMNS)})
+"""
+
+# ユニークインデックス作成前に重複行を1行（最後に保存した行）に寄せる
+DEDUPE_RACE_DATA_SQL = f"""
+DELETE FROM race_data WHERE id NOT IN (
+    SELECT MAX(id) FROM race_data GROUP BY {", ".join(RACE_KEY_COLUMNS)}
+)
+"""
+
+# 保存時に書き込むカラム（id 以外）。save_race などに渡す行はこの並び
+RACE_WRITE_COLUMNS = RACE_DATA_COLUMNS[1:]
+RACE_STORED_WRITE_COLUMNS = RACE_STORED_COLUMNS[1:]
+# RACE_WRITE_COLUMNS の各カラムの番号つきパラメーター（?N）
+_WRITE_PARAM = {c: f"?{i}" for i, c in enumerate(RACE_WRITE_COLUMNS, start=1)}
+
+
+def _race_write_values():
+    """
+    RACE_WRITE_COLUMNS の並びのパラメーターを RACE_STORED_WRITE_COLUMNS の値にする式。
+    補足項目は番号つきパラメーター（?N）をビットにして flags に詰める
+    """
+    flags = " | ".join(
+        f"((COALESCE({_WRITE_PARAM[flag]}, 0) != 0) << {bit.bit_length() - 1})" for flag, bit in FLAG_BITS.items()
+    )
+    return [flags if c == "flags" else _WRITE_PARAM[c] for c in RACE_STORED_WRITE_COLUMNS]
+
+
+# 補足項目を名前つきのカラムに戻した並び（RACE_DATA_COLUMNS）
+RACE_DATA_SELECT = ", ".join(
+    f"{flag_sql(c)} AS {c}" if c in FLAG_BITS else c for c in RACE_DATA_COLUMNS
+)
+
+# race_data 全件の読み込み（補足項目は名前つきのカラム。rev を含めない）
+SELECT_RACE_DATA_SQL = f"SELECT {RACE_DATA_SELECT} FROM race_data"
+
+# テーブル上の形のまま読む（補足項目は flags のまま）
+SELECT_RACE_STORED_SQL = f"SELECT {', '.join(RACE_STORED_COLUMNS)} FROM race_data"
+
+# 手で調べるとき用に、補足項目を名前つきのカラムで見せるビュー
+CREATE_RACE_DATA_NAMED_VIEW_SQL = f"""
+CREATE VIEW IF NOT EXISTS race_data_named AS {SELECT_RACE_DATA_SQL}
+"""
+
+# 小さな設定値・カウンター（キー → 整数）
+CREATE_META_SQL = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID
+"""
+
+# --- 変更の版数（差分エクスポート用） ---
+# race_data に書き込むトランザクションごとに race_data_rev を1増やし、書き込んだ行の rev に入れる。
+# 「rev > 前回エクスポートした版数」の行だけ読めば追加・更新分が分かる。削除は race_data_deleted に残す
+RACE_REV_KEY = "race_data_rev"
+CURRENT_RACE_REV_SQL = f"(SELECT value FROM meta WHERE key = '{RACE_REV_KEY}')"
+BUMP_RACE_REV_SQL = f"UPDATE meta SET value = value + 1 WHERE key = '{RACE_REV_KEY}'"
+
+CREATE_RACE_REV_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_race_data_rev ON race_data (rev)
+"""
+
+CREATE_RACE_DELETED_SQL = """
+CREATE TABLE IF NOT EXISTS race_data_deleted (
+    id INTEGER PRIMARY KEY,
+    rev INTEGER NOT NULL
+)
+"""
+
+CREATE_RACE_DELETED_TRIGGER_SQL = f"""
+CREATE TRIGGER IF NOT EXISTS race_data_deleted_ad AFTER DELETE ON race_data BEGIN
+    INSERT OR REPLACE INTO race_data_deleted (id, rev) VALUES (OLD.id, {CURRENT_RACE_REV_SQL});
+END
+"""
+
+UPSERT_RACE_DATA_SQL = f"""
+INSERT INTO race_data ({", ".join(RACE_STORED_WRITE_COLUMNS)}, rev)
+VALUES ({", ".join(_race_write_values())}, {CURRENT_RACE_REV_SQL})
+ON CONFLICT ({", ".join(RACE_KEY_COLUMNS)}) DO UPDATE SET
+{", ".join(f"{c} = excluded.{c}" for c in RACE_STORED_WRITE_COLUMNS if c not in RACE_KEY_COLUMNS)},
+rev = excluded.rev
+"""
+
+
+# 同じレースにその登録番号の行がもうあるか（登録番号はレースのキーなので、あれば付けられない）
+def _race_has_player_id_sql(reg_no):
+    return f"""EXISTS (
+    SELECT 1 FROM race_data AS e
+    WHERE e.date = race_data.date AND e.venue_name = race_data.venue_name
+    AND e.race_number = race_data.race_number AND e.player_id = {reg_no}
+    )"""
+
+
+# 名前だけで記録済みの行に、これから書く行の登録番号を付ける（書き込み前に流して同じ行として上書きさせる）。
+# そのレースに同じ登録番号の行がもうあるときは付けない。パラメーターは RACE_WRITE_COLUMNS の並びの1行
+ADOPT_PLAYER_ID_SQL = f"""
+UPDATE race_data SET player_id = {_WRITE_PARAM["player_id"]}, rev = {CURRENT_RACE_REV_SQL}
+WHERE date = {_WRITE_PARAM["date"]} AND venue_name = {_WRITE_PARAM["venue_name"]}
+AND race_number = {_WRITE_PARAM["race_number"]}
+AND player_id IS NULL AND player_name = {_WRITE_PARAM["player_name"]}
+AND {_WRITE_PARAM["player_id"]} IS NOT NULL
+AND NOT {_race_has_player_id_sql(_WRITE_PARAM["player_id"])}
+"""
+
+# 一括取り込み用（記録済みのレース・選手は手入力の内容を残してそのまま）
+INSERT_RACE_DATA_IF_NEW_SQL = f"""
+INSERT INTO race_data ({", ".join(RACE_STORED_WRITE_COLUMNS)}, rev)
+VALUES ({", ".join(_race_write_values())}, {CURRENT_RACE_REV_SQL})
+ON CONFLICT ({", ".join(RACE_KEY_COLUMNS)}) DO NOTHING
+"""
+
+COUNT_RACE_ROWS_SQL = """
+SELECT COUNT(*) FROM race_data
+WHERE date = ? AND venue_name = ? AND race_number = ?
+"""
+
+# 選手データページで使う選手・進入コース別の検索用インデックス
+CREATE_PLAYER_COURSE_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_race_data_player_course_date
+ON race_data (player_name, course_in, date)
+"""
+# 登録番号（player_id）での検索用。名前の表記ゆれに左右されない
+CREATE_PLAYER_ID_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_race_data_player_id_course_date
+ON race_data (player_id, course_in, date)
+"""
+
+# ※ 日付だけの検索は ux_race_data_race_player（date が先頭）で引ける
+
+# 選手データページの集計に必要なカラムだけ返す（補足項目は flags のまま。race_history.decode_flags で展開）
+PLAYER_COURSE_COLUMNS = [
+    "date", "course_in", "move", "second_place", "lost_to", "rank", "st_eval", "flags"
+]
+
+# 登録番号が分からない選手は名前で引く（登録番号のない行だけ。レースのキー・集計テーブルと同じ分け方）
+SELECT_PLAYER_COURSE_SQL = f"""
+SELECT {", ".join(PLAYER_COURSE_COLUMNS)} FROM race_data
+WHERE player_name = ? AND course_in = ? AND player_id IS NULL
+ORDER BY date DESC
+"""
+
+SELECT_PLAYER_COURSE_SINCE_SQL = f"""
+SELECT {", ".join(PLAYER_COURSE_COLUMNS)} FROM race_data
+WHERE player_name = ? AND course_in = ? AND date >= ? AND player_id IS NULL
+ORDER BY date DESC
+"""
+
+# 登録番号で引く。登録番号が埋まっていない古い行は名前で拾う（どちらもインデックスで引ける）
+SELECT_PLAYER_ID_COURSE_SQL = f"""
+SELECT {", ".join(PLAYER_COURSE_COLUMNS)} FROM race_data
+WHERE course_in = ? AND date >= ?
+AND (player_id = ? OR (player_id IS NULL AND player_name = ?))
+ORDER BY date DESC
+"""
+
+# 補足項目の組み合わせ（すべて当てはまる）の回数と全体の回数。(flags & mask) = mask のビット演算で数える
+COUNT_FLAG_COMBINATION_SQL = """
+SELECT COALESCE(SUM((flags & ?1) = ?1), 0), COUNT(*) FROM race_data
+WHERE player_name = ?2 AND course_in = ?3 AND date >= ?4 AND player_id IS NULL
+"""
+
+COUNT_FLAG_COMBINATION_ID_SQL = """
+SELECT COALESCE(SUM((flags & ?1) = ?1), 0), COUNT(*) FROM race_data
+WHERE course_in = ?3 AND date >= ?4
+AND (player_id = ?5 OR (player_id IS NULL AND player_name = ?2))
+"""
+
+# --- 選手・進入コース・動きごとの集計テーブル ---
+# race_data へのINSERT/UPDATE/DELETE のたびにトリガーで差分だけ更新するので、
+# 保存と同じトランザクションで常に最新になる。選手データページはここを読むだけ。
+# 選手はレースのキーと同じく登録番号で分ける。登録番号のある行は (player_id, '')、
+# ない行は (0, player_name) に集計する（summary_player_key）
+
+# 件数系のカラム（race_summary の move 以降の並び）
+SUMMARY_COUNT_COLUMNS = (
+    ["count", "win", "place2", "place3", "out"]
+    + FLAG_COLUMNS
+    + ["st_none", "st_nuke", "st_deoku", "st_other"]
+)
+SUMMARY_COLUMNS = ["move"] + SUMMARY_COUNT_COLUMNS
+
+# 1コースの詳細（逃げ→2着の相手、差され等→負けたコース）
+RIVAL_COLUMNS = ["move", "kind", "rival", "count"]
+RIVAL_KINDS = ["second_place", "lost_to"]
+
+CREATE_SUMMARY_SQL = f"""
+CREATE TABLE IF NOT EXISTS race_summary (
+    player_id INTEGER NOT NULL,
+    player_name TEXT NOT NULL,
+    course_in INTEGER NOT NULL,
+    move TEXT NOT NULL,
+    {", ".join(f"{c} INTEGER NOT NULL DEFAULT 0" for c in SUMMARY_COUNT_COLUMNS)},
+    PRIMARY KEY (player_id, player_name, course_in, move)
+) WITHOUT ROWID
+"""
+
+CREATE_RIVAL_SQL = """
+CREATE TABLE IF NOT EXISTS race_summary_rival (
+    player_id INTEGER NOT NULL,
+    player_name TEXT NOT NULL,
+    course_in INTEGER NOT NULL,
+    move TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    rival TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (player_id, player_name, course_in, move, kind, rival)
+) WITHOUT ROWID
+"""
+
+
+def _rank_is(r, value):
+    # rank は INTEGER 型のカラムに "1" や "着外" が入るので文字列で比較
+    if value.isdigit():
+        return f"(TRIM(CAST({r}.rank AS TEXT)) IN ('{value}', '{value}.0'))"
+    return f"(TRIM(CAST({r}.rank AS TEXT)) = '{value}')"
+
+
+def _summary_values(r, packed=True):
+    """
+    race_data の1行（r）が集計テーブルの各カラムにいくつ足されるか（0/1）。
+    packed=False は補足項目が別々のカラムだった以前のテーブル用（マイグレーションの途中で使う）
+    """
+    values = {
+        "count": "1",
+        "win": f"({_rank_is(r, '1')} OR ({r}.course_in = 1 AND {r}.move = '逃げ'))",
+        "place2": _rank_is(r, "2"),
+        "place3": _rank_is(r, "3"),
+        "out": _rank_is(r, "着外"),
+    }
+    for flag in FLAG_COLUMNS:
+        values[flag] = flag_sql(flag, r) if packed else f"{r}.{flag}"
+    # ST評価は data_rec.py の3つの選択肢に分け、空（NULL）や選択肢にない値は st_other に数える
+    st_eval = f"COALESCE({r}.st_eval, '')"
+    values["st_nuke"] = f"({st_eval} LIKE '抜出%')"
+    values["st_deoku"] = f"({st_eval} LIKE '出遅%')"
+    values["st_none"] = f"(TRIM({st_eval}) = 'なし')"
+    values["st_other"] = f"NOT ({st_eval} LIKE '抜出%' OR {st_eval} LIKE '出遅%' OR TRIM({st_eval}) = 'なし')"
+    # NULL との比較は NULL になるので 0 に寄せる
+    return {c: f"COALESCE({v}, 0)" for c, v in values.items()}
+
+
+# 集計テーブルのキー（SUMMARY_KEY_COLUMNS の並びの式は _summary_key）
+SUMMARY_KEY_COLUMNS = ["player_id", "player_name", "course_in", "move"]
+
+
+def _summary_key(r):
+    return (
+        f"COALESCE({r}.player_id, 0), "
+        f"CASE WHEN {r}.player_id IS NULL THEN COALESCE({r}.player_name, '') ELSE '' END, "
+        f"COALESCE({r}.course_in, 0), COALESCE({r}.move, '')"
+    )
+
+
+def summary_player_key(player):
+    """登録番号（int）または選手名（str）→ 集計テーブルの (player_id, player_name)"""
+    if isinstance(player, str):
+        return 0, player
+    return player, ""
+
+
+def _summary_apply_sql(r, sign, packed=True):
+    """1行分を集計テーブルに足す（sign=1）/引く（sign=-1）SQL"""
+    values = _summary_values(r, packed)
+    cols = ", ".join(SUMMARY_COUNT_COLUMNS)
+    vals = ", ".join(f"{sign} * ({values[c]})" for c in SUMMARY_COUNT_COLUMNS)
+    updates = ", ".join(f"{c} = {c} + excluded.{c}" for c in SUMMARY_COUNT_COLUMNS)
+    summary_key = ", ".join(SUMMARY_KEY_COLUMNS)
+    sql = f"""
+        INSERT INTO race_summary ({summary_key}, {cols})
+        VALUES ({_summary_key(r)}, {vals})
+        ON CONFLICT ({summary_key}) DO UPDATE SET {updates};
+    """
+    for kind in RIVAL_KINDS:
+        sql += f"""
+        INSERT INTO race_summary_rival ({summary_key}, kind, rival, count)
+        SELECT {_summary_key(r)}, '{kind}', CAST({r}.{kind} AS TEXT), {sign}
+        WHERE {r}.{kind} IS NOT NULL AND {r}.{kind} != ''
+        ON CONFLICT ({summary_key}, kind, rival) DO UPDATE SET count = count + excluded.count;
+    """
+    if sign < 0:
+        # 0件になった行は消しておく
+        sql += f"""
+        DELETE FROM race_summary
+        WHERE ({summary_key}) = ({_summary_key(r)}) AND count <= 0;
+        DELETE FROM race_summary_rival
+        WHERE ({summary_key}) = ({_summary_key(r)}) AND count <= 0;
+    """
+    return sql
+
+
+SUMMARY_TRIGGER_NAMES = ["race_summary_ai", "race_summary_ad", "race_summary_au"]
+
+
+def _summary_trigger_sqls(packed=True):
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS race_summary_ai AFTER INSERT ON race_data BEGIN
+        {_summary_apply_sql("NEW", 1, packed)}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS race_summary_ad AFTER DELETE ON race_data BEGIN
+        {_summary_apply_sql("OLD", -1, packed)}
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS race_summary_au AFTER UPDATE ON race_data BEGIN
+        {_summary_apply_sql("OLD", -1, packed)}
+        {_summary_apply_sql("NEW", 1, packed)}
+        END""",
+    ]
+
+
+def _summary_backfill_sqls(packed=True):
+    """集計テーブルを作ったときに、既存の race_data から一括で作り直す"""
+    values = _summary_values("r", packed)
+    sums = ", ".join(f"SUM({values[c]})" for c in SUMMARY_COUNT_COLUMNS)
+    sqls = [
+        "DELETE FROM race_summary",
+        "DELETE FROM race_summary_rival",
+        f"""INSERT INTO race_summary ({", ".join(SUMMARY_KEY_COLUMNS + SUMMARY_COUNT_COLUMNS)})
+        SELECT {_summary_key("r")}, {sums} FROM race_data AS r
+        GROUP BY 1, 2, 3, 4""",
+    ]
+    for kind in RIVAL_KINDS:
+        sqls.append(f"""INSERT INTO race_summary_rival ({", ".join(SUMMARY_KEY_COLUMNS)}, kind, rival, count)
+        SELECT {_summary_key("r")}, '{kind}', CAST(r.{kind} AS TEXT), COUNT(*) FROM race_data AS r
+        WHERE r.{kind} IS NOT NULL AND r.{kind} != ''
+        GROUP BY 1, 2, 3, 4, 6""")
+    return sqls
+
+
+SELECT_SUMMARY_SQL = f"""
+SELECT {", ".join(SUMMARY_COLUMNS)} FROM race_summary
+WHERE player_id = ? AND player_name = ? AND course_in = ?
+ORDER BY count DESC
+"""
+
+SELECT_RIVAL_SQL = f"""
+SELECT {", ".join(RIVAL_COLUMNS)} FROM race_summary_rival
+WHERE player_id = ? AND player_name = ? AND course_in = ?
+ORDER BY count DESC
+"""
+
+
+def _pairs_match_sql(columns, count, extra=""):
+    """
+    (a, b) = (?, ?) OR (a, b) = (?, ?) ... の行値の比較（出走表の6人分などをまとめて1回で引く）。
+    IN (VALUES ...) だと全件走査になるが、OR でつなぐと1組ずつインデックスで引ける（MULTI-INDEX OR）
+    """
+    term = f"({extra}({', '.join(columns)}) = ({', '.join('?' for _ in columns)}))"
+    return " OR ".join(term for _ in range(count))
+
+
+# --- 出走表 ---
+# 日付は出走表ページと同じ YYYYMMDD。主キーが日付始まりなので日付ごとの一括読み込みは範囲検索で済む
+CREATE_RACECARDS_SQL = """
+CREATE TABLE IF NOT EXISTS racecards (
+    date TEXT NOT NULL,
+    venue_name TEXT NOT NULL,
+    race_number INTEGER NOT NULL,
+    lane INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    reg_no INTEGER,
+    PRIMARY KEY (date, venue_name, race_number, lane)
+) WITHOUT ROWID
+"""
+
+# 選手（登録番号）ごとの出走予定を引くためのインデックス
+CREATE_RACECARDS_REG_NO_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_racecards_reg_no ON racecards (reg_no, date)
+"""
+
+INSERT_RACECARD_SQL = """
+INSERT OR REPLACE INTO racecards (date, venue_name, race_number, lane, name, reg_no)
+VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+DELETE_RACECARD_SQL = """
+DELETE FROM racecards WHERE date = ? AND venue_name = ? AND race_number = ?
+"""
+
+SELECT_RACECARD_SQL = """
+SELECT lane, name, reg_no FROM racecards
+WHERE date = ? AND venue_name = ? AND race_number = ?
+ORDER BY lane
+"""
+
+SELECT_RACECARDS_BY_DATE_SQL = """
+SELECT venue_name, race_number, lane, name, reg_no FROM racecards
+WHERE date = ?
+ORDER BY venue_name, race_number, lane
+"""
+
+# --- 選手マスタ ---
+# 期別成績ファイル（extract_racers.py で取り込み）の選手情報。登録番号が主キー。
+# name は出走表と同じ表記、name_norm は空白を除いた名前（出走表・成績との照合用）
+RACER_COLUMNS = [
+    "reg_no", "name", "name_kana", "name_norm", "branch", "class",
+    "win_rate", "place_rate", "first_count", "second_count", "starts", "avg_st",
+]
+
+CREATE_RACERS_SQL = """
+CREATE TABLE IF NOT EXISTS racers (
+    reg_no INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    name_kana TEXT,
+    name_norm TEXT NOT NULL,
+    branch TEXT,
+    class TEXT,
+    win_rate REAL,
+    place_rate REAL,
+    first_count INTEGER,
+    second_count INTEGER,
+    starts INTEGER,
+    avg_st REAL
+)
+"""
+
+CREATE_RACERS_NAME_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_racers_name_norm ON racers (name_norm)
+"""
+
+# 内容が変わった選手だけ書き換える（期ごとに取り込み直しても変わらない行はそのまま）
+UPSERT_RACER_SQL = f"""
+INSERT INTO racers ({", ".join(RACER_COLUMNS)})
+VALUES ({", ".join("?" for _ in RACER_COLUMNS)})
+ON CONFLICT (reg_no) DO UPDATE SET
+{", ".join(f"{c} = excluded.{c}" for c in RACER_COLUMNS[1:])}
+WHERE ({", ".join(f"racers.{c}" for c in RACER_COLUMNS[1:])})
+IS NOT ({", ".join(f"excluded.{c}" for c in RACER_COLUMNS[1:])})
+"""
+
+# 登録番号の埋め戻し（名前だけで保存されていた行）
+# 1. race_data は同じレースの出走表（racecards）の登録番号を使う
+# 2. それでも埋まらない行は選手マスタの名前で引く（同名の選手が1人だけのとき）。
+#    同じレースに表記違いの同じ選手が名前だけで2行あるときは、最後に保存した行だけ埋める
+# 同じレースに同じ登録番号の行がもうある行は名前のまま残す（どちらもレースのキーが重なるため）
+BACKFILL_PLAYER_ID_SQLS = [
+    """
+    UPDATE racecards SET reg_no = r.reg_no
+    FROM (
+        SELECT name_norm, MIN(reg_no) AS reg_no FROM racers
+        GROUP BY name_norm HAVING COUNT(*) = 1
+    ) AS r
+    WHERE racecards.reg_no IS NULL AND r.name_norm = normalize_name(racecards.name)
+    """,
+    f"""
+    UPDATE race_data SET player_id = rc.reg_no, rev = {CURRENT_RACE_REV_SQL}
+    FROM racecards AS rc
+    WHERE race_data.player_id IS NULL
+    AND rc.date = REPLACE(race_data.date, '-', '')
+    AND rc.venue_name = race_data.venue_name
+    AND rc.race_number = race_data.race_number
+    AND rc.name = race_data.player_name
+    AND rc.reg_no IS NOT NULL
+    AND NOT {_race_has_player_id_sql("rc.reg_no")}
+    """,
+    f"""
+    UPDATE race_data SET player_id = r.reg_no, rev = {CURRENT_RACE_REV_SQL}
+    FROM (
+        SELECT name_norm, MIN(reg_no) AS reg_no FROM racers
+        GROUP BY name_norm HAVING COUNT(*) = 1
+    ) AS r
+    WHERE race_data.player_id IS NULL AND r.name_norm = normalize_name(race_data.player_name)
+    AND NOT {_race_has_player_id_sql("r.reg_no")}
+    AND NOT EXISTS (
+        SELECT 1 FROM race_data AS o
+        WHERE o.date = race_data.date AND o.venue_name = race_data.venue_name
+        AND o.race_number = race_data.race_number AND o.player_id IS NULL
+        AND o.id > race_data.id AND normalize_name(o.player_name) = r.name_norm
+    )
+    """,
+]
+
+# --- 展開パターン辞書 ---
+# 展開ごとのパターン（と要因）と、パターンごとの出目の回数。
+# 出目の回数は1行ずつ持つので、「＋」は該当行の count = count + 1 だけで済む
+CREATE_SCENARIO_PATTERNS_SQL = """
+CREATE TABLE IF NOT EXISTS scenario_patterns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    scenario_type TEXT NOT NULL,
+    pattern TEXT NOT NULL,
+    factor TEXT NOT NULL DEFAULT ''
+)
+"""
+
+# 展開ごとのパターン一覧をパターン順で返すためのインデックス（並べ替えなしで読める）
+CREATE_SCENARIO_PATTERNS_INDEX_SQL = """
+CREATE INDEX IF NOT EXISTS idx_scenario_patterns_type_pattern
+ON scenario_patterns (scenario_type, pattern)
+"""
+
+CREATE_SCENARIO_RESULTS_SQL = """
+CREATE TABLE IF NOT EXISTS scenario_results (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    pattern_id INTEGER NOT NULL REFERENCES scenario_patterns (id) ON DELETE CASCADE,
+    kimari TEXT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (pattern_id, kimari)
+)
+"""
+
+# 出目の回数を足す（なければ追加）。1文なので同時に押されても取りこぼさない
+INCREMENT_SCENARIO_RESULT_SQL = """
+INSERT INTO scenario_results (pattern_id, kimari, count) VALUES (?, ?, ?)
+ON CONFLICT (pattern_id, kimari) DO UPDATE SET count = count + excluded.count
+"""
+
+# 展開パターン辞書が変わるたびにトリガーで1増える版数（集計キャッシュの無効化に使う）
+SCENARIO_VERSION_KEY = "scenario_version"
+
+SCENARIO_VERSION_TRIGGER_SQLS = [
+    f"""CREATE TRIGGER IF NOT EXISTS {table}_version_{suffix} AFTER {event} ON {table} BEGIN
+    UPDATE meta SET value = value + 1 WHERE key = '{SCENARIO_VERSION_KEY}';
+    END"""
+    for table in ("scenario_patterns", "scenario_results")
+    for suffix, event in (("ai", "INSERT"), ("ad", "DELETE"), ("au", "UPDATE"))
+]
+
+SELECT_SCENARIOS_SQL = """
+SELECT p.id, p.pattern, p.factor, r.id, r.kimari, r.count
+FROM scenario_patterns AS p
+LEFT JOIN scenario_results AS r ON r.pattern_id = p.id
+WHERE p.scenario_type = ?
+ORDER BY p.pattern, p.id, r.count DESC, r.id
+"""
+
+_conn = None
+_lock = threading.RLock()
+
+# このプロセスでの書き込み回数（集計キャッシュの無効化に使う）
+_write_version = 0
+
+# 選手・コース別集計の読み込みキャッシュ（先読みもここに入れる）
+SUMMARY_CACHE_SIZE = 256
+_summary_cache = OrderedDict()
+
+
+def normalize_name(name):
+    """全角・半角の違いと空白の数の違いを無視するための正規化（"寺田　　　祥" → "寺田祥"）"""
+    if name is None:
+        return None
+    return re.sub(r"\s+", "", unicodedata.normalize("NFKC", name))
+
+
+def join_name(last, first):
+    """苗字と名前を全角スペースでつないで6文字にそろえる（出走表と同じ表記）"""
+    total_len = len(last) + len(first)
+    spaces = max(0, 6 - total_len)
+    return last + "　" * spaces + first  # 全角スペース
+
+
+def split_name(full_name):
+    """join_name の逆（全角スペースが1～複数あっても分割できる）"""
+    parts = re.split(r"　+", full_name)
+    if len(parts) == 2:
+        return parts[0], parts[1]
+    return full_name, ""  # 念のため
+
+
+def canonical_name(raw):
+    """
+    公式データの選手名（"寺　田　　　祥" のように1文字ずつ空白が入ることがある）を
+    出走表と同じ表記（"寺田　　　祥"）にする。苗字と名前の区切りは一番長い空白とみなす。
+    """
+    raw = raw.strip()
+    gaps = list(re.finditer(r"\s+", raw))
+    if not gaps:
+        return raw
+    widest = max(gaps, key=lambda m: len(m.group()))
+    last = re.sub(r"\s+", "", raw[:widest.start()])
+    first = re.sub(r"\s+", "", raw[widest.end():])
+    return join_name(last, first)
+
+
+def _connect(path):
+    # Streamlit はセッションごとに別スレッドでスクリプトを動かすので
+    # check_same_thread=False にして、排他は _lock で行う
+    conn = sqlite3.connect(
+        path,
+        check_same_thread=False,
+        isolation_level=None,  # トランザクションは transaction() で明示的に張る
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    # 登録番号の埋め戻しで使う（SQL から normalize_name(name) で呼べる）
+    conn.create_function("normalize_name", 1, normalize_name, deterministic=True)
+    return conn
+
+
+def _column_exists(conn, table, column):
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})"))
+
+
+def _object_exists(conn, type_, name):
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = ? AND name = ?", (type_, name)
+    ).fetchone()
+    return row is not None
+
+
+# --- スキーマのマイグレーション ---
+# 適用済みの番号を PRAGMA user_version に記録し、起動時はその値を見るだけにする。
+# user_version が 0 の既存DB（番号管理を始める前に作ったもの）にも全部を流すので、
+# 各マイグレーションは途中まで適用済みのDBに流しても壊れないように書く。
+
+# race_data のカラムの型（古いDBに足りないカラムを足すときに使う）
+RACE_DATA_TEXT_COLUMNS = {"date", "venue_name", "player_name", "move", "st_eval"}
+
+# 以前の DB にある ST評価のフラグ列 → st_eval の値
+LEGACY_ST_COLUMNS = {
+    "抜出": "抜出（内より-0.10）",
+    "出遅": "出遅（外より+0.10）",
+}
+
+
+def _migrate_meta(conn):
+    conn.execute(CREATE_META_SQL)
+    conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES (?, 0)", (RACE_REV_KEY,))
+
+
+def _packed(conn):
+    """race_data が補足項目を flags にまとめた形か"""
+    return _column_exists(conn, "race_data", "flags")
+
+
+def _migrate_race_data_columns(conn):
+    """race_data を作る。古いDBには足りないカラムを足し、補足項目の NULL を 0 にする"""
+    conn.execute(CREATE_RACE_DATA_SQL)
+    if _packed(conn):
+        return
+    for column in RACE_DATA_COLUMNS[1:] + ["rev"]:
+        if _column_exists(conn, "race_data", column):
+            continue
+        decl = "TEXT" if column in RACE_DATA_TEXT_COLUMNS else "INTEGER"
+        if column == "makurizashi_flow_cabi":
+            decl = ""  # テーブル定義に合わせて型なし
+        conn.execute(f"ALTER TABLE race_data ADD COLUMN {column} {decl}")
+    conn.execute(BUMP_RACE_REV_SQL)
+    conn.execute(
+        f"""UPDATE race_data SET {", ".join(f"{c} = COALESCE({c}, 0)" for c in FLAG_COLUMNS)},
+        rev = {CURRENT_RACE_REV_SQL}
+        WHERE {" OR ".join(f"{c} IS NULL" for c in FLAG_COLUMNS)}"""
+    )
+    # 以前の 抜出 / 出遅 フラグ列は st_eval に寄せる（列自体は残しておく）
+    for column, value in LEGACY_ST_COLUMNS.items():
+        if _column_exists(conn, "race_data", column):
+            conn.execute(
+                f"""UPDATE race_data SET st_eval = ?, rev = {CURRENT_RACE_REV_SQL}
+                WHERE {column} = 1 AND COALESCE(st_eval, 'なし') = 'なし'""",
+                (value,)
+            )
+
+
+def _migrate_race_key(conn):
+    """1レース・1選手1行のユニークインデックス（重複行は最後に保存した行に寄せる）と検索用インデックス"""
+    if not _object_exists(conn, "index", "ux_race_data_race_player"):
+        conn.execute(DEDUPE_RACE_DATA_SQL)
+        conn.execute(CREATE_RACE_KEY_INDEX_SQL)
+    conn.execute(CREATE_PLAYER_COURSE_INDEX_SQL)
+
+
+def _migrate_summary(conn):
+    """集計テーブルとトリガーを作って既存データから一括集計"""
+    if _object_exists(conn, "table", "race_summary"):
+        return
+    conn.execute(CREATE_SUMMARY_SQL)
+    conn.execute(CREATE_RIVAL_SQL)
+    packed = _packed(conn)
+    for sql in _summary_trigger_sqls(packed):
+        conn.execute(sql)
+    for sql in _summary_backfill_sqls(packed):
+        conn.execute(sql)
+
+
+def _migrate_racecards(conn):
+    """出走表テーブルを作って、これまでのJSONファイルを取り込む"""
+    if _object_exists(conn, "table", "racecards"):
+        return
+    conn.execute(CREATE_RACECARDS_SQL)
+    _import_racecard_json(conn, RACECARD_JSON_DIR)
+
+
+def _migrate_racers(conn):
+    conn.execute(CREATE_RACERS_SQL)
+    conn.execute(CREATE_RACERS_NAME_INDEX_SQL)
+
+
+def _migrate_player_ids(conn):
+    """登録番号のカラムを追加して、名前だけの既存行を埋め戻す"""
+    if not _column_exists(conn, "racecards", "reg_no"):
+        conn.execute("ALTER TABLE racecards ADD COLUMN reg_no INTEGER")
+    conn.execute(BUMP_RACE_REV_SQL)
+    for sql in BACKFILL_PLAYER_ID_SQLS:
+        conn.execute(sql)
+    conn.execute(CREATE_PLAYER_ID_INDEX_SQL)
+    conn.execute(CREATE_RACECARDS_REG_NO_INDEX_SQL)
+
+
+def _migrate_race_rev(conn):
+    """差分エクスポート用の版数と削除記録"""
+    conn.execute(CREATE_RACE_REV_INDEX_SQL)
+    conn.execute(CREATE_RACE_DELETED_SQL)
+    conn.execute(CREATE_RACE_DELETED_TRIGGER_SQL)
+
+
+def _migrate_scenarios(conn):
+    """展開パターン辞書のテーブルを作って、これまでの scenarios.json を取り込む"""
+    if _object_exists(conn, "table", "scenario_patterns"):
+        return
+    conn.execute(CREATE_SCENARIO_PATTERNS_SQL)
+    conn.execute(CREATE_SCENARIO_PATTERNS_INDEX_SQL)
+    conn.execute(CREATE_SCENARIO_RESULTS_SQL)
+    _import_scenario_json(conn, SCENARIO_JSON_FILE)
+
+
+def _migrate_scenario_version(conn):
+    """展開パターン辞書の版数とそれを増やすトリガー"""
+    conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES (?, 0)", (SCENARIO_VERSION_KEY,))
+    for sql in SCENARIO_VERSION_TRIGGER_SQLS:
+        conn.execute(sql)
+
+
+def _migrate_flags(conn):
+    """
+    補足項目の14カラムを flags（ビットマスク）1カラムにまとめてテーブルを作り直す。
+    以前のDBにだけあるカラム（flow_cabi など）はそのまま残す。集計の件数は変わらないのでトリガーだけ作り直す
+    """
+    if not _packed(conn):
+        known = set(RACE_DATA_COLUMNS) | {"rev"}
+        extra = [
+            f"{name} {decl}".strip()
+            for _, name, decl, *_ in conn.execute("PRAGMA table_info(race_data)")
+            if name not in known
+        ]
+        extra_names = [e.split()[0] for e in extra]
+        copy_columns = [c for c in RACE_STORED_COLUMNS if c != "flags"] + ["rev"] + extra_names
+        packed_flags = " | ".join(
+            f"((COALESCE({flag}, 0) != 0) << {bit.bit_length() - 1})" for flag, bit in FLAG_BITS.items()
+        )
+        seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'race_data'").fetchone()
+
+        for name in SUMMARY_TRIGGER_NAMES + ["race_data_deleted_ad"]:
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(_race_data_table_sql("race_data_packed", extra))
+        conn.execute(
+            f"""INSERT INTO race_data_packed ({", ".join(copy_columns)}, flags)
+            SELECT {", ".join(copy_columns)}, {packed_flags} FROM race_data"""
+        )
+        conn.execute("DROP TABLE race_data")
+        conn.execute("ALTER TABLE race_data_packed RENAME TO race_data")
+        if seq is not None:
+            # 消した行の id を使い回さないよう AUTOINCREMENT の値を引き継ぐ
+            updated = conn.execute(
+                "UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'race_data'", (seq[0],)
+            ).rowcount
+            if not updated:
+                conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('race_data', ?)", (seq[0],))
+
+        conn.execute(CREATE_RACE_KEY_INDEX_SQL)
+        conn.execute(CREATE_PLAYER_COURSE_INDEX_SQL)
+        conn.execute(CREATE_PLAYER_ID_INDEX_SQL)
+        conn.execute(CREATE_RACE_REV_INDEX_SQL)
+        conn.execute(CREATE_RACE_DELETED_TRIGGER_SQL)
+        for sql in _summary_trigger_sqls():
+            conn.execute(sql)
+    conn.execute(CREATE_RACE_DATA_NAMED_VIEW_SQL)
+
+
+def _rebuild_summary(conn):
+    """集計テーブルとトリガーを今の定義で作り直し、race_data から一括集計する"""
+    for name in SUMMARY_TRIGGER_NAMES:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    conn.execute("DROP TABLE IF EXISTS race_summary")
+    conn.execute("DROP TABLE IF EXISTS race_summary_rival")
+    conn.execute(CREATE_SUMMARY_SQL)
+    conn.execute(CREATE_RIVAL_SQL)
+    for sql in _summary_trigger_sqls():
+        conn.execute(sql)
+    for sql in _summary_backfill_sqls():
+        conn.execute(sql)
+
+
+def _migrate_player_keys(conn):
+    """
+    レース・選手のユニークキーと選手・コース別集計を、名前から登録番号（ない行だけ名前）に切り替える。
+    重複行は新しいキーで最後に保存した行に寄せ、集計は作り直す
+    """
+    key_sql = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'index' AND name = 'ux_race_data_race_player'"
+    ).fetchone()
+    rebuild_summary = not _column_exists(conn, "race_summary", "player_id")
+    if rebuild_summary:
+        # 以前の集計テーブルを参照するトリガーは重複行の削除より先に外す
+        for name in SUMMARY_TRIGGER_NAMES:
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    if key_sql is None or RACE_PLAYER_KEY_SQL not in key_sql[0]:
+        conn.execute(BUMP_RACE_REV_SQL)
+        conn.execute("DROP INDEX IF EXISTS ux_race_data_race_player")
+        conn.execute(DEDUPE_RACE_DATA_SQL)
+        conn.execute(CREATE_RACE_KEY_INDEX_SQL)
+    if rebuild_summary:
+        _rebuild_summary(conn)
+
+
+def _migrate_st_other(conn):
+    """ST評価の「その他」（空や選択肢にない値）のカラムを足し、集計を作り直す"""
+    if not _column_exists(conn, "race_summary", "st_other"):
+        _rebuild_summary(conn)
+
+
+# (番号, 内容, 関数)。番号は 1 から順に、追加は末尾にだけ行う（並べ替え・削除はしない）
+MIGRATIONS = [
+    (1, "meta テーブル", _migrate_meta),
+    (2, "race_data のカラム", _migrate_race_data_columns),
+    (3, "レース・選手のユニークキー", _migrate_race_key),
+    (4, "選手・コース別集計", _migrate_summary),
+    (5, "出走表テーブル", _migrate_racecards),
+    (6, "選手マスタ", _migrate_racers),
+    (7, "登録番号", _migrate_player_ids),
+    (8, "差分エクスポート用の版数", _migrate_race_rev),
+    (9, "展開パターン辞書", _migrate_scenarios),
+    (10, "展開パターン辞書の版数", _migrate_scenario_version),
+    (11, "補足項目のビットマスク化", _migrate_flags),
+    (12, "レースのキー・集計を登録番号で", _migrate_player_keys),
+    (13, "ST評価の「その他」", _migrate_st_other),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """
+    未適用のマイグレーションを順に流し、流したものの番号のリストを返す。
+    全部を1トランザクションで行うので、途中で失敗したら何も変わらない。
+    最新なら PRAGMA user_version を読むだけで戻る
+    """
+    if schema_version(conn) >= SCHEMA_VERSION:
+        return []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # 別プロセスが先に流していたら何もしない
+        current = schema_version(conn)
+        applied = []
+        for number, _, migration in MIGRATIONS:
+            if number > current:
+                migration(conn)
+                applied.append(number)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+    return applied
+
+
+def get_connection():
+    """プロセス共通の接続を返す（初回のみ接続・スキーマ確認）"""
+    global _conn
+    with _lock:
+        if _conn is None:
+            conn = _connect(DB_FILE)
+            migrate(conn)
+            _conn = conn
+        return _conn
+
+
+def open_reader():
+    """
+    読み込み専用の別接続を返す（呼び出し側で close する）。
+    エクスポートなど時間のかかる読み込みを、共有の接続（_lock）を塞がずに行うため
+    """
+    get_connection()  # スキーマを作っておく
+    conn = sqlite3.connect(f"file:{DB_FILE}?mode=ro", uri=True, isolation_level=None, check_same_thread=False)
+    conn.create_function("normalize_name", 1, normalize_name, deterministic=True)
+    return conn
+
+
+def close_connection():
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+
+@contextmanager
+def transaction():
+    """BEGIN〜COMMIT をまとめて行う。例外時はロールバック"""
+    global _write_version
+    with _lock:
+        conn = get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+            _write_version += 1
+
+
+def execute(sql, params=()):
+    """1文だけの書き込み（自動コミット）"""
+    global _write_version
+    with _lock:
+        cursor = get_connection().execute(sql, params)
+        _write_version += 1
+        return cursor
+
+
+def data_version():
+    """
+    DBの内容が変わったら変わる値。
+    他の接続の書き込みは PRAGMA data_version、この接続の書き込みは _write_version で検知する。
+    """
+    with _lock:
+        return (get_connection().execute("PRAGMA data_version").fetchone()[0], _write_version)
+
+
+def race_rev():
+    """race_data の版数（race_data の行が書き換わったときだけ変わる。出走表などの保存では変わらない）"""
+    return fetchone(f"SELECT {CURRENT_RACE_REV_SQL}")[0]
+
+
+def fetchall(sql, params=()):
+    with _lock:
+        return get_connection().execute(sql, params).fetchall()
+
+
+def fetchone(sql, params=()):
+    with _lock:
+        return get_connection().execute(sql, params).fetchone()
+
+
+def table_names():
+    rows = fetchall("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")
+    return [row[0] for row in rows]
+
+
+def fetch_player_course(player_name, course_in, since=None, player_id=None):
+    """
+    選手・進入コースの履歴を新しい順に返す（カラムは PLAYER_COURSE_COLUMNS）。
+    since（ISO日付）を指定するとその日以降だけ。どちらもインデックスの範囲検索で済む。
+    player_id（登録番号）が分かっていれば登録番号で引く（名前の表記ゆれがあっても拾える）。
+    名前で拾うのはどちらの場合も登録番号のない行だけ。
+    """
+    if player_id is not None:
+        return fetchall(SELECT_PLAYER_ID_COURSE_SQL, (course_in, since or "", player_id, player_name))
+    if since:
+        return fetchall(SELECT_PLAYER_COURSE_SINCE_SQL, (player_name, course_in, since))
+    return fetchall(SELECT_PLAYER_COURSE_SQL, (player_name, course_in))
+
+
+def count_flag_combination(player_name, course_in, flags, since=None, player_id=None):
+    """
+    補足項目 flags（名前のリスト）がすべて当てはまった回数と、その選手・コースの全回数を返す。
+    絞り込みは fetch_player_course と同じ
+    """
+    params = (flag_mask(flags), player_name, course_in, since or "")
+    if player_id is not None:
+        return fetchone(COUNT_FLAG_COMBINATION_ID_SQL, params + (player_id,))
+    return fetchone(COUNT_FLAG_COMBINATION_SQL, params)
+
+
+def fetch_player_summary(player, course_in):
+    """
+    集計テーブルから選手・進入コースの動き別集計を返す（カラムは SUMMARY_COLUMNS）。
+    player は登録番号（int）か、登録番号のない行を引くときの選手名（str）
+    """
+    return fetchall(SELECT_SUMMARY_SQL, (*summary_player_key(player), course_in))
+
+
+def fetch_player_rivals(player, course_in):
+    """動き別の2着相手・負けたコースの件数を返す（カラムは RIVAL_COLUMNS。player は fetch_player_summary と同じ）"""
+    return fetchall(SELECT_RIVAL_SQL, (*summary_player_key(player), course_in))
+
+
+def fetch_players_course(entries, since=None):
+    """
+    複数の選手・進入コースの履歴を1回のクエリで返す（カラムは player_name, player_id + PLAYER_COURSE_COLUMNS）。
+    entries は (選手名, 進入コース, 登録番号 or None) のリスト。絞り込みは1人ずつの fetch_player_course と同じ
+    （集計用なので並びは決めない）
+    """
+    by_id = [(pid, course) for _, course, pid in entries if pid is not None]
+    # 登録番号のない行は名前で拾う（登録番号の分かる選手も、埋まっていない古い行があるので）
+    names = [(name, course) for name, course, _ in entries]
+    conditions = []
+    params = [since or ""]
+    if by_id:
+        conditions.append(_pairs_match_sql(["player_id", "course_in"], len(by_id)))
+        params += [v for pair in by_id for v in pair]
+    if names:
+        conditions.append(_pairs_match_sql(["player_name", "course_in"], len(names), "player_id IS NULL AND "))
+        params += [v for pair in names for v in pair]
+    if not conditions:
+        return []
+    sql = f"""
+        SELECT player_name, player_id, {", ".join(PLAYER_COURSE_COLUMNS)} FROM race_data
+        WHERE date >= ? AND ({" OR ".join(conditions)})
+    """
+    return fetchall(sql, params)
+
+
+def load_player_summaries(pairs):
+    """
+    複数の (登録番号 or 選手名, 進入コース) の load_player_summary をまとめて返す（{pair: (集計, 相手)}）。
+    キャッシュにない分だけを、集計・相手それぞれ1回のクエリで読む
+    """
+    pairs = list(dict.fromkeys(pairs))
+    version = data_version()
+    with _lock:
+        missing = [pair for pair in pairs if (*pair, version) not in _summary_cache]
+        if missing:
+            params = [v for player, course in missing for v in (*summary_player_key(player), course)]
+            found = {pair: ([], []) for pair in missing}
+            key_columns = ["player_id", "player_name", "course_in"]
+            summary_sql = f"""
+                SELECT {", ".join(key_columns)}, {", ".join(SUMMARY_COLUMNS)} FROM race_summary
+                WHERE {_pairs_match_sql(key_columns, len(missing))}
+                ORDER BY count DESC
+            """
+            rival_sql = f"""
+                SELECT {", ".join(key_columns)}, {", ".join(RIVAL_COLUMNS)} FROM race_summary_rival
+                WHERE {_pairs_match_sql(key_columns, len(missing))}
+                ORDER BY count DESC
+            """
+            for player_id, name, course, *row in get_connection().execute(summary_sql, params):
+                found[(player_id or name, course)][0].append(tuple(row))
+            for player_id, name, course, *row in get_connection().execute(rival_sql, params):
+                found[(player_id or name, course)][1].append(tuple(row))
+            for pair, result in found.items():
+                _summary_cache[(*pair, version)] = result
+        result = {}
+        for pair in pairs:
+            _summary_cache.move_to_end((*pair, version))
+            result[pair] = _summary_cache[(*pair, version)]
+        # 今回読んだ分を新しい側に寄せてから古いものを捨てる（キャッシュにあった分を先に捨てないように）
+        while len(_summary_cache) > SUMMARY_CACHE_SIZE:
+            _summary_cache.popitem(last=False)
+        return result
+
+
+def load_player_summary(player, course_in):
+    """
+    fetch_player_summary / fetch_player_rivals の結果をまとめて返す（キャッシュつき）。
+    DBに書き込みがあるまでは同じ選手・コースでクエリを流さない。
+    """
+    key = (player, course_in, data_version())
+    with _lock:
+        if key in _summary_cache:
+            _summary_cache.move_to_end(key)
+            return _summary_cache[key]
+        result = (fetch_player_summary(player, course_in), fetch_player_rivals(player, course_in))
+        _summary_cache[key] = result
+        while len(_summary_cache) > SUMMARY_CACHE_SIZE:
+            _summary_cache.popitem(last=False)
+        return result
+
+
+def clear_summary_cache():
+    """load_player_summary / load_player_summaries のキャッシュを空にする（次の読み込みはDBから）"""
+    with _lock:
+        _summary_cache.clear()
+
+
+def save_race(date, venue_name, race_number, rows):
+    """
+    1レース分（全選手）を1トランザクションで保存する。
+    rows は RACE_WRITE_COLUMNS の並びのタプル。同じレース・選手（登録番号、ない行は名前）の行は上書きし、
+    今回の保存に含まれない選手の行は削除する（レース単位で入れ替え）。
+    戻り値は保存前にそのレースに入っていた行数。
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    name_idx = RACE_WRITE_COLUMNS.index("player_name")
+    id_idx = RACE_WRITE_COLUMNS.index("player_id")
+    players = [row[name_idx] if row[id_idx] is None else row[id_idx] for row in rows]
+
+    with transaction() as conn:
+        conn.execute(BUMP_RACE_REV_SQL)
+        existing = conn.execute(COUNT_RACE_ROWS_SQL, (date, venue_name, race_number)).fetchone()[0]
+        conn.executemany(ADOPT_PLAYER_ID_SQL, rows)
+        conn.executemany(UPSERT_RACE_DATA_SQL, rows)
+        conn.execute(
+            f"""DELETE FROM race_data
+            WHERE date = ? AND venue_name = ? AND race_number = ?
+            AND {RACE_PLAYER_KEY_SQL} NOT IN ({", ".join("?" for _ in players)})""",
+            (date, venue_name, race_number, *players)
+        )
+    return existing
+
+
+def upsert_race_rows(rows, overwrite=False):
+    """
+    race_data 形式の行（RACE_WRITE_COLUMNS の並びのタプル）をまとめて1トランザクションで書き込む（一括取り込み用）。
+    同じレース・選手の行は overwrite=True のときだけ上書きする（名前だけで記録済みの行も同じ選手として扱う）。
+    save_race と違い、含まれない選手の行は消さない。戻り値は書き込んだ行数。
+    """
+    rows = list(rows)
+    sql = UPSERT_RACE_DATA_SQL if overwrite else INSERT_RACE_DATA_IF_NEW_SQL
+    with transaction() as conn:
+        conn.execute(BUMP_RACE_REV_SQL)
+        conn.executemany(ADOPT_PLAYER_ID_SQL, rows)
+        return conn.executemany(sql, rows).rowcount
+
+
+def upsert_racers(rows):
+    """
+    選手マスタ（RACER_COLUMNS の並びのタプル）を1トランザクションで書き込む。
+    戻り値は追加・更新した行数（内容が同じ選手は書き込まないので数えない）
+    """
+    with transaction() as conn:
+        return conn.executemany(UPSERT_RACER_SQL, rows).rowcount
+
+
+def find_racers(name):
+    """選手名（空白の違いは無視）で選手マスタを引く。[{RACER_COLUMNS...}, ...]"""
+    rows = fetchall(f"SELECT {', '.join(RACER_COLUMNS)} FROM racers WHERE name_norm = ?", (normalize_name(name),))
+    return [dict(zip(RACER_COLUMNS, row)) for row in rows]
+
+
+def resolve_reg_no(name):
+    """選手名から登録番号を引く（選手マスタにいない・同名が複数いる場合は None）"""
+    racers = find_racers(name)
+    return racers[0]["reg_no"] if len(racers) == 1 else None
+
+
+def backfill_player_ids():
+    """
+    登録番号が空の race_data / racecards の行を埋める（選手マスタを取り込み直したあとに呼ぶ）。
+    埋めた行数を返す
+    """
+    with transaction() as conn:
+        conn.execute(BUMP_RACE_REV_SQL)
+        return sum(conn.execute(sql).rowcount for sql in BACKFILL_PLAYER_ID_SQLS)
+
+
+def load_racer(reg_no):
+    """登録番号で選手マスタを引く（なければ None）"""
+    row = fetchone(f"SELECT {', '.join(RACER_COLUMNS)} FROM racers WHERE reg_no = ?", (reg_no,))
+    return dict(zip(RACER_COLUMNS, row)) if row else None
+
+
+def _write_racecard(conn, date, venue_name, race_number, racers):
+    conn.execute(DELETE_RACECARD_SQL, (date, venue_name, race_number))
+    conn.executemany(
+        INSERT_RACECARD_SQL,
+        [(date, venue_name, race_number, r["lane"], r["name"], r.get("reg_no")) for r in racers]
+    )
+
+
+def save_racecards(cards):
+    """出走表をまとめて1トランザクションで保存する。cards は (date, venue_name, race_number, racers) の並び"""
+    with transaction() as conn:
+        for date, venue_name, race_number, racers in cards:
+            _write_racecard(conn, date, venue_name, race_number, racers)
+
+
+def save_racecard(date, venue_name, race_number, racers):
+    save_racecards([(date, venue_name, race_number, racers)])
+
+
+def load_racecard(date, venue_name, race_number):
+    """[{"lane", "name", "reg_no"}, ...] を返す（保存されていなければ None）"""
+    rows = fetchall(SELECT_RACECARD_SQL, (date, venue_name, race_number))
+    if not rows:
+        return None
+    return [{"lane": lane, "name": name, "reg_no": reg_no} for lane, name, reg_no in rows]
+
+
+def load_racecards_by_date(date):
+    """その日の全出走表を {(venue_name, race_number): [{"lane", "name", "reg_no"}, ...]} で返す（1クエリ）"""
+    cards = {}
+    for venue_name, race_number, lane, name, reg_no in fetchall(SELECT_RACECARDS_BY_DATE_SQL, (date,)):
+        cards.setdefault((venue_name, race_number), []).append({"lane": lane, "name": name, "reg_no": reg_no})
+    return cards
+
+
+def _import_racecard_json(conn, directory):
+    if not os.path.isdir(directory):
+        return 0
+    count = 0
+    for filename in sorted(os.listdir(directory)):
+        if not filename.endswith(".json"):
+            continue
+        try:
+            date, venue_name, race = filename[:-len(".json")].split("_")
+            with open(os.path.join(directory, filename), "r", encoding="utf-8") as f:
+                racers = json.load(f)
+        except (ValueError, OSError):
+            # 形式の違うファイルは飛ばす
+            continue
+        _write_racecard(conn, date, venue_name, int(race), racers)
+        count += 1
+    return count
+
+
+def import_racecard_json(directory=RACECARD_JSON_DIR):
+    """{date}_{venue}_{NN}.json 形式の出走表ファイルを racecards に取り込む。取り込んだ件数を返す"""
+    with transaction() as conn:
+        return _import_racecard_json(conn, directory)
+
+
+def load_scenarios(scenario_type):
+    """
+    展開のパターン一覧を返す（1クエリ）。パターン順、出目は回数の多い順。
+    [{"id", "pattern", "factor", "results": [{"id", "kimari", "count"}, ...]}, ...]
+    """
+    patterns = []
+    for pattern_id, pattern, factor, result_id, kimari, count in fetchall(SELECT_SCENARIOS_SQL, (scenario_type,)):
+        if not patterns or patterns[-1]["id"] != pattern_id:
+            patterns.append({"id": pattern_id, "pattern": pattern, "factor": factor, "results": []})
+        if result_id is not None:
+            patterns[-1]["results"].append({"id": result_id, "kimari": kimari, "count": count})
+    return patterns
+
+
+def scenario_version():
+    """展開パターン辞書の版数（パターン・出目に変更があるたびに増える）"""
+    row = fetchone("SELECT value FROM meta WHERE key = ?", (SCENARIO_VERSION_KEY,))
+    return row[0] if row else 0
+
+
+def _add_scenario_pattern(conn, scenario_type, pattern, factor):
+    cursor = conn.execute(
+        "INSERT INTO scenario_patterns (scenario_type, pattern, factor) VALUES (?, ?, ?)",
+        (scenario_type, pattern, factor)
+    )
+    return cursor.lastrowid
+
+
+def add_scenario_pattern(scenario_type, pattern, factor, kimari, count=1):
+    """
+    パターンを出目1つつきで追加して id を返す。
+    同じ展開・パターン・要因がすでにあれば追加せず None を返す。
+    """
+    with transaction() as conn:
+        exists = conn.execute(
+            """SELECT 1 FROM scenario_patterns
+            WHERE scenario_type = ? AND pattern = ? AND factor = ?""",
+            (scenario_type, pattern, factor)
+        ).fetchone()
+        if exists:
+            return None
+        pattern_id = _add_scenario_pattern(conn, scenario_type, pattern, factor)
+        conn.execute(INCREMENT_SCENARIO_RESULT_SQL, (pattern_id, kimari, count))
+        return pattern_id
+
+
+def increment_scenario_result(pattern_id, kimari, amount=1):
+    """出目の回数を amount 足す（出目がなければ追加）"""
+    execute(INCREMENT_SCENARIO_RESULT_SQL, (pattern_id, kimari, amount))
+
+
+def delete_scenario_result(result_id):
+    execute("DELETE FROM scenario_results WHERE id = ?", (result_id,))
+
+
+def update_scenario_pattern(pattern_id, pattern, factor, results=()):
+    """
+    パターン・要因と、編集された出目（(result_id, kimari, count) の並び）を1トランザクションで書き換える。
+    変更のあった出目だけ渡す想定。別の出目と同じ表記にした場合は回数を合算して1行にまとめる。
+    """
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE scenario_patterns SET pattern = ?, factor = ? WHERE id = ?",
+            (pattern, factor, pattern_id)
+        )
+        for result_id, kimari, count in results:
+            other = conn.execute(
+                "SELECT id FROM scenario_results WHERE pattern_id = ? AND kimari = ? AND id != ?",
+                (pattern_id, kimari, result_id)
+            ).fetchone()
+            if other:
+                conn.execute("DELETE FROM scenario_results WHERE id = ?", (result_id,))
+                conn.execute(INCREMENT_SCENARIO_RESULT_SQL, (pattern_id, kimari, count))
+            else:
+                conn.execute(
+                    "UPDATE scenario_results SET kimari = ?, count = ? WHERE id = ?",
+                    (kimari, count, result_id)
+                )
+
+
+def delete_scenario_pattern(pattern_id):
+    """パターンを削除する（出目は外部キーの ON DELETE CASCADE で一緒に消える）"""
+    execute("DELETE FROM scenario_patterns WHERE id = ?", (pattern_id,))
+
+
+def _import_scenario_json(conn, path):
+    if not os.path.exists(path):
+        return 0
+    with open(path, "r", encoding="utf-8") as f:
+        scenarios = json.load(f)
+    count = 0
+    for scenario_type, patterns in scenarios.items():
+        for p in patterns:
+            pattern_id = _add_scenario_pattern(conn, scenario_type, p["pattern"], p.get("factor", ""))
+            conn.executemany(
+                INCREMENT_SCENARIO_RESULT_SQL,
+                [(pattern_id, r["kimari"], r["count"]) for r in p.get("results", [])]
+            )
+            count += 1
+    return count
@@ -1,17 +1,209 @@
-import sqlite3
-import pandas as pd
+"""
+race_data の CSV エクスポート（差分・分割読み込み）
+
+    python export_to_csv.py [--gzip] [--full]
+
+前回エクスポートした版数（db の race_data_rev）を状態ファイルに残しておき、
+それより後に追加・更新された行と削除された行だけを CSV の末尾に追記する。
+読み込みは CHUNK_SIZE 行ずつ（全件を DataFrame にしない）、別接続のスナップショット上で行う。
+
+CSV は RACE_DATA_COLUMNS + deleted 列。同じ id が複数行あるときは最後の行が最新で、
+deleted = 1 の行はその id が削除されたことを表す（race_history.py はこの形で読む）。
+古い行が増えすぎたら（COMPACT_RATIO）、追記をやめて全件を書き直す。
+--gzip を付けると boatrace_data.csv.gz に圧縮して書く（追記分は gzip のメンバーとして足す）。
+
+data_rec.py から保存のたびに schedule_export() でバックグラウンド実行する。
+"""
+import csv
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-# SQLiteファイル名
-DB_FILE = "boatrace_data.db"
 # エクスポート先CSVファイル名
-CSV_FILE = "boatrace_data.csv"
+CSV_FILE = os.path.join(BASE_DIR, "boatrace_data.csv")
+GZIP_FILE = CSV_FILE + ".gz"
+
+# fetchmany で1回に読む行数
+CHUNK_SIZE = 5000
+
+# 古い行（上書き前の行・削除済みの行）が生きている行数のこの割合を超えたら全件を書き直す
+COMPACT_RATIO = 0.5
+
+CSV_COLUMNS = db.RACE_DATA_COLUMNS + ["deleted"]
+
+SELECT_ALL_SQL = db.SELECT_RACE_DATA_SQL + " ORDER BY id"
+
+SELECT_CHANGED_SQL = db.SELECT_RACE_DATA_SQL + " WHERE rev > ? ORDER BY id"
+
+SELECT_DELETED_SQL = """
+SELECT id FROM race_data_deleted
+WHERE rev > ? ORDER BY id
+"""
+
+COUNT_ROWS_SQL = "SELECT COUNT(*) FROM race_data"
+SELECT_REV_SQL = "SELECT value FROM meta WHERE key = ?"
+
+
+def state_path(path):
+    return path + ".state.json"
+
+
+def load_state(path):
+    """前回のエクスポート状態（なければ None）"""
+    try:
+        with open(state_path(path), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def save_state(path, state):
+    tmp = state_path(path) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, state_path(path))
+
+
+def _open_csv(path, mode, compress):
+    if compress:
+        return gzip.open(path, mode + "t", newline="", encoding="utf-8")
+    return open(path, mode, newline="", encoding="utf-8")
+
+
+def is_gzip(path):
+    return path.endswith(".gz")
+
+
+def _write_chunks(writer, cursor, deleted=0):
+    """cursor の結果を CHUNK_SIZE 行ずつ書き出し、書いた行数を返す"""
+    written = 0
+    while True:
+        rows = cursor.fetchmany(CHUNK_SIZE)
+        if not rows:
+            return written
+        writer.writerows(row + (deleted,) for row in rows)
+        written += len(rows)
+
+
+def _write_full(conn, path):
+    """全件を一時ファイルに書いてから置き換える。書いた行数を返す"""
+    tmp = path + ".tmp"
+    with _open_csv(tmp, "w", is_gzip(path)) as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_COLUMNS)
+        written = _write_chunks(writer, conn.execute(SELECT_ALL_SQL))
+    os.replace(tmp, path)
+    return written
+
+
+def _append_changes(conn, path, since):
+    """rev > since の行と削除を追記し、(追加・更新の行数, 削除の行数) を返す"""
+    changed = conn.execute(SELECT_CHANGED_SQL, (since,))
+    first = changed.fetchmany(CHUNK_SIZE)
+    deleted = conn.execute(SELECT_DELETED_SQL, (since,)).fetchall()
+    if not first and not deleted:
+        return 0, 0
+    with _open_csv(path, "a", is_gzip(path)) as f:
+        writer = csv.writer(f)
+        writer.writerows(row + (0,) for row in first)
+        written = len(first) + _write_chunks(writer, changed)
+        writer.writerows((row_id,) + (None,) * (len(db.RACE_DATA_COLUMNS) - 1) + (1,) for (row_id,) in deleted)
+    return written, len(deleted)
+
+
+def export(path=CSV_FILE, full=False):
+    """
+    CSV を最新の状態にする。前回の状態が使えれば差分だけ追記し、
+    {"mode": "full" / "append" / "none", "rows", "deleted", "rev"} を返す
+    """
+    state = load_state(path)
+    usable = (
+        not full
+        and state is not None
+        and os.path.exists(path)
+        and os.path.getsize(path) == state.get("size")
+    )
+
+    conn = db.open_reader()
+    try:
+        # 版数と行の読み込みを同じスナップショットで行う（途中の保存は次回に回る）
+        conn.execute("BEGIN")
+        rev = conn.execute(SELECT_REV_SQL, (db.RACE_REV_KEY,)).fetchone()[0]
+        live = conn.execute(COUNT_ROWS_SQL).fetchone()[0]
+
+        if usable and state["rev"] == rev:
+            return {"mode": "none", "rows": 0, "deleted": 0, "rev": rev}
+
+        if usable:
+            written, deleted = _append_changes(conn, path, state["rev"])
+            lines = state["lines"] + written + deleted
+            mode = "append"
+        if not usable or lines - live > live * COMPACT_RATIO:
+            written = _write_full(conn, path)
+            deleted = 0
+            lines = written
+            mode = "full"
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+    save_state(path, {"rev": rev, "lines": lines, "size": os.path.getsize(path)})
+    return {"mode": mode, "rows": written, "deleted": deleted, "rev": rev}
+
+
+# --- 保存後の自動エクスポート ---
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="export")
+_pending = {"running": False, "again": False}
+_pending_lock = threading.Lock()
+
+
+def _run_pending(path):
+    while True:
+        try:
+            export(path)
+        except Exception as e:  # 保存自体は済んでいるので、失敗は表示だけして次回に任せる
+            print(f"CSVエクスポートに失敗しました: {e}", file=sys.stderr)
+        with _pending_lock:
+            if not _pending["again"]:
+                _pending["running"] = False
+                return
+            _pending["again"] = False
+
+
+def schedule_export(path=CSV_FILE):
+    """
+    バックグラウンドでエクスポートする（すぐ戻る）。
+    実行中に呼ばれた分は、終わったあと1回にまとめて実行する
+    """
+    with _pending_lock:
+        if _pending["running"]:
+            _pending["again"] = True
+            return
+        _pending["running"] = True
+    _executor.submit(_run_pending, path)
 
-# SQLiteからデータを読み込んでDataFrameに変換
-conn = sqlite3.connect(DB_FILE)
-df = pd.read_sql_query("SELECT * FROM race_data", conn)
-conn.close()
 
-# CSVとして保存（index列なし、UTF-8で保存）
-df.to_csv(CSV_FILE, index=False, encoding="utf-8")
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    path = GZIP_FILE if "--gzip" in args else CSV_FILE
 
-print(f"エクスポート完了: {CSV_FILE}")
\ No newline at end of file
+    started = time.monotonic()
+    result = export(path, full="--full" in args)
+    elapsed = time.monotonic() - started
+    if result["mode"] == "none":
+        print(f"変更はありません: {path}")
+    else:
+        label = "全件" if result["mode"] == "full" else "差分"
+        print(
+            f"エクスポート完了（{label}）: {path} "
+            f"{result['rows']}行 / 削除 {result['deleted']}行（{elapsed:.1f}秒）"
+        )
@@ -1,30 +1,114 @@
-import re
+"""
+選手期別成績ファイル（公式サイトの fanYYMM.txt, 固定長・Shift-JIS）から選手マスタを取り込む
+
+    python extract_racers.py [ファイル] [--csv racer_data.csv]
+
+1行ずつバイト位置で切り出して racers テーブルに書き込む（ファイル全体を読み込まない）。
+期が変わって取り込み直しても、内容が変わった選手の行だけが書き換わる。
+取り込み後、登録番号が空のレース・出走表・狙い目リストの項目を選手マスタから埋める。
+--csv を付けると取り込んだ内容を CSV にも書き出す。
+"""
 import csv
+import sys
+import time
+
+import db
+import watchlist
+
+ENCODING = "cp932"
+DEFAULT_FILE = "racers.txt"
+BATCH_SIZE = 2000
+
+# (カラム名, 開始バイト（0始まり）, バイト数, 変換)
+# 期別成績ファイルのレイアウト（登番・氏名・支部・級別・勝率・複勝率・1着/2着/出走回数・平均ST）
+FIELDS = [
+    ("reg_no", 0, 4, int),
+    ("name", 4, 16, db.canonical_name),
+    ("name_kana", 20, 15, str.strip),
+    ("branch", 35, 4, str.strip),
+    ("class", 39, 2, str.strip),
+    ("win_rate", 58, 4, lambda v: int(v) / 100),      # "0650" → 6.50
+    ("place_rate", 62, 4, lambda v: int(v) / 10),     # "0452" → 45.2（%）
+    ("first_count", 66, 3, int),
+    ("second_count", 69, 3, int),
+    ("starts", 72, 3, int),
+    ("avg_st", 79, 3, lambda v: int(v) / 100),        # "017" → 0.17
+]
+LINE_MIN_BYTES = max(start + length for _, start, length, _ in FIELDS)
+
+
+def parse_line(raw):
+    """1行（bytes）を選手情報の辞書にする。形式が合わない行は None"""
+    raw = raw.rstrip(b"\r\n")
+    if len(raw) < LINE_MIN_BYTES or not raw[:4].isdigit():
+        return None
+    racer = {}
+    for column, start, length, convert in FIELDS:
+        # 全角文字の途中で切れないようバイト位置で切ってからデコードする
+        text = raw[start:start + length].decode(ENCODING, errors="replace")
+        try:
+            racer[column] = convert(text)
+        except ValueError:
+            racer[column] = None
+    if racer["reg_no"] is None or not racer["name"]:
+        return None
+    racer["name_norm"] = db.normalize_name(racer["name"])
+    return racer
+
+
+def iter_racers(path):
+    """ファイルを1行ずつ読んで選手情報を返す（ジェネレーター）"""
+    with open(path, "rb") as f:
+        for raw in f:
+            racer = parse_line(raw)
+            if racer:
+                yield racer
 
-# テキストファイルを読み込む
-with open("racers.txt", "r", encoding="shift-jis") as file:
-    text_data = file.read()
 
-# 正規表現パターンを調整
-# 数字（選手ID）+ 名前 + 級別・登録番号 の形式でマッチ
-pattern = r"(\d+)\s+([^\d]+?)\s{2,}([A-Za-z0-9]+)[^\d]*"
+def import_racers(path, csv_path=None, batch_size=BATCH_SIZE):
+    """racers テーブルに取り込み、{"read", "written"} を返す"""
+    summary = {"read": 0, "written": 0}
+    batch = []
+    writer = None
+    csv_file = None
+    if csv_path:
+        csv_file = open(csv_path, "w", newline="", encoding="utf-8-sig")
+        writer = csv.writer(csv_file)
+        writer.writerow(db.RACER_COLUMNS)
 
-# 行ごとに解析して、必要な情報を抽出
-racer_data = []
+    try:
+        for racer in iter_racers(path):
+            row = tuple(racer[c] for c in db.RACER_COLUMNS)
+            batch.append(row)
+            if writer:
+                writer.writerow(row)
+            summary["read"] += 1
+            if len(batch) >= batch_size:
+                summary["written"] += db.upsert_racers(batch)
+                batch.clear()
+        if batch:
+            summary["written"] += db.upsert_racers(batch)
+    finally:
+        if csv_file:
+            csv_file.close()
+    return summary
 
-for match in re.finditer(pattern, text_data):
-    # 選手ID、名前、級別、登録番号を取得
-    racer_id = match.group(1)  # 選手ID
-    name = match.group(2).strip()  # 選手名
-    rank_and_number = match.group(3).strip()  # 級別と登録番号
 
-    # 結果をリストに追加
-    racer_data.append([name, rank_and_number])
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    csv_path = None
+    if "--csv" in args:
+        i = args.index("--csv")
+        csv_path = args[i + 1] if i + 1 < len(args) else "racer_data.csv"
+        del args[i:i + 2]
+    path = args[0] if args else DEFAULT_FILE
 
-# CSVに保存
-with open("racer_data.csv", "w", newline="", encoding="shift-jis") as file:
-    writer = csv.writer(file)
-    writer.writerow(["名前", "級別・登録番号"])  # ヘッダー行
-    writer.writerows(racer_data)
+    started = time.monotonic()
+    result = import_racers(path, csv_path)
+    elapsed = time.monotonic() - started
+    print(f"{result['read']}人を読み込み、{result['written']}人分を追加・更新しました（{elapsed:.1f}秒）")
 
-print("CSVファイルに保存しました。")
+    # 名前だけで保存されていたレース・出走表・狙い目リストに登録番号を入れる
+    print(f"登録番号の埋め戻し: レース・出走表 {db.backfill_player_ids()}行 / 狙い目リスト {watchlist.backfill_reg_no()}件")
+    if csv_path:
+        print(f"CSVファイルに保存しました: {csv_path}")
@@ -0,0 +1,284 @@
+"""
+競走成績ファイル（公式サイトからダウンロードできる K ファイル）の一括取り込み
+
+    python import_results.py <フォルダ> [--overwrite] [--batch 5000]
+
+フォルダ内の K*.TXT（LZH を解凍したもの, Shift-JIS）を1行ずつ読み、
+進入コース・着順・決まり手・STから race_data の行を作って、
+BATCH_SIZE 行ごとに1トランザクションで書き込む（ファイル全体をメモリに載せない）。
+
+決まり手から分かるのは1着艇と1コースの動きだけ（それもそのコースの選択肢 db.MOVE_CHOICES にある動きだけ）なので、
+それ以外の選手の動きは空欄、
+補足項目は 0 になる。ST評価は両隣のコースとのST差から決める。
+記録済みのレース・選手は --overwrite を付けない限り上書きしない（手入力の内容を残す）。
+"""
+import os
+import re
+import sys
+import time
+
+import db
+from racecard import VENUE_CODES
+
+ENCODING = "cp932"
+BATCH_SIZE = 5000
+
+# ST評価（data_rec.py の選択肢と同じ表記）
+ST_NONE = "なし"
+ST_NUKE = "抜出（内より-0.10）"
+ST_DEOKU = "出遅（外より+0.10）"
+ST_GAP = 0.10
+
+VENUE_NAMES = {code: name for name, code in VENUE_CODES.items()}
+
+# 決まり手 → (1着艇の動き, 1コースの動き)。1コースが勝った場合は「逃げ」。
+# 書くのはその進入コースの動きの選択肢（db.MOVE_CHOICES）にある動きだけで、
+# 選択肢にない組み合わせ（2コースの捲りなど）や決まり手（恵まれ・不成立など）は動きを空欄にする
+KIMARITE_MOVES = {
+    "逃げ": ("逃げ", None),
+    "差し": ("差し", "差され"),
+    "まくり": ("捲り", "捲られ"),
+    "まくり差し": ("捲り差し", "捲り差され"),
+    "抜き": (None, "抜かれ"),
+}
+
+
+def recorded_move(move, course_in):
+    """動きがそのコースの選択肢にあればそのまま、なければ None（手入力の動きと混ざらない値は書かない）"""
+    return move if move in db.MOVE_CHOICES.get(course_in, ()) else None
+
+
+VENUE_BEGIN_RE = re.compile(r"^(\d{2})KBGN")
+VENUE_END_RE = re.compile(r"^(\d{2})KEND")
+DATE_RE = re.compile(r"(\d{4})/\s*(\d{1,2})/\s*(\d{1,2})")
+FILE_DATE_RE = re.compile(r"K(\d{2})(\d{2})(\d{2})", re.IGNORECASE)
+RACE_HEADER_RE = re.compile(r"^\s*(\d{1,2})R\s")
+# 着 艇 登番 選手名 ﾓｰﾀｰ ﾎﾞｰﾄ 以降（展示 進入 ST ﾚｰｽﾀｲﾑ）は欠場などで崩れるので後で分ける
+RESULT_RE = re.compile(r"^\s*(\S{1,2})\s+([1-6])\s+(\d{4})\s+(\D+?)\s+(\d{1,3})\s+(\d{1,3})\s+(.*)$")
+
+
+def parse_st(text):
+    """"0.12" → 0.12、フライング "F.01" → -0.01、出遅れ・欠場は None"""
+    text = text.strip()
+    match = re.fullmatch(r"(F?)(\d*)\.(\d{2})", text)
+    if not match:
+        return None
+    value = float(f"{match.group(2) or 0}.{match.group(3)}")
+    return -value if match.group(1) else value
+
+
+def parse_result_line(line):
+    """成績1行を辞書で返す（欠場などで進入コースがない行は None）"""
+    match = RESULT_RE.match(line)
+    if not match:
+        return None
+    finish, lane, reg_no, name, _motor, _boat, rest = match.groups()
+    tokens = rest.split()
+    # 展示タイム 進入コース ST レースタイム
+    if len(tokens) < 3 or not re.fullmatch(r"[1-6]", tokens[1]):
+        return None
+    return {
+        "finish": int(finish) if finish.isdigit() else None,
+        "lane": int(lane),
+        "reg_no": reg_no,
+        "name": db.canonical_name(name),
+        "course_in": int(tokens[1]),
+        "st": parse_st(tokens[2]),
+    }
+
+
+def iter_races(lines, default_date=None):
+    """
+    K ファイルの行から1レースずつ
+    {"date", "venue_name", "race_number", "kimarite", "entries": [...]} を返す（ジェネレーター）
+    """
+    venue_name = None
+    date = default_date
+    race = None
+
+    def finish_race():
+        if race and race["entries"]:
+            return race
+        return None
+
+    for line in lines:
+        line = line.rstrip("\r\n")
+        begin = VENUE_BEGIN_RE.match(line)
+        if begin:
+            venue_name = VENUE_NAMES.get(begin.group(1))
+            date = default_date
+            race = None
+            continue
+        if VENUE_END_RE.match(line):
+            done = finish_race()
+            if done:
+                yield done
+            venue_name = None
+            race = None
+            continue
+        if venue_name is None:
+            continue
+
+        date_match = DATE_RE.search(line)
+        if date_match and race is None:
+            y, m, d = (int(g) for g in date_match.groups())
+            date = f"{y:04d}-{m:02d}-{d:02d}"
+            continue
+
+        header = RACE_HEADER_RE.match(line)
+        if header:
+            done = finish_race()
+            if done:
+                yield done
+            race = {
+                "date": date,
+                "venue_name": venue_name,
+                "race_number": int(header.group(1)),
+                "kimarite": None,
+                "entries": [],
+            }
+            continue
+        if race is None:
+            continue
+
+        if "ﾚｰｽﾀｲﾑ" in line:
+            # 見出し行の末尾が決まり手
+            tail = line.split("ﾚｰｽﾀｲﾑ", 1)[1].strip()
+            race["kimarite"] = tail or None
+            continue
+
+        entry = parse_result_line(line)
+        if entry:
+            race["entries"].append(entry)
+
+    done = finish_race()
+    if done:
+        yield done
+
+
+def st_eval(course_in, st_by_course):
+    """両隣とのST差からST評価を決める（内より0.10以上早い → 抜出、外より0.10以上遅い → 出遅）"""
+    st = st_by_course.get(course_in)
+    if st is None:
+        return ST_NONE
+    inner = st_by_course.get(course_in - 1)
+    outer = st_by_course.get(course_in + 1)
+    # 浮動小数の誤差で 0.10 ちょうどが外れないよう丸めて比べる
+    if inner is not None and round(inner - st, 2) >= ST_GAP:
+        return ST_NUKE
+    if outer is not None and round(st - outer, 2) >= ST_GAP:
+        return ST_DEOKU
+    return ST_NONE
+
+
+def race_rows(race):
+    """1レース分を race_data の行（db.RACE_WRITE_COLUMNS の並び）にする"""
+    entries = race["entries"]
+    by_finish = {e["finish"]: e for e in entries if e["finish"]}
+    winner = by_finish.get(1)
+    second = by_finish.get(2)
+    st_by_course = {e["course_in"]: e["st"] for e in entries}
+    winner_move, inner_move = KIMARITE_MOVES.get(race["kimarite"], (None, None))
+
+    rows = []
+    for e in entries:
+        course_in = e["course_in"]
+        move = None
+        second_place = None
+        lost_to = None
+        rank = str(e["finish"]) if e["finish"] in (1, 2, 3) else "着外"
+
+        if course_in == 1:
+            if winner is e:
+                # data_rec.py と同じく、逃げは着順なし・2着のコースを記録
+                move = "逃げ"
+                rank = None
+                if second:
+                    second_place = second["course_in"] if second["course_in"] in (2, 3, 4) else "記録なし"
+            elif winner:
+                move = recorded_move(inner_move, course_in)
+                if move:
+                    lost_to = winner["course_in"]
+        elif winner is e:
+            move = recorded_move(winner_move, course_in)
+
+        values = {
+            "date": race["date"],
+            "venue_name": race["venue_name"],
+            "race_number": race["race_number"],
+            "course_in": course_in,
+            "player_name": e["name"],
+            "move": move,
+            "second_place": second_place,
+            "lost_to": lost_to,
+            "rank": rank,
+            "st_eval": st_eval(course_in, st_by_course),
+            "player_id": int(e["reg_no"]),
+        }
+        rows.append(tuple(values.get(c, 0) for c in db.RACE_WRITE_COLUMNS))
+    return rows
+
+
+def file_date(path):
+    """ファイル名 K240501.TXT から "2024-05-01"（読み取れなければ None）"""
+    match = FILE_DATE_RE.search(os.path.basename(path))
+    if not match:
+        return None
+    yy, mm, dd = match.groups()
+    return f"20{yy}-{mm}-{dd}"
+
+
+def iter_result_files(directory):
+    for filename in sorted(os.listdir(directory)):
+        if filename.upper().startswith("K") and filename.upper().endswith(".TXT"):
+            yield os.path.join(directory, filename)
+
+
+def import_directory(directory, overwrite=False, batch_size=BATCH_SIZE):
+    """
+    フォルダ内の K ファイルを取り込む。batch_size 行ごとに1トランザクションで書き込み、
+    {"files", "races", "rows", "written"} を返す
+    """
+    summary = {"files": 0, "races": 0, "rows": 0, "written": 0}
+    batch = []
+
+    def flush():
+        if batch:
+            summary["written"] += db.upsert_race_rows(batch, overwrite=overwrite)
+            batch.clear()
+
+    for path in iter_result_files(directory):
+        with open(path, "r", encoding=ENCODING, errors="replace") as f:
+            for race in iter_races(f, default_date=file_date(path)):
+                if not race["date"] or not race["venue_name"]:
+                    continue
+                rows = race_rows(race)
+                batch.extend(rows)
+                summary["races"] += 1
+                summary["rows"] += len(rows)
+                if len(batch) >= batch_size:
+                    flush()
+        summary["files"] += 1
+    flush()
+    return summary
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    if not args:
+        print(__doc__)
+        sys.exit(1)
+
+    overwrite = "--overwrite" in args
+    batch_size = BATCH_SIZE
+    if "--batch" in args:
+        batch_size = int(args[args.index("--batch") + 1])
+    directory = args[0]
+
+    started = time.monotonic()
+    result = import_directory(directory, overwrite=overwrite, batch_size=batch_size)
+    elapsed = time.monotonic() - started
+    print(
+        f"{result['files']}ファイル {result['races']}レース {result['rows']}行を読み込み、"
+        f"{result['written']}行を書き込みました（{elapsed:.1f}秒）"
+    )
@@ -0,0 +1,123 @@
+"""
+展開パターン辞書の出目（3連単）の分布集計
+
+全パターンの出目を1つの DataFrame にまとめ、groupby で全パターン・全展開を一度に計算する。
+  - 出目ごとの確率（と確率から見た目安オッズ）
+  - 1着・2着・3着それぞれのコース分布
+  - 上位N点を買ったときの的中率（カバー率）
+結果は展開パターン辞書の版数（db.scenario_version）が変わるまでキャッシュする。
+
+    python kimari_stats.py   # 展開ごとの集計を表示
+"""
+import threading
+
+import pandas as pd
+
+import db
+
+# カバー率を出す点数
+TOP_N = [1, 3, 5, 10]
+
+PLACES = ["first", "second", "third"]
+PLACE_LABELS = {"first": "1着", "second": "2着", "third": "3着"}
+COURSES = [1, 2, 3, 4, 5, 6]
+
+SELECT_RESULTS_SQL = """
+SELECT p.scenario_type, p.id, r.kimari, r.count
+FROM scenario_results AS r
+JOIN scenario_patterns AS p ON p.id = r.pattern_id
+WHERE r.count > 0
+"""
+
+# 集計の単位（パターンごと / 展開ごと）
+PATTERN_KEYS = ["pattern_id"]
+TYPE_KEYS = ["scenario_type"]
+
+_cache = {"version": None, "stats": None}
+_lock = threading.Lock()
+
+
+def load_results():
+    """全パターンの出目を1行1出目の DataFrame で返す（"1-2-3" 形式でない出目は除く）"""
+    rows = db.fetchall(SELECT_RESULTS_SQL)
+    df = pd.DataFrame(rows, columns=["scenario_type", "pattern_id", "kimari", "count"])
+    courses = df["kimari"].str.extract(r"^([1-6])-([1-6])-([1-6])$")
+    courses.columns = PLACES
+    df = pd.concat([df, courses], axis=1).dropna(subset=PLACES)
+    df[PLACES] = df[PLACES].astype("uint8")
+    df["scenario_type"] = df["scenario_type"].astype("category")
+    return df.reset_index(drop=True)
+
+
+def kimari_distribution(df, keys):
+    """
+    keys ごとの出目の確率。回数の多い順に rank（1〜）・累積確率 cum_prob をつける。
+    インデックスは keys（.loc[[key]] でそのグループの出目一覧が引ける）
+    """
+    dist = df.groupby(keys + ["kimari"], observed=True)["count"].sum().reset_index()
+    dist["prob"] = dist["count"] / dist.groupby(keys, observed=True)["count"].transform("sum")
+    dist = dist.sort_values(keys + ["count", "kimari"], ascending=[True] * len(keys) + [False, True])
+    grouped = dist.groupby(keys, observed=True)
+    dist["rank"] = grouped.cumcount() + 1
+    dist["cum_prob"] = grouped["prob"].cumsum()
+    dist["fair_odds"] = 1 / dist["prob"]
+    return dist.set_index(keys)
+
+
+def place_distribution(df, keys):
+    """
+    keys ごと・着順ごとのコース分布（行: keys + place、列: コース1〜6、値: 割合）
+    """
+    long = df.melt(id_vars=keys + ["count"], value_vars=PLACES, var_name="place", value_name="course")
+    counts = long.groupby(keys + ["place", "course"], observed=True)["count"].sum()
+    share = counts / counts.groupby(level=keys + ["place"], observed=True).transform("sum")
+    return share.unstack("course").reindex(columns=COURSES).fillna(0.0)
+
+
+def coverage(dist, keys):
+    """keys ごとの上位N点のカバー率（列: top1, top3, …）と出目の種類数・合計回数"""
+    grouped = dist.groupby(level=keys, observed=True)
+    result = pd.DataFrame({"kinds": grouped.size(), "total": grouped["count"].sum()})
+    for n in TOP_N:
+        top = dist[dist["rank"] <= n]
+        result[f"top{n}"] = top.groupby(level=keys, observed=True)["prob"].sum()
+    return result.fillna(0.0)
+
+
+def compute_stats(df):
+    """パターンごと・展開ごとの集計をまとめて返す"""
+    stats = {}
+    for level, keys in (("pattern", PATTERN_KEYS), ("type", TYPE_KEYS)):
+        dist = kimari_distribution(df, keys)
+        stats[level] = {
+            "kimari": dist,
+            "place": place_distribution(df, keys),
+            "coverage": coverage(dist, keys),
+        }
+    return stats
+
+
+def get_stats():
+    """集計結果を返す。展開パターン辞書に変更がなければ前回の結果をそのまま返す"""
+    version = db.scenario_version()
+    with _lock:
+        if _cache["stats"] is None or _cache["version"] != version:
+            _cache["stats"] = compute_stats(load_results())
+            _cache["version"] = version
+        return _cache["stats"]
+
+
+def select(frame, key):
+    """集計結果から1つのパターン・展開の行を取り出す（なければ空の DataFrame）"""
+    if key in frame.index.get_level_values(0):
+        return frame.loc[[key]]
+    return frame.iloc[0:0]
+
+
+if __name__ == "__main__":
+    stats = get_stats()
+    for scenario_type, row in stats["type"]["coverage"].iterrows():
+        top = select(stats["type"]["kimari"], scenario_type).head(3)
+        best = " / ".join(f"{k} {p:.1%}" for k, p in zip(top["kimari"], top["prob"]))
+        cover = " ".join(f"上位{n}点 {row[f'top{n}']:.0%}" for n in TOP_N)
+        print(f"{scenario_type}: {int(row['total'])}回 {best}（{cover}）")
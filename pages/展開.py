@@ -1,6 +1,8 @@
 import streamlit as st
-import json
-import os
+
+import db
+import kimari_stats
+import perf
 
 SCENARIO_TYPES = [
     "イン逃げ",
@@ -11,41 +13,56 @@ SCENARIO_TYPES = [
     "6捲り", "6捲り差し"
 ]
 
-FILE_PATH = "scenarios.json"
-
 
-def load_scenarios():
-    if os.path.exists(FILE_PATH):
-        with open(FILE_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    else:
-        return {t: [] for t in SCENARIO_TYPES}
+def show_distribution(kimari, place, cover):
+    """出目の確率（上位10点）・着順ごとのコース分布・上位N点のカバー率を表示"""
+    cols = st.columns(len(kimari_stats.TOP_N))
+    for col, n in zip(cols, kimari_stats.TOP_N):
+        col.metric(f"上位{n}点", f"{cover[f'top{n}'].iloc[0]:.0%}")
 
+    table = kimari[["kimari", "count", "prob", "cum_prob", "fair_odds"]].head(10)
+    table.columns = ["出目", "回数", "確率", "累積", "目安オッズ"]
+    st.dataframe(
+        table.style.format({"確率": "{:.1%}", "累積": "{:.1%}", "目安オッズ": "{:.1f}"}),
+        hide_index=True,
+        use_container_width=True
+    )
 
-def save_scenarios(data):
-    with open(FILE_PATH, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    place = place.droplevel(0).rename(index=kimari_stats.PLACE_LABELS)
+    place.columns = [f"{c}コース" for c in place.columns]
+    st.dataframe(place.style.format("{:.0%}"), use_container_width=True)
 
 
 def main():
+    perf.start("展開")
     st.title("展開パターン辞書")
 
-    scenarios = load_scenarios()
     selected_type = st.selectbox("展開を選択してください", SCENARIO_TYPES)
 
-    scenarios[selected_type] = sorted(
-        scenarios[selected_type],
-        key=lambda x: x["pattern"]
-    )
+    # パターン順・出目は回数の多い順で返ってくる（並べ替え不要）
+    with perf.stage("パターンの読み込み"):
+        patterns = db.load_scenarios(selected_type)
+
+    # 全パターンの確率・分布（辞書に変更があるまでキャッシュ）
+    with perf.stage("出目の集計"):
+        stats = kimari_stats.get_stats()
+    type_cover = kimari_stats.select(stats["type"]["coverage"], selected_type)
+    if not type_cover.empty:
+        with st.expander(f"📊 【{selected_type}】全体の出目分布（{int(type_cover['total'].iloc[0])}回）"):
+            show_distribution(
+                kimari_stats.select(stats["type"]["kimari"], selected_type),
+                kimari_stats.select(stats["type"]["place"], selected_type),
+                type_cover
+            )
 
     st.subheader(f"【{selected_type}】の登録パターン")
 
     if selected_type not in st.session_state:
-        st.session_state[selected_type] = [False] * len(scenarios[selected_type])
+        st.session_state[selected_type] = [False] * len(patterns)
 
-    if scenarios[selected_type]:
-        for idx, pattern in enumerate(scenarios[selected_type], start=1):
-            edit_key = f"{selected_type}_{idx}_edit"
+    if patterns:
+        for idx, pattern in enumerate(patterns, start=1):
+            edit_key = f"{selected_type}_{pattern['id']}_edit"
             if edit_key not in st.session_state:
                 st.session_state[edit_key] = False
 
@@ -53,16 +70,24 @@ def main():
             with st.expander(f"{idx}. **{pattern['pattern']}**", expanded=False):
                 st.markdown(f"📝 <span style='color:blue'>要因:</span> {pattern['factor']}", unsafe_allow_html=True)
 
-                pattern["results"].sort(key=lambda x: x["count"], reverse=True)
+                kimari = kimari_stats.select(stats["pattern"]["kimari"], pattern["id"])
+                probs = dict(zip(kimari["kimari"], kimari["prob"]))
+                cover = kimari_stats.select(stats["pattern"]["coverage"], pattern["id"])
+                if not cover.empty:
+                    st.caption(" / ".join(
+                        f"上位{n}点 {cover[f'top{n}'].iloc[0]:.0%}" for n in kimari_stats.TOP_N
+                    ))
 
                 for r in pattern["results"]:
                     col1,col2 = st.columns([3,1])
                     with col1:
-                        st.write(f"🎯 {r['kimari']}（{r['count']}）")
+                        if r["kimari"] in probs:
+                            st.write(f"🎯 {r['kimari']}（{r['count']}・{probs[r['kimari']]:.0%}）")
+                        else:
+                            st.write(f"🎯 {r['kimari']}（{r['count']}）")
                     with col2:
-                        if st.button("＋", key=f"plus_{selected_type}_{idx}_{r['kimari']}"):
-                            r["count"] += 1
-                            save_scenarios(scenarios)
+                        if st.button("＋", key=f"plus_{selected_type}_{pattern['id']}_{r['kimari']}"):
+                            db.increment_scenario_result(pattern["id"], r["kimari"])
                             st.rerun()
 
 
@@ -74,6 +99,7 @@ def main():
 
                     st.markdown("### 出目一覧")
 
+                    edited_results = []
 
                     for i, r in enumerate(pattern["results"]):
                         c1, c2, c3 = st.columns([3,2,1])
@@ -95,12 +121,12 @@ def main():
 
                         with c3:
                             if st.button("❌", key=f"{edit_key}_del_{i}"):
-                                pattern["results"].pop(i)
-                                save_scenarios(scenarios)
+                                db.delete_scenario_result(r["id"])
                                 st.rerun()
 
-                        r["kimari"] = kimari
-                        r["count"] = count
+                        # 変更のあった出目だけ保存時に書き込む
+                        if kimari != r["kimari"] or count != r["count"]:
+                            edited_results.append((r["id"], kimari, count))
 
                     st.markdown("---")
                     st.markdown("### 新しい出目を追加")
@@ -117,19 +143,8 @@ def main():
  
                     if st.button("追加", key=f"{edit_key}_add"):
                         new_kimari = f"{n1}-{n2}-{n3}"
-
-                        exists = False
-                        for r in pattern["results"]:
-                            if r["kimari"] == new_kimari:
-                                r["count"] += ncount
-                                exists = True
-
-                        if not exists:
-                            pattern["results"].append(
-                                {"kimari": new_kimari, "count": ncount}
-                            )
-
-                        save_scenarios(scenarios)
+                        # 同じ出目があれば回数を足し、なければ追加
+                        db.increment_scenario_result(pattern["id"], new_kimari, ncount)
                         st.rerun()
 
                     st.markdown("---")
@@ -137,9 +152,7 @@ def main():
                     col1, col2 = st.columns(2)
                     with col1:
                         if st.button("保存", key=f"{edit_key}_save"):
-                            pattern['pattern'] = p_input
-                            pattern['factor'] = f_input
-                            save_scenarios(scenarios)
+                            db.update_scenario_pattern(pattern["id"], p_input, f_input, edited_results)
                             st.session_state[edit_key] = False
                             st.rerun()
                     with col2:
@@ -148,8 +161,7 @@ def main():
                             st.rerun()
                     st.markdown("---")
                     if st.button("🗑 このパターンを削除", key=f"{edit_key}_delete_pattern"):
-                        scenarios[selected_type].pop(idx-1)
-                        save_scenarios(scenarios)
+                        db.delete_scenario_pattern(pattern["id"])
                         st.rerun()
 
                 else:
@@ -178,25 +190,18 @@ def main():
         submitted = st.form_submit_button("追加")
         if submitted:
             if pattern and results:
-                new_entry = {
-                    "pattern": pattern.strip(),
-                    "factor": factor.strip(),
-                    "results": [
-                      {"kimari": results, "count":1}
-                    ]
-                }
-
-                # 重複チェック
-                if new_entry in scenarios[selected_type]:
+                # 同じパターン・要因がすでにあれば None が返る（重複チェック）
+                pattern_id = db.add_scenario_pattern(selected_type, pattern.strip(), factor.strip(), results)
+                if pattern_id is None:
                     st.warning("同じパターンがすでに存在します。")
                 else:
-                    scenarios[selected_type].append(new_entry)
-                    save_scenarios(scenarios)
                     st.success("追加しました！")
                     st.rerun()
             else:
                 st.error("パターンと出目は必須です。")
 
+    perf.finish()
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
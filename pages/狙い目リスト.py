@@ -1,40 +1,17 @@
 import streamlit as st
-import json
-import re
-import os
 from datetime import datetime, timedelta
 
-SAVE_DIR = "local_racecards"
-LIST_FILE = "manual_list.json"
+import db
+import perf
+import watchlist
 
-# ------------------
-# 名前結合関数（6文字基準）
-# ------------------
-def join_name(last, first):
-    total_len = len(last) + len(first)
-    spaces = max(0, 6 - total_len)
-    return last + "　" * spaces + first  # 全角スペース
-
-
-# ------------------
-# 名前分割関数（編集用）
-# ------------------
-def split_name(full_name):
-    # 🔹 全角スペースが1～複数あっても分割できるようにする
-    parts = re.split(r"　+", full_name)
-    if len(parts) == 2:
-        return parts[0], parts[1]
-    return full_name, ""  # 念のため
+perf.start("狙い目リスト")
 
 # ------------------
-# 狙い目リストのロード
+# 狙い目リストのロード（manual_list.json ＋ 追記ログ）
 # ------------------
-if not os.path.exists(LIST_FILE):
-    with open(LIST_FILE, "w", encoding="utf-8") as f:
-        json.dump([], f, ensure_ascii=False, indent=2)
-
-with open(LIST_FILE, "r", encoding="utf-8") as f:
-    manual_list = json.load(f)
+with perf.stage("リストの読み込み"):
+    manual_list = watchlist.load_list()
 
 # ------------------
 # 明日・今日の狙い目リスト表示（日付切替）
@@ -49,31 +26,17 @@ tomorrow = (datetime.now() + timedelta(days=1)).strftime("%Y%m%d")
 selected_label = st.selectbox("日付を選択", ["今日", "明日"])
 selected_date = today if selected_label == "今日" else tomorrow
 
-# 選択日のファイルを取得
-files = sorted([f for f in os.listdir(SAVE_DIR) if f.startswith(selected_date)])
+# 選択日の出走表をまとめて取得（1クエリ）
+with perf.stage("出走表"):
+    racecards = db.load_racecards_by_date(selected_date)
 
 st.header(f"📌 {selected_label}の狙い目リスト")
-if not files:
+if not racecards:
     st.warning(f"{selected_date} の出走表が見つかりません")
 else:
-    venue_races = {}
-    for filename in files:
-        date, venue, race = filename.replace(".json","").split("_")
-        with open(os.path.join(SAVE_DIR, filename), "r", encoding="utf-8") as f:
-            racers = json.load(f)
-
-        for r in racers:
-            match = next((m for m in manual_list if m["name"] == r["name"] and m["lane"] == r["lane"]), None)
-            if match:
-                color = "green" if match["mark"] == "◯" else "red"
-                text = {
-                    "lane": r["lane"],
-                    "name": r["name"],
-                    "note": match["note"],
-                    "mark": match["mark"],
-                    "color": color
-                }
-                venue_races.setdefault(venue, {}).setdefault(int(race), []).append(text)
+    # (正規化した選手名, コース) のインデックスと突き合わせる
+    with perf.stage("突き合わせ"):
+        venue_races = watchlist.build_day_view(racecards)
 
     # 場ごと・レースごとに表示
     for venue, races in venue_races.items():
@@ -114,14 +77,12 @@ if search_last or search_first:
             if col5.button("編集", key=f"btn_edit_{i}"):  # key をボタン専用にする
                 st.session_state[f"edit_{i}"] = True
             if col6.button("削除", key=f"del_{i}"):
-                manual_list.remove(m)
-                with open(LIST_FILE, "w", encoding="utf-8") as f:
-                    json.dump(manual_list, f, ensure_ascii=False, indent=2)
+                watchlist.delete_entry(m["id"])
                 st.success("削除しました")
                 st.rerun()
 
             if st.session_state.get(f"edit_{i}", False):
-                last_name, first_name = split_name(m["name"])
+                last_name, first_name = watchlist.split_name(m["name"])
                 with st.form(f"form_edit_{i}"):
                     new_last = st.text_input("苗字", value=last_name)
                     new_first = st.text_input("名前", value=first_name)
@@ -130,12 +91,13 @@ if search_last or search_first:
                     new_mark = st.radio("評価", ["◯","△"], index=0 if m["mark"]=="◯" else 1)
                     submitted = st.form_submit_button("更新")
                     if submitted:
-                        m["name"] = join_name(new_last, new_first)
-                        m["lane"] = new_lane
-                        m["note"] = new_note
-                        m["mark"] = new_mark
-                        with open(LIST_FILE, "w", encoding="utf-8") as f:
-                            json.dump(manual_list, f, ensure_ascii=False, indent=2)
+                        watchlist.update_entry(
+                            m["id"],
+                            name=watchlist.join_name(new_last, new_first),
+                            lane=new_lane,
+                            note=new_note,
+                            mark=new_mark
+                        )
                         st.success("更新しました")
                         st.session_state[f"edit_{i}"] = False
                         st.rerun()
@@ -155,9 +117,8 @@ with st.form("add_form", clear_on_submit=True):
     submitted = st.form_submit_button("追加")
 
 if submitted:
-    full_name = join_name(last_name, first_name)
-    new_entry = {"name": full_name, "lane": lane, "note": note, "mark": mark}
-    manual_list.append(new_entry)
-    with open(LIST_FILE, "w", encoding="utf-8") as f:
-        json.dump(manual_list, f, ensure_ascii=False, indent=2)
-    st.success(f"追加しました！ → {full_name}")
\ No newline at end of file
+    full_name = watchlist.join_name(last_name, first_name)
+    watchlist.add_entry(full_name, lane, note, mark)
+    st.success(f"追加しました！ → {full_name}")
+
+perf.finish()
@@ -1,249 +1,116 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
 import requests
-from bs4 import BeautifulSoup
 import datetime
-import os
-import json
-
-# --- オフライン用の読み込み関数 ---
-def load_local_racecard(date_str, venue_name, race_number):
-    file_name = f"{date_str}_{venue_name}_{race_number:02}.json"
-    file_path = os.path.join("local_racecards", file_name)
-
-    if os.path.exists(file_path):
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return [entry["name"] for entry in data]
+import time
+
+import charts
+import db
+import perf
+import player_summary
+import prefetch
+import racecard
+
+perf.start("選手データ")
+
+# 詳細の表示のしかた（6人分の円グラフをまとめて送ると重いので、選手ごとに開く・棒グラフにすることもできる）
+VIEW_ALL = "すべて表示"
+VIEW_LAZY = "選手ごとに開く"
+CHART_PIE = "円グラフ"
+CHART_BAR = "軽量（棒グラフ）"
+
+# この実行で表示したグラフの数・送った量・詳細の表示にかかった時間（表示の計測用）
+render_stats = {"charts": 0, "bytes": 0, "seconds": 0.0}
+
+
+@perf.timed("グラフ")
+def show_chart(cache_key, chart_key, frame, names, values, title, hole=0.3, show_labels=False):
+    # 円グラフは charts のキャッシュから、軽量表示は値だけの棒グラフにする
+    if chart_style == CHART_BAR:
+        data, size = charts.bar_data(frame, names, values)
+        st.caption(title)
+        st.bar_chart(data, x=names, y=values, horizontal=True, use_container_width=True)
     else:
-        return None
+        fig, size = charts.pie(cache_key, frame, names, values, title, hole, show_labels)
+        st.plotly_chart(fig, use_container_width=True, key=chart_key)
+    render_stats["charts"] += 1
+    render_stats["bytes"] += size
 
-def get_race_data_from_csv(player_name, course_num):
-    # CSVファイルのパスを指定（SQLiteのdb_pathと同じディレクトリ構成を想定）
-    csv_path = os.path.join(os.path.dirname(__file__), "..", "boatrace_data.csv")
-    df = pd.read_csv(csv_path)
 
-    # 条件でフィルタリング
-    filtered_df = df[(df["player_name"] == player_name) & (df["course_in"] == course_num)]
-
-    # もし空なら空リストを返す
-    if filtered_df.empty:
-        return []
-
-    # SQLiteのfetchall()と同様にリストのタプルに変換して返す
-    return filtered_df.values.tolist()
-
-# color_map を定義（app全体で共通化して使えるように）
-color_map = {
-    # ①（1コース）
-    "逃げ": "blue",
-    "差され": "green",
-    "捲り差され": "yellow",
-    "捲られ": "red",
-
-    # ②〜⑥共通（色分類に基づいて設定）
-    "差し": "green",
-    "2外見て差し":"green",
-    "4外見て差し":"green",
-    "外マイ": "indianred",
-    "ジカマ": "firebrick",
-    "ツケマイ": "tomato",
-    "箱捲り": "tomato",
-    "絞り捲り": "lightcoral",
-    "叩いて外マイ": "crimson",
-
-    "捲り差し": "khaki",
-    "後手捲り差し": "goldenrod",
-    "叩いて捲り差し": "khaki",
-    "1-2捲り差し": "gold",
-    "2-4捲り差し": "goldenrod",
-    "捲り差し・外マイ": "goldenrod",
-
-    "2捲り展開": "rebeccapurple",
-    "3捲り展開": "rebeccapurple",
-    "4捲り展開": "rebeccapurple",
-    "5捲り展開": "rebeccapurple",
-    "3ツケマイ展開": "rebeccapurple",
-    "3絞り展開": "slateblue",
-    "4絞り展開": "slateblue",
-    "5絞り展開": "slateblue",
-    "展開差し・捲り差し": "thistle",
-    "他艇捲り展開": "thistle",
-    "展開捲り差し・外マイ": "thistle",
-    "展開差し・捲り差し・外マイ": "thistle",
-
-    "3捲り差され": "darkgray",
-    "捲られ・叩かれ": "gray",
-    "ブロック負け": "lightgray",
-    "2外被り": "lightgray",
-    "3差し被り": "lightgray",
-    "4外被り": "lightgray",
-    "5差し被り": "lightgray",
-    "5捲り差され": "darkgray",
-    "後手": "darkslategray",
-
-    "2": "black",
-    "3": "red",
-    "4": "blue",
-    "5": "yellow",
-    "6": "green",
-    "記録なし": "gray"
-}
-
-
-def show_movement_summary(data_rows,player_name):
-    # data_rowsはget_race_data_from_dbの戻り値（リスト）
-    if not data_rows:
+@perf.timed("選手ごとの表示")
+def show_movement_summary(summary, rivals, player_name, course_num, since=None, player_id=None):
+    # summary / rivals は get_race_summary の戻り値（動き別の集計済みの行）
+    summary = summary[summary["count"] > 0]
+    if summary.empty:
         st.info("データがありません。")
         return
 
-    # DataFrameに変換（カラム名付き）
-    columns = [
-        "id", "date", "venue_name", "race_number", "course_in", "player_name", "move", 
-        "second_place", "lost_to", "rank",
-        "flow", "cabi", "kawarizensoku", "attack", "pressure",
-        "block","three_hari",
-        "three_makurizashi", "two_nokoshi", "four_tsubushi", "four_nokoshi", "st_eval", "two_shizumase", "four_shizumase", "makurizashi_flow_cabi"
-    ]
-    df = pd.DataFrame(data_rows, columns=columns)
-
-
-    # rankの前後スペースを除去しておく（表記ブレ対策）
-    df["rank"] = df["rank"].astype(str).str.strip()
-
-    # 1着の判定：rankが"1" または course_in==1 かつ move=="逃げ"
-    df["is_win"] = ((df["rank"] == "1") | ((df["course_in"] == 1) & (df["move"] == "逃げ")))
-
-    # 着順ごとの判定（1コース逃げ以外は rank に値がある
-    df["is_2nd"] = (df["rank"] == "2")
-    df["is_3rd"] = (df["rank"] == "3")
-    df["is_out"] = (df["rank"] == "着外")
-
-    # 動きごとに集計
-    movement_summary = df.groupby("move").agg(
-        count=('move', 'count'),
-        win=('is_win', 'sum'),
-        place2=('is_2nd', 'sum'),
-        place3=('is_3rd', 'sum'),
-        out=('is_out', 'sum')
-    ).reset_index()
-
-    # 回数順に並べ替え
-    movement_summary = movement_summary.sort_values("count", ascending=False)
-
-    # 表表示（割合なし）
-    movement_summary = movement_summary[["move", "count", "win", "place2", "place3", "out"]]
-    movement_summary = movement_summary.rename(columns={
-        "move": "動き", "count": "回数", "win": "1着", "place2": "2着", "place3": "3着", "out": "着外"
-    })
+    with perf.stage("動きの集計"):
+        # 動きごとの集計（動きが空の行は補足項目・ST評価の合計にだけ使う）。回数順・割合なし
+        movement_summary = player_summary.movement_table(summary)
 
     st.markdown("---")
     st.markdown("#### 動きの傾向")
     st.dataframe(movement_summary, use_container_width=True, hide_index=True)
 
     # 円グラフ（割合表示あり）
-    fig = px.pie(
-        movement_summary,
-        names="動き",
-        values="回数",
-        title="動きの割合",
-        hole=0.4,
-        color="動き",
-        color_discrete_map=color_map
+    show_chart(
+        ("move", player_name, course_num, since, player_id),
+        f"move_summary_{player_name}",
+        movement_summary, "動き", "回数", "動きの割合", hole=0.4, show_labels=True,
     )
-    fig.update_traces(textinfo='percent+label')  # ← 割合とラベルを表示
-    st.plotly_chart(fig, key=f"move_summary_{player_name}")
 
-    df_move = df[df["move"].notnull()]  # 念のためnull除外（任意）
-
-    if df_move.empty:
+    if movement_summary.empty:
         st.write("データがありません。")
         return
 
-    # 現在の進入コース（すべて同じはず）
-    course_num = df_move["course_in"].iloc[0]
-
     # 1コースの場合のみ動きのセレクトボックスと詳細表示
     if course_num == 1:
         selected_move = st.selectbox("表示する動きを選んでください", movement_summary["動き"], key=f"select_move_{player_name}")
-        df_move = df_move[df_move["move"] == selected_move]
-
-        if df_move.empty:
-            st.write("選択された動きのデータがありません。")
-            return
-
-        if selected_move == "逃げ":
-            if "second_place" in df_move.columns:
-                second_course_counts = df_move["second_place"].value_counts().reset_index()
-                second_course_counts.columns = ["2着コース", "回数"]
-                fig = px.pie(second_course_counts, names="2着コース", values="回数", title="2着の相手コース", hole=0.3, color="2着コース", color_discrete_map=color_map)
-                st.plotly_chart(fig, use_container_width=True, key=f"pie_nige_2nd_{player_name}_{selected_move}_{course_num}")
-
-        elif selected_move in ["差され", "捲られ", "捲り差され"]:
-            if "lost_to" in df_move.columns:
-                rival_counts = df_move["lost_to"].value_counts().reset_index()
-                rival_counts.columns = ["負けたコース", "回数"]
-                fig1 = px.pie(rival_counts, names="負けたコース", values="回数", title="負けたコース", hole=0.3, color="負けたコース",color_discrete_map=color_map)
-                st.plotly_chart(fig1, use_container_width=True, key=f"pie_lose_course_{player_name}_{selected_move}_{course_num}")
+        # 逃げは2着の相手コース、差され・捲られ・捲り差されは負けたコースの内訳
+        rival_counts = player_summary.rival_table(rivals, selected_move)
+
+        if rival_counts is not None and not rival_counts.empty:
+            if selected_move == "逃げ":
+                show_chart(
+                    ("nige_2nd", player_name, course_num, since, player_id),
+                    f"pie_nige_2nd_{player_name}_{selected_move}_{course_num}",
+                    rival_counts, "2着コース", "回数", "2着の相手コース",
+                )
+            else:
+                show_chart(
+                    ("lost_to", player_name, course_num, since, player_id, selected_move),
+                    f"pie_lose_course_{player_name}_{selected_move}_{course_num}",
+                    rival_counts, "負けたコース", "回数", "負けたコース",
+                )
 
     ### ③ 補足項目（コース別に表示）
-    補足項目 = {
-        1: ["flow", "kawarizensoku", "block", "three_hari"],
-        2: ["flow", "cabi", "kawarizensoku", "attack", "pressure", "three_makurizashi"],
-        3: ["flow", "cabi", "kawarizensoku", "attack", "pressure", "two_nokoshi", "four_tsubushi", "two_shizumase", "makurizashi_flow_cabi"],
-        4: ["flow", "cabi", "kawarizensoku", "attack", "pressure"],
-        5: ["flow", "cabi", "kawarizensoku", "attack", "pressure", "four_nokoshi", "four_shizumase"],
-        6: ["attack", "pressure"]
-    }
-
-    # 英語 → 日本語 の対応辞書
-    japanese_labels = {
-        "flow": "流れ",
-        "cabi": "キャビ",
-        "kawarizensoku": "かわり全速",
-        "attack": "攻め",
-        "pressure": "圧",
-        "block": "捲りブロック",
-        "three_hari": "3張",
-        "three_makurizashi": "3捲り差し1着",
-        "two_nokoshi": "2残し",
-        "four_tsubushi": "4潰し",
-        "four_nokoshi": "4残し",
-        "two_shizumase": "2沈ませ",
-        "four_shizumase": "4沈ませ",
-        "makurizashi_flow_cabi": "捲り差し流れ・キャビ"
-    }
-
-
-    selected_items = 補足項目.get(course_num, [])
+    selected_items = player_summary.SUPPLEMENT_ITEMS.get(course_num, [])
 
     if selected_items:
         st.markdown("#### 補足項目")
-        rows = []
-        for item in selected_items:
-            if item in df.columns:
-                count = df[item].sum()
-                total = len(df)
-                rows.append({"項目": japanese_labels.get(item, item), "回数": count, "割合": f"{round(count / total * 100, 1)}%"})
-
-        if rows:
-            df_supplement = pd.DataFrame(rows)
+        df_supplement = player_summary.supplement_table(summary, course_num)
+        if not df_supplement.empty:
             st.dataframe(df_supplement, use_container_width=True, hide_index=True)
 
+        # 補足項目の組み合わせ（例: 流れ AND キャビ）はビット演算で数える
+        labels = {player_summary.FLAG_LABELS.get(item, item): item for item in selected_items}
+        combo = st.multiselect(
+            "組み合わせ（すべて当てはまった回数）", list(labels), key=f"flag_combo_{player_name}_{course_num}"
+        )
+        if len(combo) >= 2:
+            with perf.stage("組み合わせの集計"):
+                hit, count = db.count_flag_combination(
+                    player_name, course_num, [labels[c] for c in combo], since, player_id
+                )
+            if count:
+                st.write(f"{' かつ '.join(combo)}: {hit}回 / {count}回（{round(hit / count * 100, 1)}%）")
+
 
     ### ④ ST評価（出遅・抜出）
-    if "st_eval" in df.columns:
-        st.markdown("#### ST評価")
-
-        count_df = df["st_eval"].value_counts(dropna=False).reset_index()
-        count_df.columns = ["評価", "回数"]
-        total = count_df["回数"].sum()
-        count_df["割合"] = count_df["回数"].apply(
-            lambda x: f"{round(x / total * 100)}%"
-        )
+    st.markdown("#### ST評価")
+    count_df = player_summary.st_table(summary)
 
-        st.dataframe(count_df, use_container_width=True, hide_index=True)
+    st.dataframe(count_df, use_container_width=True, hide_index=True)
 
 
 st.markdown("<h2 style='text-align: center;'>コース別選手データ</h2>", unsafe_allow_html=True)
@@ -268,29 +135,27 @@ with col1:
 with col2:
     race_number = st.selectbox("レースを選択", list(range(1, 13)))
 
-venue_code = venues[venue_name]
-url = f"https://www.boatrace.jp/owpc/pc/race/racelist?rno={race_number}&jcd={venue_code}&hd={date_str}"
+# 集計期間（直近に絞った場合もインデックスの範囲検索で済む）
+periods = {"全期間": None, "直近1年": 365, "直近半年": 182, "直近3ヶ月": 91}
+period = st.selectbox("集計期間", list(periods.keys()))
+since = (today - datetime.timedelta(days=periods[period])).isoformat() if periods[period] else None
 
-@st.cache_data(ttl=3600)
-def get_racer_names(url, date_str, venue_name, race_number):
-    # ① まずローカルに出走表があるか確認
-    local_data = load_local_racecard(date_str, venue_name, race_number)
-    if local_data:
-        return local_data
+col1, col2 = st.columns(2)
+with col1:
+    view_mode = st.radio("詳細の表示", [VIEW_ALL, VIEW_LAZY], horizontal=True, key="player_view_mode")
+with col2:
+    chart_style = st.radio("グラフ", [CHART_PIE, CHART_BAR], horizontal=True, key="player_chart_style")
 
-    # ② なければオンラインで取得
-    try:
-        res = requests.get(url)
-        res.raise_for_status()
-        soup = BeautifulSoup(res.content, "html.parser")
-        name_tags = soup.select("div.is-fs18.is-fBold a")
 
-        if not name_tags:
+@perf.timed("出走表")
+def get_racer_names(date_str, venue_name, race_number):
+    # ローカル保存 → ディスクキャッシュ（http_cache.db）→ オンラインの順に探す
+    try:
+        racer_names = racecard.load_racer_names(date_str, venue_name, race_number)
+        if not racer_names:
             # オンラインでも選手名が取得できない（ページ構成変化 or 未公開）
             st.warning("出走表が見つかりませんでした（ローカルにもオンラインにもありません）")
-            return []
-
-        return [tag.text.strip() for tag in name_tags]
+        return racer_names
 
     except requests.exceptions.RequestException as e:
         st.warning("通信エラーが発生しました（オフラインとみなします）")
@@ -305,14 +170,14 @@ def get_racer_names(url, date_str, venue_name, race_number):
         return []
 
 # 先に関数としてリセット処理を定義しておく
-def reset_shortcut_and_course_states(date_str, race_number, venue_name, url):
+def reset_shortcut_and_course_states(date_str, race_number, venue_name):
 
     # --- コース進入セレクトボックスのリセット（UI） ---
     for i in range(6):
         st.session_state[f"course_pos_{i}"] = i + 1
 
     # --- 選手ごとのステート初期化 ---
-    racer_names = get_racer_names(url, date_str, venue_name, race_number)
+    racer_names = get_racer_names(date_str, venue_name, race_number)
     for i, name in enumerate(racer_names, start=1):
         key_prefix = f"{date_str}_{race_number}_{name}"
         keys_to_clear = [
@@ -333,17 +198,24 @@ if "prev_date_str" not in st.session_state:
 
 # レース or 日付が変わったらリセット
 if st.session_state.prev_race_number != race_number or st.session_state.prev_date_str != date_str:
-    reset_shortcut_and_course_states(date_str, race_number, venue_name, url)
+    reset_shortcut_and_course_states(date_str, race_number, venue_name)
     st.session_state.prev_race_number = race_number
     st.session_state.prev_date_str = date_str
 
 
 
 
-racer_names = get_racer_names(url, date_str, venue_name, race_number)
+racer_names = get_racer_names(date_str, venue_name, race_number)
+
+# 入力・閲覧している間に次のレースの出走表と選手データを先読みしておく
+if racer_names and race_number < 12:
+    prefetch.prefetch_race(date_str, venue_name, race_number + 1)
 
 try:
     if racer_names:
+        # 出走表のリンクから取った登録番号（{選手名: 登録番号}）
+        player_ids = racecard.load_player_ids(date_str, venue_name, race_number)
+
         st.markdown(f"### {venue_name} {race_number}R 出走表")
 
         st.markdown("### 進入コース")
@@ -380,6 +252,31 @@ try:
         
         record_data = []
 
+        # 6人分の進入コース（コース選択の値はこの実行の前にセッションに入っている）を先に決めて、
+        # 集計を1回でまとめて読む
+        entries = []
+        for i, name in enumerate(racer_names, start=1):
+            key_prefix = f"{date}_{race_number}_{name}"
+            saved_course_in = st.session_state.get(f"{key_prefix}_course_in", i)
+            default_course = saved_course_in if 1 <= saved_course_in <= 6 else i
+            course_in = st.session_state.get(f"{key_prefix}_course_in_selectbox", default_course)
+            entries.append((name, course_in, player_ids.get(name)))
+        with perf.stage("集計の読み込み"):
+            all_summary, all_rivals = player_summary.load_entries(entries, since)
+
+        st.markdown("### 6選手の比較")
+        with perf.stage("比較表"):
+            compare_table = player_summary.compare_entries(entries, all_summary)
+        st.dataframe(
+            compare_table,
+            use_container_width=True,
+            hide_index=True,
+            column_config={
+                col: st.column_config.NumberColumn(col, format="percent")
+                for col in ["1着率", "2連対率", "3連対率", "抜出", "出遅"]
+            },
+        )
+
         for i, name in enumerate(racer_names, start=1):
             key_prefix = f"{date}_{race_number}_{name}"
 
@@ -418,13 +315,33 @@ try:
             # 必要に応じて、ここに選手名と選択されたコースを保存する処理などを追加できます
             # 例: record_data.append({"選手名": name, "進入コース": selected_course}
 
-            race_data = get_race_data_from_csv(name, course_in)
+            # 選手ごとに開くときは、開いた選手の分だけ表とグラフを作る
+            if view_mode == VIEW_LAZY and not st.toggle("詳細を表示", key=f"{key_prefix}_detail"):
+                continue
+
+            started = time.perf_counter()
+            if course_in == entries[i - 1][1]:
+                summary, rivals = player_summary.select_entry(all_summary, all_rivals, i - 1)
+            else:
+                # 先に読んだときとコースが違う（ふつうは起きない）ときだけ1人分を読み直す
+                entry = [(name, course_in, player_ids.get(name))]
+                with perf.stage("集計の読み込み"):
+                    summary, rivals = player_summary.select_entry(*player_summary.load_entries(entry, since), 0)
 
             # 動きの表＋円グラフを表示 ←★ここで表示実行
-            show_movement_summary(race_data, name)
+            show_movement_summary(summary, rivals, name, course_in, since, player_ids.get(name))
+            render_stats["seconds"] += time.perf_counter() - started
+
+        with st.expander("表示の計測（この実行分）"):
+            st.write(
+                f"グラフ {render_stats['charts']}個 / 送信量 約{render_stats['bytes'] / 1024:.1f}KB / "
+                f"詳細の表示 {render_stats['seconds'] * 1000:.0f}ms"
+            )
 
         # 最後に course_order を保存
         st.session_state["course_order"] = course_order
 
 except Exception as e:
-    st.error(f"データの取得中にエラーが発生しました: {e}")
\ No newline at end of file
+    st.error(f"データの取得中にエラーが発生しました: {e}")
+
+perf.finish()
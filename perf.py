@@ -0,0 +1,245 @@
+"""
+ページの処理時間の計測（1回の実行ごと・名前をつけた区間ごと）
+
+    perf.start("選手データ")          # スクリプトの最初で
+    with perf.stage("集計の読み込み"):  # 測りたい区間（関数なら @perf.timed("出走表")）
+        ...
+    perf.finish()                     # スクリプトの最後で（perf_metrics.db に追記し、サイドバーに内訳を出す）
+
+区間が入れ子になったときは内側の時間を外側から除く（各区間 + その他 = 全体）。
+同じ名前の区間を何度通っても（6人分など）1つにまとめて、時間と回数を合計する。
+Streamlit はセッションごとに別スレッドでスクリプトを動かすので、実行中の記録はスレッドごとに持つ。
+st.rerun / st.stop で途中で終わった実行は記録しない（次の start で捨てる）。
+
+記録は boatrace_data.db とは別の perf_metrics.db に入れる（書き込みで db の集計キャッシュを無効にしないため）。
+KEEP_DAYS 日より古い記録は、プロセスで最初に書き込むときに消す。
+
+    python perf.py [日付]   # その日のページ・区間ごとの p50 / p95（既定は今日）
+"""
+import datetime
+import functools
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+METRICS_FILE = os.path.join(BASE_DIR, "perf_metrics.db")
+
+KEEP_DAYS = 30
+
+# 区間以外の時間・実行全体の時間を記録するときの区間名
+OTHER = "その他"
+TOTAL = "全体"
+
+CREATE_METRICS_SQL = """
+CREATE TABLE IF NOT EXISTS perf_metrics (
+    id INTEGER PRIMARY KEY,
+    run_at TEXT NOT NULL,
+    day TEXT NOT NULL,
+    page TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    ms REAL NOT NULL,
+    calls INTEGER NOT NULL DEFAULT 1
+)
+"""
+
+INSERT_METRICS_SQL = """
+INSERT INTO perf_metrics (run_at, day, page, stage, ms, calls) VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+_local = threading.local()
+_conn = None
+_conn_lock = threading.RLock()
+
+
+class Run:
+    """1回の実行の記録（区間名 → [秒, 回数]）"""
+
+    def __init__(self, page):
+        self.page = page
+        self.started_at = datetime.datetime.now()
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.stack = []  # 実行中の区間 [名前, 測り始め]
+
+    def add(self, name, seconds, calls):
+        entry = self.stages.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += calls
+
+
+def start(page):
+    """このスレッドでの実行の計測を始める（前の実行の記録が残っていれば捨てる）"""
+    _local.run = Run(page)
+
+
+def current():
+    return getattr(_local, "run", None)
+
+
+@contextmanager
+def stage(name):
+    """区間の時間を測る（start していなければ何もしない）"""
+    run = current()
+    if run is None:
+        yield
+        return
+    now = time.perf_counter()
+    if run.stack:
+        # 外側の区間はここまでの分を足して止めておく
+        parent = run.stack[-1]
+        run.add(parent[0], now - parent[1], 0)
+    entry = [name, now]
+    run.stack.append(entry)
+    try:
+        yield
+    finally:
+        now = time.perf_counter()
+        run.stack.remove(entry)
+        run.add(name, now - entry[1], 1)
+        if run.stack:
+            run.stack[-1][1] = now
+
+
+def timed(name):
+    """関数の呼び出しを区間として測るデコレーター"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def finish(panel=True):
+    """
+    実行の計測を終えて [(区間, ミリ秒, 回数), ...]（時間の長い順。最後に その他・全体）を返し、
+    perf_metrics.db に追記する。panel=True ならサイドバーに内訳を出す（チェックを入れたときだけ）
+    """
+    run = current()
+    _local.run = None
+    if run is None:
+        return []
+    total = time.perf_counter() - run.started
+    timings = sorted(((name, s * 1000, calls) for name, (s, calls) in run.stages.items()), key=lambda t: -t[1])
+    timings.append((OTHER, max(0.0, total * 1000 - sum(ms for _, ms, _ in timings)), 1))
+    timings.append((TOTAL, total * 1000, 1))
+    try:
+        _write(run, timings)
+    except sqlite3.Error as e:
+        # 計測の記録に失敗しても画面は止めない
+        print(f"処理時間の記録に失敗しました: {e}", file=sys.stderr)
+    if panel:
+        _show_panel(run.page, timings)
+    return timings
+
+
+# --- 記録 ---
+
+def _get_conn():
+    global _conn
+    with _conn_lock:
+        if _conn is None:
+            conn = sqlite3.connect(METRICS_FILE, check_same_thread=False, isolation_level=None, timeout=5)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute(CREATE_METRICS_SQL)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_perf_metrics_day ON perf_metrics (day, page)")
+            cutoff = (datetime.date.today() - datetime.timedelta(days=KEEP_DAYS)).isoformat()
+            conn.execute("DELETE FROM perf_metrics WHERE day < ?", (cutoff,))
+            _conn = conn
+        return _conn
+
+
+def _write(run, timings):
+    run_at = run.started_at.isoformat(timespec="seconds")
+    day = run.started_at.date().isoformat()
+    with _conn_lock:
+        conn = _get_conn()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(INSERT_METRICS_SQL, [(run_at, day, run.page, name, ms, calls) for name, ms, calls in timings])
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+def load_metrics(day=None, page=None):
+    """その日（既定は今日）の記録を DataFrame（run_at, page, stage, ms, calls）で返す"""
+    day = day or datetime.date.today().isoformat()
+    sql = "SELECT run_at, page, stage, ms, calls FROM perf_metrics WHERE day = ?"
+    params = [day]
+    if page:
+        sql += " AND page = ?"
+        params.append(page)
+    with _conn_lock:
+        rows = _get_conn().execute(sql, params).fetchall()
+    return pd.DataFrame(rows, columns=["run_at", "page", "stage", "ms", "calls"])
+
+
+def percentiles(day=None, page=None):
+    """ページ・区間ごとの実行回数・p50・p95・最大（ミリ秒）"""
+    df = load_metrics(day, page)
+    if df.empty:
+        return pd.DataFrame(columns=["page", "stage", "runs", "p50", "p95", "max"])
+    grouped = df.groupby(["page", "stage"])["ms"]
+    result = pd.DataFrame({
+        "runs": grouped.size(),
+        "p50": grouped.quantile(0.5),
+        "p95": grouped.quantile(0.95),
+        "max": grouped.max(),
+    })
+    return result.reset_index().sort_values(["page", "p95"], ascending=[True, False], ignore_index=True)
+
+
+def hourly(day=None, page=None):
+    """実行全体の時間の1時間ごとの p50・p95（行: 時、列: p50 / p95）"""
+    df = load_metrics(day, page)
+    df = df[df["stage"] == TOTAL]
+    if df.empty:
+        return pd.DataFrame(columns=["p50", "p95"])
+    grouped = df.groupby(df["run_at"].str[11:13].rename("時"))["ms"]
+    return pd.DataFrame({"p50": grouped.quantile(0.5), "p95": grouped.quantile(0.95)})
+
+
+# --- サイドバーの表示 ---
+
+def _show_panel(page, timings):
+    import streamlit as st
+
+    if not st.sidebar.checkbox("処理時間を表示", key="perf_panel"):
+        return
+    st.sidebar.markdown(f"**{page}** この実行: {timings[-1][1]:.0f}ms")
+    st.sidebar.dataframe(
+        pd.DataFrame(timings[:-1], columns=["区間", "ms", "回数"]).round({"ms": 1}),
+        use_container_width=True,
+        hide_index=True,
+    )
+    today = percentiles(page=page)
+    if not today.empty:
+        st.sidebar.markdown("今日の p50 / p95（ms）")
+        st.sidebar.dataframe(
+            today[["stage", "runs", "p50", "p95"]].rename(columns={"stage": "区間", "runs": "回数"}).round(1),
+            use_container_width=True,
+            hide_index=True,
+        )
+        st.sidebar.line_chart(hourly(page=page), use_container_width=True)
+
+
+if __name__ == "__main__":
+    day = sys.argv[1] if len(sys.argv) > 1 else None
+    table = percentiles(day)
+    if table.empty:
+        print("記録がありません")
+        sys.exit()
+    for page, rows in table.groupby("page", sort=False):
+        print(f"[{page}]")
+        for row in rows.itertuples():
+            print(f"  {row.stage:<16} {row.runs:>5}回  p50 {row.p50:8.1f}ms  p95 {row.p95:8.1f}ms  最大 {row.max:8.1f}ms")
@@ -0,0 +1,245 @@
+"""
+選手データページの集計（出走表の6人分をまとめて）
+
+選手・進入コースごとの動き別集計（db.SUMMARY_COLUMNS）と相手コース（db.RIVAL_COLUMNS）を
+6人分まとめて読み、1つの DataFrame（entry 列 = 出走表での並び）で持つ。
+  - 全期間: 集計テーブルを行値の IN で1回ずつ読む（db.load_player_summaries）。
+    登録番号の分かる選手は登録番号の集計と、登録番号のない行の名前での集計を足す
+  - 期間指定: 6人分の履歴を1回のクエリで読み、entry ごとに1回の groupby で集計する
+compare_entries() でその結果から6人の比較表を作る。
+movement_table() など（1人分の表）は選手データページと day_report.py（1日分の一括出力）で共通に使う。
+streamlit には依存しない。
+"""
+import numpy as np
+import pandas as pd
+
+import db
+import race_history
+
+# 比較表の列
+COMPARE_COLUMNS = ["枠", "選手", "コース", "出走", "1着率", "2連対率", "3連対率", "最多の動き", "抜出", "出遅"]
+
+# 動きの表の列（集計の列 → 表示名）
+MOVEMENT_LABELS = {"move": "動き", "count": "回数", "win": "1着", "place2": "2着", "place3": "3着", "out": "着外"}
+
+# 1コースのとき、動きごとに内訳を出す相手（動き → 相手の種類）と、その列名
+RIVAL_OF_MOVE = {"逃げ": "second_place", "差され": "lost_to", "捲られ": "lost_to", "捲り差され": "lost_to"}
+RIVAL_LABELS = {"second_place": "2着コース", "lost_to": "負けたコース"}
+
+# 補足項目（コース別に表示）
+SUPPLEMENT_ITEMS = {
+    1: ["flow", "kawarizensoku", "block", "three_hari"],
+    2: ["flow", "cabi", "kawarizensoku", "attack", "pressure", "three_makurizashi"],
+    3: ["flow", "cabi", "kawarizensoku", "attack", "pressure", "two_nokoshi", "four_tsubushi", "two_shizumase", "makurizashi_flow_cabi"],
+    4: ["flow", "cabi", "kawarizensoku", "attack", "pressure"],
+    5: ["flow", "cabi", "kawarizensoku", "attack", "pressure", "four_nokoshi", "four_shizumase"],
+    6: ["attack", "pressure"]
+}
+
+# 英語 → 日本語 の対応辞書
+FLAG_LABELS = {
+    "flow": "流れ",
+    "cabi": "キャビ",
+    "kawarizensoku": "かわり全速",
+    "attack": "攻め",
+    "pressure": "圧",
+    "block": "捲りブロック",
+    "three_hari": "3張",
+    "three_makurizashi": "3捲り差し1着",
+    "two_nokoshi": "2残し",
+    "four_tsubushi": "4潰し",
+    "four_nokoshi": "4残し",
+    "two_shizumase": "2沈ませ",
+    "four_shizumase": "4沈ませ",
+    "makurizashi_flow_cabi": "捲り差し流れ・キャビ"
+}
+
+# ST評価（出遅・抜出）。data_rec.py の選択肢にない値や空の行は「その他」
+ST_LABELS = {
+    "st_none": "なし", "st_nuke": "抜出（内より-0.10）", "st_deoku": "出遅（外より+0.10）", "st_other": "その他"
+}
+
+
+def summarize_race_df(df, keys=()):
+    """生データを集計テーブルと同じ形（keys + SUMMARY_COLUMNS / keys + RIVAL_COLUMNS）に集計する"""
+    keys = list(keys)
+    move = df["move"].astype(object).fillna("")
+    st_eval = df["st_eval"].astype("string").fillna("")
+    is_nuke = st_eval.str.startswith("抜出")
+    is_deoku = st_eval.str.startswith("出遅")
+    is_none = st_eval.str.strip() == "なし"
+    # 補足項目は flags のビットを全項目まとめて展開する
+    flags = race_history.decode_flags(df["flags"])
+
+    counts = pd.DataFrame({
+        **{key: df[key] for key in keys},
+        "move": move,
+        "count": 1,
+        # 1着の判定：rankが"1" または course_in==1 かつ move=="逃げ"
+        "win": (df["rank"] == "1") | ((df["course_in"] == 1) & (move == "逃げ")),
+        "place2": df["rank"] == "2",
+        "place3": df["rank"] == "3",
+        "out": df["rank"] == "着外",
+        **{flag: flags[flag] for flag in db.FLAG_COLUMNS},
+        "st_none": is_none,
+        "st_nuke": is_nuke,
+        "st_deoku": is_deoku,
+        "st_other": ~(is_nuke | is_deoku | is_none),
+    })
+    summary = counts.groupby(keys + ["move"], as_index=False).sum()
+    for col in db.SUMMARY_COUNT_COLUMNS:
+        summary[col] = summary[col].astype("int64")
+
+    rivals = (
+        df.assign(move=move)[keys + ["move", *db.RIVAL_KINDS]]
+        .astype({kind: object for kind in db.RIVAL_KINDS})
+        .melt(id_vars=keys + ["move"], var_name="kind", value_name="rival")
+        .dropna(subset=["rival"])
+        .groupby(keys + ["move", "kind", "rival"], observed=True)
+        .size()
+        .reset_index(name="count")
+    )
+    return summary[keys + db.SUMMARY_COLUMNS], rivals[keys + db.RIVAL_COLUMNS]
+
+
+def _entry_of_rows(df, entries):
+    """履歴の各行が entries の何番目の選手のものか（どれにも当たらない行は -1）"""
+    entry = np.full(len(df), -1)
+    course = df["course_in"].to_numpy()
+    names = df["player_name"].to_numpy()
+    ids = df["player_id"]
+    for i, (name, course_in, player_id) in enumerate(entries):
+        if player_id is not None:
+            hit = (ids == player_id).fillna(False).to_numpy(dtype=bool) | (ids.isna().to_numpy() & (names == name))
+        else:
+            hit = ids.isna().to_numpy() & (names == name)
+        entry[(course == course_in) & hit & (entry < 0)] = i
+    return entry
+
+
+def load_entries(entries, since=None):
+    """
+    entries（(選手名, 進入コース, 登録番号 or None) のリスト）の集計をまとめて返す。
+    戻り値は (summary, rivals)。どちらも entry 列（entries での番号）つき
+    """
+    entries = list(entries)
+    if since:
+        rows = db.fetch_players_course(entries, since)
+        df = pd.DataFrame.from_records(rows, columns=["player_name", "player_id"] + db.PLAYER_COURSE_COLUMNS)
+        df = race_history.compact(df)
+        df["entry"] = _entry_of_rows(df, entries)
+        return summarize_race_df(df[df["entry"] >= 0], keys=["entry"])
+
+    # 期間指定と同じく、登録番号の行 + 登録番号のない行（名前）を1人分にする
+    keys = [
+        [(name, course_in)] if player_id is None else [(player_id, course_in), (name, course_in)]
+        for name, course_in, player_id in entries
+    ]
+    results = db.load_player_summaries([key for entry_keys in keys for key in entry_keys])
+    summaries = []
+    rivals = []
+    for i, entry_keys in enumerate(keys):
+        parts = [results[key] for key in entry_keys]
+        summaries += [(i, *row) for row in _merge_rows([summary_rows for summary_rows, _ in parts], 1)]
+        rivals += [(i, *row) for row in _merge_rows([rival_rows for _, rival_rows in parts], 3)]
+    return (
+        pd.DataFrame.from_records(summaries, columns=["entry"] + db.SUMMARY_COLUMNS),
+        pd.DataFrame.from_records(rivals, columns=["entry"] + db.RIVAL_COLUMNS),
+    )
+
+
+def _merge_rows(parts, key_len):
+    """
+    集計テーブルの行のリストを1つにする（先頭 key_len 列が同じ行は件数を足し、回数の多い順）。
+    ほとんどは片方が空なので、そのときはそのまま返す
+    """
+    parts = [rows for rows in parts if rows]
+    if len(parts) <= 1:
+        return parts[0] if parts else []
+    merged = {}
+    for rows in parts:
+        for row in rows:
+            key = row[:key_len]
+            if key in merged:
+                merged[key] = key + tuple(a + b for a, b in zip(merged[key][key_len:], row[key_len:]))
+            else:
+                merged[key] = row
+    return sorted(merged.values(), key=lambda row: row[key_len], reverse=True)
+
+
+def select_entry(summary, rivals, i):
+    """load_entries の結果から1人分（entry 列なし）を取り出す"""
+    return (
+        summary[summary["entry"] == i].drop(columns="entry"),
+        rivals[rivals["entry"] == i].drop(columns="entry"),
+    )
+
+
+def compare_entries(entries, summary):
+    """load_entries の集計から6人の比較表（COMPARE_COLUMNS）を作る"""
+    totals = summary.groupby("entry")[db.SUMMARY_COUNT_COLUMNS].sum()
+    # 回数が同じ動きは名前順（全期間・期間指定で読み込みの並びが違っても同じ動きになるように）
+    moves = summary[summary["move"] != ""].sort_values(["count", "move"], ascending=[False, True])
+    moves = moves.drop_duplicates("entry")
+    moves = moves.set_index("entry")
+
+    table = pd.DataFrame({
+        "枠": range(1, len(entries) + 1),
+        "選手": [name for name, _, _ in entries],
+        "コース": [course_in for _, course_in, _ in entries],
+    })
+    table = table.join(totals, how="left").fillna(0)
+    count = table["count"].where(table["count"] > 0)
+    table["出走"] = table["count"].astype("int64")
+    table["1着率"] = table["win"] / count
+    table["2連対率"] = (table["win"] + table["place2"]) / count
+    table["3連対率"] = (table["win"] + table["place2"] + table["place3"]) / count
+    table["最多の動き"] = moves["move"].reindex(table.index)
+    table["抜出"] = table["st_nuke"] / count
+    table["出遅"] = table["st_deoku"] / count
+    return table[COMPARE_COLUMNS]
+
+
+def movement_table(summary):
+    """1人分の集計から動きの表（MOVEMENT_LABELS の列・回数順。動きが空の行は除く）"""
+    movement = summary[(summary["count"] > 0) & (summary["move"] != "")]
+    movement = movement.sort_values("count", ascending=False)
+    return movement[list(MOVEMENT_LABELS)].rename(columns=MOVEMENT_LABELS)
+
+
+def rival_table(rivals, move):
+    """1人分の相手コースのうち、動き move の内訳（[相手の列名, 回数]）。内訳を出さない動きは None"""
+    kind = RIVAL_OF_MOVE.get(move)
+    if kind is None:
+        return None
+    counts = rivals[(rivals["move"] == move) & (rivals["kind"] == kind)][["rival", "count"]]
+    counts.columns = [RIVAL_LABELS[kind], "回数"]
+    return counts
+
+
+def supplement_table(summary, course_in):
+    """1人分の集計から補足項目の表（項目・回数・割合）。そのコースに項目がなければ None"""
+    items = SUPPLEMENT_ITEMS.get(course_in, [])
+    if not items:
+        return None
+    total = summary["count"].sum()
+    rows = []
+    for item in items:
+        if item in summary.columns:
+            count = summary[item].sum()
+            rows.append({"項目": FLAG_LABELS.get(item, item), "回数": count, "割合": f"{round(count / total * 100, 1)}%"})
+    return pd.DataFrame(rows, columns=["項目", "回数", "割合"])
+
+
+def st_table(summary):
+    """1人分の集計から ST評価の表（評価・回数・割合。0回の評価は除く）"""
+    count_df = pd.DataFrame({
+        "評価": list(ST_LABELS.values()),
+        "回数": [summary[col].sum() for col in ST_LABELS],
+    })
+    count_df = count_df[count_df["回数"] > 0].sort_values("回数", ascending=False)
+    total = count_df["回数"].sum()
+    count_df["割合"] = count_df["回数"].apply(
+        lambda x: f"{round(x / total * 100)}%"
+    )
+    return count_df
@@ -0,0 +1,53 @@
+"""
+次のレースの先読み
+
+レース N を入力している間に、レース N+1 の出走表（http_cache.db）と
+各選手の選手データ集計（db のキャッシュ）をバックグラウンドで温めておく。
+「次のレースへ」で切り替えたときは通信待ちなしでキャッシュから表示できる。
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+import racecard
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="prefetch")
+_pending = set()
+_done = set()  # 先読みが済んだレース（Streamlit の再実行のたびに読み直さない）
+_lock = threading.Lock()
+
+
+def _warm(date_str, venue_name, race_number):
+    try:
+        racers = racecard.load_racers(date_str, venue_name, race_number)
+        # 進入コースは枠なりと仮定して、6人分の集計をまとめて読んでおく
+        # （player_summary.load_entries と同じく、登録番号の集計と名前の集計の両方）
+        keys = []
+        for lane, r in enumerate(racers, start=1):
+            if r.get("reg_no") is not None:
+                keys.append((r["reg_no"], lane))
+            keys.append((r["name"], lane))
+        db.load_player_summaries(keys)
+    except Exception:
+        # 先読みの失敗は表示時に取り直すので握りつぶす（次の再実行でもう一度先読みする）
+        pass
+    else:
+        # 出走表が未公開のレースは、公開後にもう一度先読みする
+        if racers:
+            with _lock:
+                _done.add((date_str, venue_name, race_number))
+    finally:
+        with _lock:
+            _pending.discard((date_str, venue_name, race_number))
+
+
+def prefetch_race(date_str, venue_name, race_number):
+    """レースの先読みを予約する（同じレースが実行中か、先読み済みなら何もしない）"""
+    if not 1 <= race_number <= 12:
+        return
+    key = (date_str, venue_name, race_number)
+    with _lock:
+        if key in _pending or key in _done:
+            return
+        _pending.add(key)
+    _executor.submit(_warm, date_str, venue_name, race_number)
@@ -0,0 +1,129 @@
+"""
+レース履歴（race_data 形式の DataFrame）の省メモリ化と補足項目のビット演算
+
+compact() は race_data の行をカテゴリ型・小さい整数型の DataFrame にする（補足項目は flags の uint16 1列）。
+flags と名前つきの補足項目は encode_flags / decode_flags / has_flags で行き来する。
+
+    python race_history.py   # race_data 全件を読み、省メモリ化の前後のメモリ使用量（10万行あたり）を表示
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+import db
+
+CSV_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "boatrace_data.csv")
+
+# 値の種類が少ない文字列カラムはカテゴリ型にする
+CATEGORY_COLUMNS = ["date", "venue_name", "player_name", "move", "st_eval", "second_place", "lost_to"]
+
+# 補足項目（0/1）のカラム。compact() では flags（uint16 のビットマスク）1列にまとめる
+FLAG_COLUMNS = db.FLAG_COLUMNS
+
+# 着順は "1" / "2" / "3" / "着外" に正規化（1コース逃げは空）
+RANK_CATEGORIES = ["1", "2", "3", "着外"]
+
+
+def normalize_rank(values):
+    """1 / 1.0 / " 1 " などの表記ゆれを "1" にそろえたカテゴリ列を返す"""
+    text = values.astype("string").str.strip().str.replace(r"\.0$", "", regex=True)
+    return pd.Categorical(text, categories=RANK_CATEGORIES)
+
+
+def encode_flags(df):
+    """名前つきの補足項目カラム（ない項目は 0）を flags のビットマスク（uint16）にまとめる"""
+    flags = np.zeros(len(df), dtype="uint16")
+    for flag, bit in db.FLAG_BITS.items():
+        if flag in df.columns:
+            on = pd.to_numeric(df[flag], errors="coerce").fillna(0).to_numpy() != 0
+            flags |= np.where(on, bit, 0).astype("uint16")
+    return flags
+
+
+def decode_flags(flags, names=FLAG_COLUMNS):
+    """flags の列を補足項目ごとの 0/1（uint8）の DataFrame に展開する（全項目を1回のビット演算で）"""
+    values = pd.to_numeric(flags, errors="coerce").fillna(0).to_numpy(dtype="uint16")
+    shifts = np.array([db.FLAG_BITS[name].bit_length() - 1 for name in names], dtype="uint16")
+    bits = (values[:, None] >> shifts) & 1
+    index = flags.index if isinstance(flags, pd.Series) else None
+    return pd.DataFrame(bits.astype("uint8"), columns=list(names), index=index)
+
+
+def has_flags(flags, names):
+    """補足項目 names がすべて当てはまる行の真偽値（"流れ AND キャビ" → has_flags(df["flags"], ["flow", "cabi"])）"""
+    mask = db.flag_mask(names)
+    return (pd.to_numeric(flags, errors="coerce").fillna(0).astype("int64") & mask) == mask
+
+
+def compact(df):
+    """
+    race_data 形式の DataFrame を省メモリな dtype に変換する（元の df を書き換える）。
+    名前つきの補足項目カラム（CSV など）は flags にまとめる
+    """
+    named = [col for col in FLAG_COLUMNS if col in df.columns]
+    if "flags" not in df.columns:
+        df["flags"] = encode_flags(df)
+    if named:
+        df.drop(columns=named, inplace=True)
+    df["flags"] = pd.to_numeric(df["flags"], errors="coerce").fillna(0).astype("uint16")
+    for col in ("course_in", "race_number"):
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce").fillna(0).astype("uint8")
+    if "rank" in df.columns:
+        df["rank"] = normalize_rank(df["rank"])
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns:
+            # 2着・負けたコースは数値と "記録なし" などが混在するので文字列にそろえる
+            if col in ("second_place", "lost_to"):
+                df[col] = df[col].astype("string").str.replace(r"\.0$", "", regex=True)
+            df[col] = df[col].astype("category")
+    if "id" in df.columns:
+        df["id"] = df["id"].astype("int32")
+    if "player_id" in df.columns:
+        df["player_id"] = pd.to_numeric(df["player_id"], errors="coerce").astype("Int32")
+    return df
+
+
+def read_export(path):
+    """
+    export_to_csv.py の CSV を読む。差分の追記で同じ id が複数行あるときは最後の行を使い、
+    削除の行（deleted = 1）を除く
+    """
+    df = pd.read_csv(path)
+    if "deleted" in df.columns:
+        df = df.drop_duplicates("id", keep="last")
+        df = df[df["deleted"] != 1].drop(columns="deleted").reset_index(drop=True)
+    return df
+
+
+def read_history():
+    """race_data 全件（DBがなければ export_to_csv.py の CSV）を読んで省メモリな形で返す"""
+    if os.path.exists(db.DB_FILE):
+        df = pd.read_sql_query(db.SELECT_RACE_STORED_SQL, db.get_connection())
+    elif os.path.exists(CSV_FILE):
+        # CSV の補足項目は名前つきのカラム（足りない項目は 0 として扱う）
+        df = read_export(CSV_FILE)
+    else:
+        df = pd.DataFrame(columns=db.RACE_STORED_COLUMNS)
+    return compact(df)
+
+
+def memory_report(df):
+    """DataFrame のメモリ使用量（合計・10万行あたり）をバイトで返す"""
+    total = int(df.memory_usage(deep=True).sum())
+    rows = len(df)
+    per_100k = int(total / rows * 100_000) if rows else 0
+    return {"rows": rows, "bytes": total, "bytes_per_100k_rows": per_100k}
+
+
+if __name__ == "__main__":
+    raw = pd.read_sql_query(db.SELECT_RACE_DATA_SQL, db.get_connection())
+    history = read_history()
+
+    for label, frame in (("読み込んだまま", raw), ("省メモリ型", history)):
+        report = memory_report(frame)
+        print(
+            f"{label}: {report['rows']}行 {report['bytes'] / 1024 / 1024:.2f}MB "
+            f"（10万行あたり {report['bytes_per_100k_rows'] / 1024 / 1024:.2f}MB）"
+        )
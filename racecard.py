@@ -0,0 +1,309 @@
+"""
+出走表（boatrace.jp の racelist ページ）の取得
+
+data_rec.py・pages・save_racecard.py で共通に使う。
+取得したページは http_cache.db に (hd, jcd, rno) をキーにして保存し、
+ETag / Last-Modified による条件付きリクエストで更新を確認する。
+再起動後や別ページ・別プロセスからでも、取得済みの出走表は取り直さない。
+"""
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+import zlib
+import requests
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup
+from urllib.parse import urlparse
+
+import db
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 会場名 → 場コード対応（必要に応じて追加）
+VENUE_CODES = {
+    "桐生": "01", "戸田": "02", "江戸川": "03", "平和島": "04", "多摩川": "05",
+    "浜名湖": "06", "蒲郡": "07", "常滑": "08", "津": "09", "三国": "10",
+    "びわこ": "11", "住之江": "12", "尼崎": "13", "鳴門": "14", "丸亀": "15",
+    "児島": "16", "宮島": "17", "徳山": "18", "下関": "19", "若松": "20",
+    "芦屋": "21", "福岡": "22", "唐津": "23", "大村": "24"
+}
+
+RACELIST_URL = "https://www.boatrace.jp/owpc/pc/race/racelist?rno={rno}&jcd={jcd}&hd={hd}"
+TOBAN_RE = re.compile(r"toban=(\d+)")
+
+# 取得の設定
+MAX_WORKERS = 8          # 同時に走らせる取得数（コネクションプールの大きさ）
+MAX_PER_HOST = 6         # 1ホストに同時に出すリクエストの上限
+REQUESTS_PER_SECOND = 10 # 1ホストへの平均のリクエスト数（毎秒）
+BURST = 10               # 間をあけずに続けて出せるリクエスト数（トークンバケットの大きさ）
+REQUEST_TIMEOUT = 10     # 1リクエストのタイムアウト（秒）
+MAX_RETRIES = 3          # 通信エラー・5xx のときの再試行回数
+BACKOFF_SECONDS = 1.0    # 再試行の待ち時間（1, 2, 4 秒…と倍々に伸ばす）
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# キャッシュの設定
+CACHE_FILE = os.path.join(BASE_DIR, "http_cache.db")
+CACHE_MAX_BYTES = 50 * 1024 * 1024   # これを超えたら古く使われたものから消す
+FRESH_SECONDS = 60 * 60              # この間は確認なしでキャッシュを使う
+MISSING_FRESH_SECONDS = 5 * 60       # 出走表が未公開だったページの再確認間隔
+TOUCH_SECONDS = 60 * 60              # 最後に使った時刻（LRU 用）は、これより古いときだけ書き直す
+
+
+class RateLimiter:
+    """
+    ホストごとのトークンバケット。毎秒 rate 個たまり、最大 burst 個まで続けて出せる。
+    トークンがなければ順番に待つ（先に待ち始めたリクエストから出る）
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}  # host → (残りトークン, 最後に数えた時刻)
+        self._lock = threading.Lock()
+
+    def wait(self, host):
+        with self._lock:
+            now = time.monotonic()
+            tokens, last = self._buckets.get(host, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate) - 1
+            self._buckets[host] = (tokens, now)
+        if tokens < 0:
+            time.sleep(-tokens / self.rate)
+
+
+_limiter = RateLimiter(REQUESTS_PER_SECOND, BURST)
+_host_slots = {}
+_host_slots_lock = threading.Lock()
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """keep-alive で接続を使い回すセッション（プロセスで1つ）"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def _host_slot(host):
+    """ホストごとの同時リクエスト数を MAX_PER_HOST に抑えるセマフォ"""
+    with _host_slots_lock:
+        if host not in _host_slots:
+            _host_slots[host] = threading.BoundedSemaphore(MAX_PER_HOST)
+        return _host_slots[host]
+
+
+def fetch(url, headers=None):
+    """レート制限・同時数の制限・タイムアウト・再試行つきで GET する（304 もそのまま返す）"""
+    host = urlparse(url).netloc
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            # 再試行の待ち時間はセマフォを持たずに待つ
+            with _host_slot(host):
+                _limiter.wait(host)
+                response = get_session().get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+            if response.status_code in RETRY_STATUS:
+                raise requests.exceptions.HTTPError(f"{response.status_code}", response=response)
+            response.raise_for_status()
+            return response
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.HTTPError) as e:
+            status = e.response.status_code if e.response is not None else None
+            if attempt == MAX_RETRIES or (status is not None and status not in RETRY_STATUS):
+                raise
+            time.sleep(BACKOFF_SECONDS * 2 ** attempt)
+
+
+def parse_racecard(html):
+    """racelist ページから [{"lane", "name", "reg_no"}, ...] を取り出す。見つからなければ None"""
+    soup = BeautifulSoup(html, "html.parser")
+
+    name_tags = soup.select("div.is-fs18.is-fBold a")
+    if not name_tags:
+        return None
+
+    racers = []
+    for i, tag in enumerate(name_tags[:6]):
+        # 選手名のリンク先（.../racersearch/profile?toban=4444）から登録番号を取る
+        toban = TOBAN_RE.search(tag.get("href", ""))
+        racers.append({
+            "lane": i + 1,
+            "name": tag.text.strip(),
+            "reg_no": int(toban.group(1)) if toban else None
+        })
+
+    return racers if racers else None
+
+
+# --- ディスクキャッシュ ---
+
+CREATE_CACHE_SQL = """
+CREATE TABLE IF NOT EXISTS racelist_cache (
+    hd TEXT NOT NULL,
+    jcd TEXT NOT NULL,
+    rno INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    body BLOB,
+    racers TEXT,
+    size INTEGER NOT NULL DEFAULT 0,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    PRIMARY KEY (hd, jcd, rno)
+)
+"""
+
+_cache_conn = None
+_cache_lock = threading.RLock()
+
+
+def _get_cache():
+    global _cache_conn
+    with _cache_lock:
+        if _cache_conn is None:
+            conn = sqlite3.connect(CACHE_FILE, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute(CREATE_CACHE_SQL)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_racelist_cache_accessed ON racelist_cache (accessed_at)")
+            _cache_conn = conn
+        return _cache_conn
+
+
+def _cache_get(key):
+    with _cache_lock:
+        return _get_cache().execute(
+            """SELECT etag, last_modified, body, racers, fetched_at, accessed_at FROM racelist_cache
+            WHERE hd = ? AND jcd = ? AND rno = ?""",
+            key
+        ).fetchone()
+
+
+def _cache_touch(key, accessed_at, revalidated=False):
+    """
+    使った時刻を記録する。キャッシュから返すたびに書き込まないよう、
+    前回の記録が TOUCH_SECONDS より新しければ何もしない（再確認したときは常に書く）
+    """
+    now = time.time()
+    if not revalidated and now - accessed_at < TOUCH_SECONDS:
+        return
+    with _cache_lock:
+        if revalidated:
+            _get_cache().execute(
+                "UPDATE racelist_cache SET fetched_at = ?, accessed_at = ? WHERE hd = ? AND jcd = ? AND rno = ?",
+                (now, now, *key)
+            )
+        else:
+            _get_cache().execute(
+                "UPDATE racelist_cache SET accessed_at = ? WHERE hd = ? AND jcd = ? AND rno = ?",
+                (now, *key)
+            )
+
+
+def _cache_put(key, response, racers):
+    body = zlib.compress(response.content)
+    now = time.time()
+    with _cache_lock:
+        conn = _get_cache()
+        conn.execute(
+            """INSERT OR REPLACE INTO racelist_cache
+            (hd, jcd, rno, etag, last_modified, body, racers, size, fetched_at, accessed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            (
+                *key,
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+                body,
+                json.dumps(racers, ensure_ascii=False) if racers else None,
+                len(body),
+                now,
+                now,
+            )
+        )
+        _cache_evict(conn)
+
+
+def _cache_evict(conn):
+    """合計サイズが上限を超えていたら、最後に使われたのが古い順に消す（LRU）"""
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM racelist_cache").fetchone()[0]
+    if total <= CACHE_MAX_BYTES:
+        return
+    rows = conn.execute("SELECT hd, jcd, rno, size FROM racelist_cache ORDER BY accessed_at").fetchall()
+    conn.execute("BEGIN")
+    for hd, jcd, rno, size in rows:
+        if total <= CACHE_MAX_BYTES:
+            break
+        conn.execute("DELETE FROM racelist_cache WHERE hd = ? AND jcd = ? AND rno = ?", (hd, jcd, rno))
+        total -= size
+    conn.execute("COMMIT")
+
+
+def get_racecard(date_str, venue_code, race_number):
+    """
+    出走表を返す（[{"lane", "name", "reg_no"}, ...] / 未公開なら None。reg_no は分からなければ None）。
+    キャッシュが新しければ通信なし、古ければ条件付きリクエストで確認する。
+    通信できないときは古いキャッシュでも返す（なければ例外をそのまま投げる）。
+    """
+    key = (date_str, venue_code, int(race_number))
+    cached = _cache_get(key)
+
+    if cached is not None:
+        etag, last_modified, body, racers_json, fetched_at, accessed_at = cached
+        racers = json.loads(racers_json) if racers_json else None
+        fresh_for = FRESH_SECONDS if racers else MISSING_FRESH_SECONDS
+        if time.time() - fetched_at < fresh_for:
+            _cache_touch(key, accessed_at)
+            return racers
+
+    headers = {}
+    if cached is not None:
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+    url = RACELIST_URL.format(rno=race_number, jcd=venue_code, hd=date_str)
+    try:
+        response = fetch(url, headers=headers)
+    except requests.exceptions.RequestException:
+        if cached is not None and racers:
+            _cache_touch(key, accessed_at)
+            return racers
+        raise
+
+    if response.status_code == 304 and cached is not None:
+        _cache_touch(key, accessed_at, revalidated=True)
+        return racers
+
+    racers = parse_racecard(response.content)
+    _cache_put(key, response, racers)
+    return racers
+
+
+def load_racers(date_str, venue_name, race_number):
+    """
+    [{"lane", "name", "reg_no"}, ...] を返す。ローカル保存 → キャッシュ → オンラインの順に探す。
+    見つからなければ空リスト。通信エラーは requests の例外のまま投げる。
+    """
+    racers = db.load_racecard(date_str, venue_name, race_number)
+    if racers:
+        return racers
+    return get_racecard(date_str, VENUE_CODES[venue_name], race_number) or []
+
+
+def load_racer_names(date_str, venue_name, race_number):
+    """選手名のリストを返す（探す順番・例外は load_racers と同じ）"""
+    return [r["name"] for r in load_racers(date_str, venue_name, race_number)]
+
+
+def load_player_ids(date_str, venue_name, race_number):
+    """{選手名: 登録番号} を返す（登録番号が分からない選手は None）"""
+    return {r["name"]: r.get("reg_no") for r in load_racers(date_str, venue_name, race_number)}
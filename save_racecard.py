@@ -1,65 +1,101 @@
-import os
-import json
-import requests
-from bs4 import BeautifulSoup
-from datetime import datetime
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# 出走表の保存先ディレクトリ
-SAVE_DIR = "local_racecards"
+import db
+from racecard import VENUE_CODES, MAX_WORKERS, get_racecard
 
-# 必要ならフォルダを作成
-os.makedirs(SAVE_DIR, exist_ok=True)
 
 def fetch_racecard(date: str, venue: str, race_num: int):
-    url = f"https://www.boatrace.jp/owpc/pc/race/racelist?rno={race_num}&jcd={VENUE_CODES[venue]}&hd={date}"
-    response = requests.get(url)
-    soup = BeautifulSoup(response.content, "html.parser")
+    # 取得済みのページは http_cache.db から返る（通信・解析なし）
+    return get_racecard(date, VENUE_CODES[venue], race_num)
 
-    name_tags = soup.select("div.is-fs18.is-fBold a")
-    if not name_tags:
-        return None
 
-    racers = []
-    for i, tag in enumerate(name_tags[:6]):
-        racers.append({
-            "lane": i + 1,
-            "name": tag.text.strip()
-        })
+def save_racecards(date: str, venues, max_workers=MAX_WORKERS):
+    """
+    指定日・複数会場の出走表をまとめて並列取得して racecards テーブルに保存する。
+    まず各会場の1Rを取り、開催している会場だけ2R〜12Rを取りにいく。
+    1Rの取得に失敗した（未公開とは限らない）会場は、2回目に1Rから取り直す。
+    戻り値は件数の集計（saved / missing / failed）。
+    """
+    started = time.monotonic()
+    summary = {"saved": 0, "missing": 0, "failed": 0}
+
+    def run(tasks, retry_later=False):
+        """tasks を取得して保存し、(出走表があった会場, 取得に失敗した会場) を返す"""
+        found = []
+        failed = []
+        cards = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(fetch_racecard, date, venue, race_num): (venue, race_num)
+                for venue, race_num in tasks
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                venue, race_num = futures[future]
+                try:
+                    data = future.result()
+                except Exception as e:
+                    # 通信エラーだけでなく解析・キャッシュのエラーでも、ほかのレースの取得分は保存する
+                    failed.append(venue)
+                    if retry_later:
+                        print(f"[{done}/{len(tasks)}] {venue}{race_num}R 取得失敗（あとで取り直します）: {e}")
+                    else:
+                        summary["failed"] += 1
+                        print(f"[{done}/{len(tasks)}] {venue}{race_num}R 取得失敗: {e}")
+                    continue
+                if data:
+                    cards.append((date, venue, race_num, data))
+                    found.append(venue)
+                    print(f"[{done}/{len(tasks)}] {venue}{race_num}R 取得完了")
+                else:
+                    summary["missing"] += 1
+        # 取得できた分をまとめて1トランザクションで保存
+        db.save_racecards(cards)
+        summary["saved"] += len(cards)
+        return found, failed
 
-    return racers if racers else None
+    open_venues, failed_venues = run([(venue, 1) for venue in venues], retry_later=True)
+    found, _ = run(
+        [(venue, race_num) for venue in open_venues for race_num in range(2, 13)]
+        + [(venue, race_num) for venue in failed_venues for race_num in range(1, 13)]
+    )
+    open_count = len(set(open_venues) | set(found))
 
-# 会場名 → 場コード対応（必要に応じて追加）
-VENUE_CODES = {
-    "桐生": "01", "戸田": "02", "江戸川": "03", "平和島": "04", "多摩川": "05",
-    "浜名湖": "06", "蒲郡": "07", "常滑": "08", "津": "09", "三国": "10",
-    "びわこ": "11", "住之江": "12", "尼崎": "13", "鳴門": "14", "丸亀": "15",
-    "児島": "16", "宮島": "17", "徳山": "18", "下関": "19", "若松": "20",
-    "芦屋": "21", "福岡": "22", "唐津": "23", "大村": "24"
-}
+    elapsed = time.monotonic() - started
+    print(
+        f"完了: 保存 {summary['saved']}件 / 出走表なし {summary['missing']}件 / "
+        f"失敗 {summary['failed']}件（開催 {open_count}場, {elapsed:.1f}秒）"
+    )
+    return summary
 
 def save_day_racecards(date: str, venue: str):
     """
     指定日・会場の1〜12Rの出走表を保存
     """
-    for race_num in range(1, 13):
-        data = fetch_racecard(date, venue, race_num)
-        if data:
-            filename = f"{date}_{venue}_{race_num:02}.json"
-            path = os.path.join(SAVE_DIR, filename)
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            print(f"{filename} 保存完了")
-        else:
-            print(f"{race_num}R の出走表が見つかりません")
+    return save_racecards(date, [venue])
 
 if __name__ == "__main__":
+    # python save_racecard.py --import-json [フォルダ] で以前のJSONファイルを取り込む
+    if len(sys.argv) > 1 and sys.argv[1] == "--import-json":
+        directory = sys.argv[2] if len(sys.argv) > 2 else db.RACECARD_JSON_DIR
+        print(f"{db.import_racecard_json(directory)}件の出走表を取り込みました")
+        sys.exit()
+
     input_date = input("日付 (例: 20250528): ")
-    input_venues = input("場名（カンマ区切り可 例: 桐生,蒲郡）: ")
+    input_venues = input("場名（カンマ区切り可 例: 桐生,蒲郡 / 空欄で全場）: ")
 
-    venues_list = [v.strip() for v in input_venues.split(",")]
+    if input_venues.strip():
+        venues_list = [v.strip() for v in input_venues.split(",")]
+    else:
+        venues_list = list(VENUE_CODES.keys())
 
+    valid_venues = []
     for venue in venues_list:
         if venue not in VENUE_CODES:
             print(f"対応していない場名です: {venue}")
         else:
-            save_day_racecards(input_date, venue)
\ No newline at end of file
+            valid_venues.append(venue)
+
+    if valid_venues:
+        save_racecards(input_date, valid_venues)
@@ -0,0 +1,291 @@
+"""
+狙い目リスト（manual_list.json）の読み書きと照合用インデックス
+
+追加・編集・削除は manual_list.log.jsonl に1行ずつ追記するだけにして、
+ファイル全体の書き直しは追記が COMPACT_EVERY 件たまったときの圧縮でまとめて行う。
+圧縮は一時ファイルに書いてから os.replace で入れ替えるので、途中で落ちても
+manual_list.json が壊れることはない。書き込みはロックファイルで1つずつにする。
+
+各項目には id を振っておき、ログの操作は id 指定で何度適用しても同じ結果になる
+（圧縮の入れ替え後・ログ削除前に落ちても、次回の読み込みで正しく復元できる）。
+
+読み込んだリストは (正規化した選手名, コース) をキーにした辞書にして持っておき、
+manual_list.json・ログの更新時刻・サイズが変わったときだけ作り直す。
+"""
+import os
+import json
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+
+import db
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LIST_FILE = os.path.join(BASE_DIR, "manual_list.json")
+LOG_FILE = os.path.join(BASE_DIR, "manual_list.log.jsonl")
+LOCK_FILE = LIST_FILE + ".lock"
+
+COMPACT_EVERY = 50        # ログがこの件数を超えたら manual_list.json にまとめる
+LOCK_TIMEOUT = 10         # ロック待ちの上限（秒）
+LOCK_STALE_SECONDS = 60   # これより古いロックファイルは落ちたプロセスの残りとみなす
+
+FIELDS = ("name", "lane", "note", "mark", "reg_no")
+
+_cache = {"signature": None, "entries": [], "index": {}, "log_count": 0}
+_lock = threading.Lock()
+
+
+# 選手名の表記の扱いは db と共通（"寺田　　　祥" の形にそろえる・空白の違いを無視する）
+join_name = db.join_name
+split_name = db.split_name
+normalize_name = db.normalize_name
+
+
+# --- ロック ---
+
+@contextmanager
+def file_lock(timeout=LOCK_TIMEOUT):
+    """ロックファイル（O_CREAT | O_EXCL）でプロセス・セッションをまたいで書き込みを1つにする"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fd = os.open(LOCK_FILE, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(LOCK_FILE) > LOCK_STALE_SECONDS:
+                    os.remove(LOCK_FILE)
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"{LOCK_FILE} のロックを取得できません")
+            time.sleep(0.05)
+    try:
+        os.write(fd, str(os.getpid()).encode())
+        os.close(fd)
+        yield
+    finally:
+        try:
+            os.remove(LOCK_FILE)
+        except FileNotFoundError:
+            pass
+
+
+# --- 読み込み ---
+
+def _signature():
+    signature = []
+    for path in (LIST_FILE, LOG_FILE):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            signature.append(None)
+            continue
+        signature.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+def _read_snapshot():
+    try:
+        with open(LIST_FILE, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        return {}
+    state = {}
+    for i, m in enumerate(entries):
+        # id のない古い形式の項目は位置と内容から決まる id を振る（次の圧縮で書き込まれる）
+        key = f"{i}:" + json.dumps(m, ensure_ascii=False, sort_keys=True)
+        entry_id = m.get("id") or uuid.uuid5(uuid.NAMESPACE_URL, key).hex
+        state[entry_id] = {**m, "id": entry_id}
+    return state
+
+
+def _read_log():
+    """ログの操作一覧。書き込み途中で落ちた最後の1行（JSONとして読めない行）は無視する"""
+    ops = []
+    try:
+        with open(LOG_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    ops.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return ops
+
+
+def _apply(state, op):
+    """操作を1件適用する（同じ操作を何度適用しても結果は同じ）"""
+    if op["op"] in ("add", "update"):
+        entry = {k: op["entry"][k] for k in FIELDS if k in op["entry"]}
+        if op["op"] == "update":
+            if op["id"] not in state:
+                return  # 別のセッションで削除済み
+            entry = {**state[op["id"]], **entry}
+        state[op["id"]] = {**entry, "id": op["id"]}
+    elif op["op"] == "delete":
+        state.pop(op["id"], None)
+
+
+def _read_state():
+    state = _read_snapshot()
+    ops = _read_log()
+    for op in ops:
+        _apply(state, op)
+    return state, len(ops)
+
+
+def _build_index(entries):
+    """
+    (登録番号, コース) と (正規化した選手名, コース) の両方から引ける辞書。
+    キーの型が違う（int / str）ので1つの辞書に入れても衝突しない
+    """
+    index = {}
+    for m in entries:
+        # 同じ選手・コースが重複している場合は先に登録したものを使う
+        if m.get("reg_no"):
+            index.setdefault((int(m["reg_no"]), int(m["lane"])), m)
+        index.setdefault((normalize_name(m["name"]), int(m["lane"])), m)
+    return index
+
+
+def _lookup(index, name, lane, reg_no=None):
+    if reg_no:
+        match = index.get((int(reg_no), int(lane)))
+        if match:
+            return match
+    return index.get((normalize_name(name), int(lane)))
+
+
+def _load():
+    signature = _signature()
+    with _lock:
+        if _cache["signature"] != signature:
+            state, log_count = _read_state()
+            entries = list(state.values())
+            _cache["entries"] = entries
+            _cache["index"] = _build_index(entries)
+            _cache["log_count"] = log_count
+            _cache["signature"] = signature
+        return _cache
+
+
+def load_list():
+    """リストのコピーを返す（画面側で書き換えてもキャッシュに影響しない）"""
+    return [dict(m) for m in _load()["entries"]]
+
+
+def find(name, lane, reg_no=None):
+    """出走表の選手（登録番号があれば登録番号、なければ名前）・コースに一致するリストの項目（なければ None）"""
+    return _lookup(_load()["index"], name, lane, reg_no)
+
+
+def build_day_view(racecards):
+    """
+    1日分の出走表（db.load_racecards_by_date の戻り値）とリストを突き合わせて
+    {venue: {race_number: [{"lane", "name", "note", "mark", "color"}, ...]}} を返す
+    """
+    index = _load()["index"]
+    venue_races = {}
+    for (venue, race), racers in racecards.items():
+        for r in racers:
+            match = _lookup(index, r["name"], r["lane"], r.get("reg_no"))
+            if match:
+                color = "green" if match["mark"] == "◯" else "red"
+                text = {
+                    "lane": r["lane"],
+                    "name": r["name"],
+                    "note": match["note"],
+                    "mark": match["mark"],
+                    "color": color
+                }
+                venue_races.setdefault(venue, {}).setdefault(int(race), []).append(text)
+    return venue_races
+
+
+# --- 書き込み ---
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def compact():
+    """ログを manual_list.json に反映して空にする"""
+    with file_lock():
+        _compact_locked()
+
+
+def _compact_locked():
+    state, _ = _read_state()
+    _write_atomic(LIST_FILE, list(state.values()))
+    # ここで落ちてもログの操作は再適用して問題ない
+    try:
+        os.remove(LOG_FILE)
+    except FileNotFoundError:
+        pass
+
+
+def _count_log_lines():
+    try:
+        with open(LOG_FILE, "rb") as f:
+            return sum(1 for line in f if line.strip())
+    except FileNotFoundError:
+        return 0
+
+
+def _append(op):
+    with file_lock():
+        with open(LOG_FILE, "ab") as f:
+            # 前回途中で落ちた行があれば、その行とつながらないよう改行してから書く
+            if f.tell() > 0:
+                with open(LOG_FILE, "rb") as r:
+                    r.seek(-1, os.SEEK_END)
+                    if r.read(1) != b"\n":
+                        f.write(b"\n")
+            f.write((json.dumps(op, ensure_ascii=False) + "\n").encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        # リスト全体は読み直さず、ログの行数だけ数える（圧縮するので多くても COMPACT_EVERY 行程度）。
+        # ほかのプロセスの追記も含めて数えられる
+        if _count_log_lines() > COMPACT_EVERY:
+            _compact_locked()
+
+
+def add_entry(name, lane, note, mark):
+    """項目を追加して id を返す（登録番号は選手マスタから引けたときだけ入る）"""
+    entry_id = uuid.uuid4().hex
+    entry = {"name": name, "lane": lane, "note": note, "mark": mark, "reg_no": db.resolve_reg_no(name)}
+    _append({"op": "add", "id": entry_id, "entry": entry})
+    return entry_id
+
+
+def update_entry(entry_id, **fields):
+    """項目の name / lane / note / mark を書き換える（name を変えたら登録番号も引き直す）"""
+    if "name" in fields:
+        fields["reg_no"] = db.resolve_reg_no(fields["name"])
+    _append({"op": "update", "id": entry_id, "entry": {k: v for k, v in fields.items() if k in FIELDS}})
+
+
+def backfill_reg_no():
+    """登録番号のない項目に選手マスタから登録番号を入れる。埋めた件数を返す"""
+    count = 0
+    for m in load_list():
+        if m.get("reg_no"):
+            continue
+        reg_no = db.resolve_reg_no(m["name"])
+        if reg_no:
+            _append({"op": "update", "id": m["id"], "entry": {"reg_no": reg_no}})
+            count += 1
+    return count
+
+
+def delete_entry(entry_id):
+    _append({"op": "delete", "id": entry_id})